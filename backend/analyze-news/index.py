@@ -1,13 +1,671 @@
+import hashlib
+import heapq
 import json
 import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+
+LLM_MODEL = 'llama-3.1-70b-versatile'
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '8'))
+GROQ_RPM = int(os.environ.get('GROQ_RPM', '30'))
+GROQ_TPM = int(os.environ.get('GROQ_TPM', '0'))
+ANALYSIS_MODE = os.environ.get('ANALYSIS_MODE', 'split')
+ANALYSIS_BATCH = int(os.environ.get('ANALYSIS_BATCH', '5'))
+LLM_CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', '5000'))
+LLM_JSON_MODE = os.environ.get('LLM_JSON_MODE', '1') == '1'
+PROMPT_VERSION = '2'
+ANALYSIS_MODEL_VERSION = f'{LLM_MODEL}/v{PROMPT_VERSION}'
+PRECLASSIFY = os.environ.get('PRECLASSIFY', '1') == '1'
+PRECLASSIFY_THRESHOLD = float(os.environ.get('PRECLASSIFY_THRESHOLD', '0.8'))
+PRECLASSIFY_KEYWORDS = 5
+LOCAL_MODEL_VERSION = 'local-lexicon/v1'
+
+STOPWORDS = frozenset('''
+the and for that with from this have has had was were are been will would could should their they them there
+what when where which who whom into over after before about than then also just more most some such only other
+said says new its his her our your not but all can may one two out year years time today week
+это как что для его она они при над под без или так уже еще ещё был была были будет также после которые который
+'''.split())
+
+POLITICAL_TERMS = frozenset('''
+election elections vote voters voting ballot referendum parliament parliamentary senate congress duma bundestag
+government minister ministers president presidential prime premier chancellor cabinet kremlin regime
+opposition party parties coalition campaign candidate democracy democratic authoritarian dictator
+law laws legislation bill court courts judge ruling constitution constitutional sanctions sanction
+protest protests protesters rally crackdown arrest arrested detained prisoner dissident censorship
+diplomat diplomatic embassy treaty summit nato military army troops war invasion ceasefire policy
+corruption propaganda journalist journalists media press freedom rights activist activists
+выборы голосование парламент правительство министр президент премьер оппозиция партия закон суд
+санкции протест протесты митинг задержан арест цензура журналист свобода война армия политика
+'''.split())
+
+OFF_TOPIC_TERMS = frozenset('''
+football soccer basketball tennis hockey league match goal goals score scored championship tournament
+olympic olympics athlete coach playoff fans stadium weather forecast rain snow temperature sunny storm
+recipe recipes cooking restaurant celebrity actress actor movie film album singer concert fashion
+iphone smartphone gadget game gaming videogame review trailer horoscope lottery
+футбол хоккей матч чемпионат турнир погода прогноз рецепт фильм сериал концерт
+'''.split())
+
+POSITIVE_TERMS = frozenset('''
+agreement agree peace progress growth improve improved improvement success successful win support
+welcome welcomed praise praised reform reforms release released cooperation stable recovery boost
+соглашение мир рост успех поддержка реформа сотрудничество
+'''.split())
+
+NEGATIVE_TERMS = frozenset('''
+crisis attack attacks killed death deaths war conflict violence crackdown arrest arrested threat threats
+collapse decline sanctions condemn condemned accuse accused scandal corruption fraud protest protests
+кризис атака погибли смерть война конфликт насилие угроза скандал коррупция
+'''.split())
+
+MANIPULATION_MARKERS = frozenset('''
+shocking shock unbelievable outrageous exposed secret secretly bombshell scandalous truth hidden
+everyone nobody always never must urgent destroy destroyed traitor traitors enemy enemies
+шок сенсация разоблачение предатель враг позор
+'''.split())
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_HEALTHCHECK_IDLE = int(os.environ.get('DB_HEALTHCHECK_IDLE', '30'))
+TRACE_DEBUG = os.environ.get('TRACE_DEBUG', '0') == '1'
+HISTORY_HOURLY_RETENTION_DAYS = int(os.environ.get('HISTORY_HOURLY_RETENTION_DAYS', '7'))
+HISTORY_DAILY_RETENTION_DAYS = int(os.environ.get('HISTORY_DAILY_RETENTION_DAYS', '180'))
+HISTORY_COMPACT_INTERVAL = 3600
+KEYWORD_HOURLY_RETENTION_DAYS = int(os.environ.get('KEYWORD_HOURLY_RETENTION_DAYS', '7'))
+KEYWORD_DAILY_RETENTION_DAYS = int(os.environ.get('KEYWORD_DAILY_RETENTION_DAYS', '180'))
+KEYWORD_RISING_MIN_COUNT = int(os.environ.get('KEYWORD_RISING_MIN_COUNT', '3'))
+NEWS_PARTITIONS_AHEAD = int(os.environ.get('NEWS_PARTITIONS_AHEAD', '3'))
+NEWS_RETENTION_MONTHS = int(os.environ.get('NEWS_RETENTION_MONTHS', '0'))
+NEWS_RETENTION_ACTION = os.environ.get('NEWS_RETENTION_ACTION', 'detach')
+ANALYSIS_CLAIM_LIMIT = int(os.environ.get('ANALYSIS_CLAIM_LIMIT', '16'))
+ANALYSIS_TIME_BUDGET = float(os.environ.get('ANALYSIS_TIME_BUDGET', '25'))
+ANALYSIS_SAFETY_MARGIN = float(os.environ.get('ANALYSIS_SAFETY_MARGIN', '3'))
+ANALYSIS_BATCH_ESTIMATE = float(os.environ.get('ANALYSIS_BATCH_ESTIMATE', '5'))
+ANALYSIS_LEASE_SECONDS = int(os.environ.get('ANALYSIS_LEASE_SECONDS', '300'))
+ANALYSIS_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', '3'))
+
+_module_loaded_at = time.perf_counter()
+_invocations = 0
+_history_compacted_at = 0.0
+
+_db_pool = None
+_db_pool_url = None
+_db_last_used = {}
+_groq_client = None
+_groq_client_key = None
+_resources_lock = threading.Lock()
+
+
+class Trace:
+    """Метрики одного вызова: спаны по стадиям (число, сумма и максимум времени), счётчики и токены LLM"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, invocation=None, debug=TRACE_DEBUG):
+        with self.lock:
+            self.invocation = invocation
+            self.debug = debug
+            self.started = time.perf_counter()
+            self.spans = {}
+            self.counters = {}
+            self.tokens = {'prompt': 0, 'completion': 0}
+
+    @contextmanager
+    def span(self, name):
+        """Замер стадии; исключение внутри считается в счётчике <name>.errors"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incr(f'{name}.errors')
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self.lock:
+            span = self.spans.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            span['count'] += 1
+            span['total_ms'] += seconds * 1000
+            span['max_ms'] = max(span['max_ms'], seconds * 1000)
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_usage(self, usage):
+        """Токены из usage ответа Groq"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        with self.lock:
+            self.tokens['prompt'] += prompt_tokens
+            self.tokens['completion'] += completion_tokens
+        return prompt_tokens, completion_tokens
+
+    def summary(self):
+        with self.lock:
+            return {
+                'invocation': self.invocation,
+                'duration_ms': round((time.perf_counter() - self.started) * 1000, 1),
+                'spans': {
+                    name: {'count': span['count'], 'total_ms': round(span['total_ms'], 1), 'max_ms': round(span['max_ms'], 1)}
+                    for name, span in sorted(self.spans.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'tokens': dict(self.tokens)
+            }
+
+
+trace = Trace()
+
+
+def log(event, level='info', **fields):
+    """Структурированный лог: одна строка JSON на событие"""
+    print(json.dumps({'level': level, 'event': event, 'invocation': trace.invocation, **fields}, default=str, ensure_ascii=False))
+
+
+def attach_trace(response, summary):
+    """Сводка вызова в заголовке X-Trace ответа (в режиме debug)"""
+    headers = response.setdefault('headers', {})
+    headers['X-Trace'] = json.dumps(summary, separators=(',', ':'))
+    exposed = headers.get('Access-Control-Expose-Headers')
+    headers['Access-Control-Expose-Headers'] = f'{exposed}, X-Trace' if exposed else 'X-Trace'
+
+
+def sql_span(query):
+    """Имя спана запроса по первой команде SQL: db.select, db.insert, db.with..."""
+    head = query[:64].decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)[:64]
+    words = head.split(None, 1)
+    return f'db.{words[0].lower()}' if words else 'db.query'
+
+
+_traced_cursors = {}
+
+
+def traced_cursor(base):
+    """Подкласс курсора base, который пишет каждый запрос в спан trace"""
+    if base not in _traced_cursors:
+        class TracedCursor(base):
+            def execute(self, query, vars=None):
+                with trace.span(sql_span(query)):
+                    return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                with trace.span(sql_span(query)):
+                    return super().executemany(query, vars_list)
+
+            def copy_expert(self, sql, file, size=8192):
+                with trace.span('db.copy'):
+                    return super().copy_expert(sql, file, size)
+
+        _traced_cursors[base] = TracedCursor
+    return _traced_cursors[base]
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    """Соединение пула: курсоры любого cursor_factory оборачиваются в traced_cursor"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=traced_cursor(base), **kwargs)
+
+
+def parse_llm_json(answer):
+    """
+    JSON из ответа LLM -> (значение, truncated): строгий разбор, иначе извлечение из markdown-блока или текста вокруг
+    и починка обрезанного по max_tokens ответа (truncated=True — недописанный хвост отброшен, кешировать такое нельзя).
+    Счётчики: llm.json_parsed, llm.json_repaired, llm.json_truncated, llm.parse_errors
+    """
+    try:
+        parsed = json.loads(answer)
+        trace.incr('llm.json_parsed')
+        return parsed, False
+    except (TypeError, ValueError):
+        pass
+    
+    parsed, truncated = extract_json(answer or '')
+    if parsed is None:
+        trace.incr('llm.parse_errors')
+        raise ValueError(f'Unparseable LLM response: {(answer or "")[:200]!r}')
+    trace.incr('llm.json_parsed')
+    trace.incr('llm.json_repaired')
+    if truncated:
+        trace.incr('llm.json_truncated')
+    return parsed, truncated
+
+
+def extract_json(text):
+    """Первый JSON-объект или массив в тексте (с преамбулой, ```json-блоком, хвостом или обрывом) -> (значение или None, обрыв)"""
+    fenced = re.search(r'```(?:json)?\s*(.*?)(?:```|$)', text, re.DOTALL | re.IGNORECASE)
+    candidates = [fenced.group(1)] if fenced else []
+    candidates.append(text)
+    
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        starts = [i for i in (candidate.find('{'), candidate.find('[')) if i >= 0]
+        if not starts:
+            continue
+        body = candidate[min(starts):]
+        for attempt in (body, re.sub(r',\s*([}\]])', r'\1', body)):
+            try:
+                return decoder.raw_decode(attempt)[0], False
+            except ValueError:
+                pass
+        repaired = close_truncated_json(body)
+        if repaired is not None:
+            return repaired, True
+    return None, False
+
+
+def close_truncated_json(text):
+    """Дописывает закрывающие кавычки и скобки обрезанному JSON, отбрасывая недописанный хвост"""
+    stack = []
+    in_string = False
+    escaped = False
+    # Позиции, после которых JSON можно корректно закрыть: конец значения на любом уровне вложенности
+    cut_points = []
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+                cut_points.append((i + 1, list(stack)))
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, list(stack)))
+            if not stack:
+                break
+        elif char == ',':
+            cut_points.append((i, list(stack)))
+    
+    if in_string and stack:
+        # Обрыв внутри строкового значения: дописываем кавычку, чтобы сохранить начало текста
+        cut_points.append((len(text), stack + ['"']))
+    
+    for end, open_brackets in reversed(cut_points[-50:]):
+        candidate = re.sub(r'[\s,:]+$', '', text[:end])
+        candidate += ''.join(reversed(open_brackets))
+        try:
+            return json.loads(re.sub(r',\s*([}\]])', r'\1', candidate))
+        except ValueError:
+            continue
+    return None
+
+
+def to_score(value):
+    """Оценка 0-100 из числа или строки ('75', '75%', '7.5'); вне диапазона — обрезается, мусор — None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, str):
+        match = re.search(r'-?\d+(?:[.,]\d+)?', value)
+        if not match:
+            return None
+        value = float(match.group(0).replace(',', '.'))
+    if not isinstance(value, (int, float)) or value != value:
+        return None
+    clamped = min(100, max(0, value))
+    if clamped != value:
+        trace.incr('llm.values_clamped')
+    return int(round(clamped))
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    text = str(value).strip().lower()
+    if text in ('true', 'yes', 'да', '1'):
+        return True
+    if text in ('false', 'no', 'нет', '0'):
+        return False
+    return None
+
+
+def normalize_sentiment(value):
+    """positive/negative/neutral из ответа модели (регистр, русские варианты, mixed -> neutral)"""
+    if not value:
+        return None
+    text = str(value).strip().lower()
+    if text.startswith(('pos', 'позит', 'полож')):
+        return 'positive'
+    if text.startswith(('neg', 'негат', 'отриц')):
+        return 'negative'
+    return 'neutral'
+
+
+def normalize_keywords(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        return []
+    keywords = []
+    for keyword in value:
+        keyword = str(keyword).strip()[:100] if keyword is not None else ''
+        if keyword and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords[:10]
+
+
+def validate_analysis(data):
+    """
+    Приводит ответ модели к схеме news_analysis: оценки 0-100, sentiment из трёх значений, список ключевых слов.
+    Без sentiment, bias_score или credibility_score анализ не принимается: новость осталась бы done с пустыми полями
+    """
+    if not isinstance(data, dict):
+        trace.incr('llm.schema_errors')
+        raise ValueError('Analysis is not a JSON object')
+    analysis = dict(
+        data,
+        sentiment=normalize_sentiment(data.get('sentiment')),
+        bias_score=to_score(data.get('bias_score')),
+        credibility_score=to_score(data.get('credibility_score')),
+        manipulation_detected=to_bool(data.get('manipulation_detected')),
+        summary=str(data.get('summary') or '')[:2000],
+        keywords=normalize_keywords(data.get('keywords'))
+    )
+    missing = [field for field in ('sentiment', 'bias_score', 'credibility_score') if analysis[field] is None]
+    if missing:
+        trace.incr('llm.schema_errors')
+        raise ValueError(f"Analysis lacks {', '.join(missing)}")
+    return analysis
+
+
+def validate_fake_check(data, reason_key='reason'):
+    """Ответ проверки на фейк -> (is_fake или None, если модель не дала однозначного ответа, reason)"""
+    if not isinstance(data, dict):
+        trace.incr('llm.schema_errors')
+        raise ValueError('Fake check is not a JSON object')
+    return to_bool(data.get('is_fake')), str(data.get(reason_key) or '')[:1000]
+
+
+def get_db_pool(db_url):
+    """Пул соединений процесса, переживает тёплые вызовы"""
+    global _db_pool, _db_pool_url
+    with _resources_lock:
+        if _db_pool is None or _db_pool.closed or _db_pool_url != db_url:
+            from psycopg2.pool import ThreadedConnectionPool
+            if _db_pool is not None and not _db_pool.closed:
+                _db_pool.closeall()
+            _db_pool = ThreadedConnectionPool(1, DB_POOL_SIZE, db_url, connection_factory=TracedConnection)
+            _db_pool_url = db_url
+        return _db_pool
+
+
+def is_connection_alive(conn):
+    """Проверка соединения: давно простаивавшее пингуем через SELECT 1"""
+    if conn.closed:
+        return False
+    last_used = _db_last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_HEALTHCHECK_IDLE:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def db_connection(db_url):
+    """Соединение из пула с переподключением; незакоммиченная транзакция откатывается при возврате"""
+    pool = get_db_pool(db_url)
+    conn = pool.getconn()
+    attempts = 0
+    while not is_connection_alive(conn) and attempts < DB_POOL_SIZE:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+        attempts += 1
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        _db_last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def get_groq_client(groq_key):
+    """Один клиент Groq на процесс: HTTP-соединение и TLS переиспользуются"""
+    global _groq_client, _groq_client_key
+    with _resources_lock:
+        if _groq_client is None or _groq_client_key != groq_key:
+            from groq import Groq
+            _groq_client = Groq(api_key=groq_key)
+            _groq_client_key = groq_key
+        return _groq_client
+
+
+class TokenBucket:
+    """Потокобезопасное ведро токенов для лимита «N в минуту»"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+    def acquire(self, amount=1, deadline=None):
+        """Ждёт токены; если их не накопится к deadline (time.monotonic()), сразу возвращает False, ничего не списав"""
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LLMDeadlineExceeded(Exception):
+    """Лимит RPM/TPM не даст сделать вызов до дедлайна вызова функции"""
+
+
+class LLMExecutor:
+    """Параллельное выполнение LLM-вызовов с ограничением RPM/TPM"""
+
+    def __init__(self, workers=LLM_CONCURRENCY, rpm=GROQ_RPM, tpm=GROQ_TPM):
+        self.workers = max(1, workers)
+        self.requests_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm > 0 else None
+        # time.monotonic(), после которого новые вызовы не начинаются (ставит analyze_existing_news)
+        self.deadline = None
+
+    def throttle(self, estimated_tokens):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise LLMDeadlineExceeded('Invocation deadline reached')
+        if self.requests_bucket and not self.requests_bucket.acquire(1, self.deadline):
+            raise LLMDeadlineExceeded('Request rate limit would outlast the invocation')
+        if self.tokens_bucket and not self.tokens_bucket.acquire(estimated_tokens, self.deadline):
+            raise LLMDeadlineExceeded('Token rate limit would outlast the invocation')
+
+    def available_requests(self):
+        """Запросы, доступные без ожидания по RPM (None — лимита нет)"""
+        return self.requests_bucket.available() if self.requests_bucket else None
+
+    def complete(self, groq_key, messages, temperature, max_tokens, json_mode=LLM_JSON_MODE):
+        """Один chat completion с учётом лимитов, возвращает текст ответа (json_mode — response_format json_object)"""
+        prompt_chars = sum(len(m['content']) for m in messages)
+        with trace.span('groq.throttle'):
+            self.throttle(prompt_chars // 4 + max_tokens)
+
+        client = get_groq_client(groq_key)
+        started = time.perf_counter()
+        with trace.span('groq.call'):
+            response = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **({'response_format': {'type': 'json_object'}} if json_mode else {})
+            )
+        prompt_tokens, completion_tokens = trace.add_usage(getattr(response, 'usage', None))
+        if trace.debug:
+            log('groq.call', duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return response.choices[0].message.content
+
+    def map(self, fn, items):
+        """Применяет fn к items в пуле потоков, возвращает [(item, result, error)] в исходном порядке"""
+        items = list(items)
+        if not items:
+            return []
+
+        def run(item):
+            try:
+                return item, fn(item), None
+            except Exception as e:
+                return item, None, e
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as pool:
+            return list(pool.map(run, items))
+
+
+llm_executor = LLMExecutor()
+
+
+class LLMCache:
+    """LRU-кеш результатов LLM по хешу нормализованного текста с таблицей llm_cache в БД"""
+
+    def __init__(self, max_size=LLM_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, text):
+        normalized = ' '.join((text or '').lower().split())
+        raw = f'{LLM_MODEL}|{PROMPT_VERSION}|{kind}|{normalized}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, persist=True):
+        with self.lock:
+            self._store(key, value)
+            if persist:
+                self.pending[key] = value
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def preload(self, conn, keys):
+        """Подгружает из БД записи, которых нет в памяти, одним запросом"""
+        with self.lock:
+            missing = [k for k in set(keys) if k not in self.entries]
+        if not missing:
+            return
+        with conn.cursor() as cur:
+            cur.execute("SELECT cache_key, result FROM llm_cache WHERE cache_key = ANY(%s)", (missing,))
+            rows = cur.fetchall()
+        with self.lock:
+            for cache_key, result in rows:
+                self._store(cache_key, result)
+
+    def flush(self, conn):
+        """Сохраняет новые записи в БД (в текущей транзакции)"""
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending.clear()
+        if not pending:
+            return
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO llm_cache (cache_key, model, prompt_version, result)
+                VALUES %s
+                ON CONFLICT (cache_key) DO NOTHING
+            """, [(k, LLM_MODEL, PROMPT_VERSION, Json(v)) for k, v in pending])
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+llm_cache = LLMCache()
 
 
 def handler(event, context):
     """
     Анализ уже собранных новостей через Groq AI и пересчёт статистики
     """
+    global _invocations
+    started = time.perf_counter()
+    cold = _invocations == 0
+    _invocations += 1
+    params = event.get('queryStringParameters') or {}
+    trace.reset(getattr(context, 'request_id', None) or _invocations, TRACE_DEBUG or params.get('debug') == '1')
+    
+    response = None
+    try:
+        response = handle_request(event, context)
+        return response
+    finally:
+        summary = trace.summary()
+        log(
+            'invocation',
+            cold=cold,
+            since_load_ms=round((started - _module_loaded_at) * 1000, 1),
+            status=response['statusCode'] if response else None,
+            **{key: value for key, value in summary.items() if key != 'invocation'}
+        )
+        if response is not None and trace.debug:
+            attach_trace(response, summary)
+
+
+def handle_request(event, context):
+    """Обработка HTTP-запроса"""
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -15,7 +673,7 @@ def handler(event, context):
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Max-Age': '86400'
             },
@@ -26,10 +684,62 @@ def handler(event, context):
     try:
         params = event.get('queryStringParameters') or {}
         country_code = params.get('country', 'RU')
+        mode = params.get('mode', ANALYSIS_MODE)
+        batch_size = int(params.get('batch', ANALYSIS_BATCH))
         
         db_url = os.environ.get('DATABASE_URL')
         groq_key = os.environ.get('GROQ_API_KEY')
         
+        if method == 'GET' and params.get('action') == 'history':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(get_history(
+                    db_url, country_code,
+                    params.get('bucket', 'auto'), params.get('from'), params.get('to')
+                )),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'GET' and params.get('action') == 'keywords':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(get_keyword_trends(
+                    db_url, country_code,
+                    int(params.get('window', '24')), min(int(params.get('k', '20')), 100)
+                )),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'GET' and params.get('action') == 'backlog':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(get_backlog(db_url, country_code)),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'GET' and params.get('action') == 'map':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(get_world_map(db_url)),
+                'isBase64Encoded': False
+            }
+        
         if not groq_key:
             return {
                 'statusCode': 400,
@@ -45,8 +755,23 @@ def handler(event, context):
             }
         
         if method == 'POST':
-            result = analyze_existing_news(db_url, groq_key, country_code)
-            stats = calculate_statistics(db_url, country_code)
+            result = analyze_existing_news(db_url, groq_key, country_code, mode, batch_size, context)
+            with trace.span('statistics'):
+                if country_code == 'ALL':
+                    stats = {}
+                    recompute_country_scores(db_url)
+                else:
+                    stats = calculate_statistics(db_url, country_code)
+                    record_history(db_url, country_code, stats)
+            
+            with trace.span('serialize'):
+                body = json.dumps({
+                    'analyzed': result['analyzed'],
+                    'failed': result['failed'],
+                    'remaining_backlog': result['remaining_backlog'],
+                    'cache': llm_cache.stats(),
+                    'statistics': stats
+                })
             
             return {
                 'statusCode': 200,
@@ -54,11 +779,7 @@ def handler(event, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'analyzed': result['analyzed'],
-                    'failed': result['failed'],
-                    'statistics': stats
-                }),
+                'body': body,
                 'isBase64Encoded': False
             }
         
@@ -73,7 +794,7 @@ def handler(event, context):
         }
         
     except Exception as e:
-        print(f'Error: {e}')
+        log('request.error', level='error', error=str(e))
         return {
             'statusCode': 500,
             'headers': {
@@ -85,60 +806,272 @@ def handler(event, context):
         }
 
 
-def analyze_existing_news(db_url, groq_key, country_code):
-    """Анализ новостей без is_fake и анализа"""
+def analyze_existing_news(db_url, groq_key, country_code, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH, context=None):
+    """Анализ новостей из очереди пачками с коммитом каждой, пока хватает времени вызова"""
     if not db_url:
-        return {'analyzed': 0, 'failed': 0}
+        return {'analyzed': 0, 'failed': 0, 'remaining_backlog': 0}
     
+    started = time.monotonic()
     analyzed_count = 0
     failed_count = 0
+    remaining_backlog = None
+    batch_durations = []
+    # LLM-вызовы не начинаются позже, чем за ANALYSIS_SAFETY_MARGIN до таймаута: запись и flush кеша должны успеть
+    llm_executor.deadline = time.monotonic() + remaining_seconds(context, started) - ANALYSIS_SAFETY_MARGIN
     
     try:
-        conn = psycopg2.connect(db_url)
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Получаем новости без анализа
-                cur.execute("""
-                    SELECT n.id, n.title, n.content
-                    FROM news_articles n
-                    LEFT JOIN news_analysis a ON a.article_id = n.id
-                    WHERE n.country_code = %s AND a.id IS NULL
-                    LIMIT 50
-                """, (country_code,))
+        with db_connection(db_url) as conn:
+            while True:
+                # Новую пачку начинаем, только если она успеет завершиться до таймаута
+                needed = max(batch_durations[-3:], default=ANALYSIS_BATCH_ESTIMATE) + ANALYSIS_SAFETY_MARGIN
+                if remaining_seconds(context, started) < needed:
+                    log('analysis.budget_exhausted', analyzed=analyzed_count, batches=len(batch_durations))
+                    break
                 
-                articles = cur.fetchall()
-                print(f'Found {len(articles)} articles to analyze')
-                
-                for article in articles:
-                    try:
-                        # Проверка на фейк
-                        is_fake, reason = check_fake(article['title'], article['content'], groq_key)
-                        
-                        if is_fake is not None:
-                            cur.execute("""
-                                UPDATE news_articles 
-                                SET is_fake = %s, fake_check_reason = %s
-                                WHERE id = %s
-                            """, (is_fake, reason, article['id']))
-                        
-                        # Полный анализ
-                        analyze_and_save(article['id'], article['title'], article['content'], groq_key, cur)
-                        analyzed_count += 1
-                        
-                    except Exception as e:
-                        print(f'Error analyzing article {article["id"]}: {e}')
-                        failed_count += 1
-                
-                conn.commit()
-                print(f'Analyzed: {analyzed_count}, Failed: {failed_count}')
+                # Захватываем не больше новостей, чем позволяет накопленный лимит RPM
+                limit = claim_limit(mode, batch_size)
+                if limit < 1:
+                    log('analysis.rate_limited', analyzed=analyzed_count, batches=len(batch_durations))
+                    break
                 
-        finally:
-            conn.close()
+                batch_started = time.monotonic()
+                analyzed, failed, claimed = analyze_batch(conn, groq_key, country_code, mode, batch_size, limit)
+                analyzed_count += analyzed
+                failed_count += failed
+                if not claimed:
+                    break
+                batch_durations.append(time.monotonic() - batch_started)
+            
+            remaining_backlog = count_backlog(conn, country_code)
+            log('analysis.done', analyzed=analyzed_count, failed=failed_count, remaining=remaining_backlog)
             
     except Exception as e:
-        print(f'Database error: {e}')
+        log('analysis.db_error', level='error', error=str(e))
+    finally:
+        llm_executor.deadline = None
+    
+    return {'analyzed': analyzed_count, 'failed': failed_count, 'remaining_backlog': remaining_backlog}
+
+
+def claim_limit(mode, batch_size, limit=ANALYSIS_CLAIM_LIMIT):
+    """Размер захвата по доступным запросам: split — два вызова на новость, combined — один на batch_size новостей"""
+    available = llm_executor.available_requests()
+    if available is None:
+        return limit
+    per_article = 1 / max(1, batch_size) if mode == 'combined' else 2
+    return min(limit, int(available / per_article))
+
+
+def remaining_seconds(context, started):
+    """Оставшееся время вызова: из context, а без него — по ANALYSIS_TIME_BUDGET"""
+    getter = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(getter):
+        return getter() / 1000
+    return ANALYSIS_TIME_BUDGET - (time.monotonic() - started)
+
+
+def analyze_batch(conn, groq_key, country_code, mode, batch_size, limit=ANALYSIS_CLAIM_LIMIT):
+    """Одна пачка: захват задач, LLM-фаза и запись с коммитом, возвращает (analyzed, failed, claimed)"""
+    analyzed_count = 0
+    failed_count = 0
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Захват задач: параллельные вызовы получают непересекающиеся наборы
+        with trace.span('analysis.claim'):
+            articles = claim_jobs(country_code, limit, cur)
+        log('analysis.claimed', articles=len(articles))
+        if not articles:
+            return 0, 0, 0
+        
+        llm_cache.preload(conn, cache_keys(articles, mode))
+        conn.commit()
+        
+        # LLM-вызовы идут параллельно, транзакция на это время закрыта
+        with trace.span('analysis.llm'):
+            results = run_analysis(articles, groq_key, mode, batch_size)
+        
+        fake_flags = []
+        analyses = []
+        failures = []
+        released = []
+        for article, result, error in results:
+            if isinstance(error, LLMDeadlineExceeded):
+                # Вызов не состоялся: задача возвращается в очередь без траты попытки
+                released.append(article['id'])
+                continue
+            if error is not None:
+                log('analysis.article_error', level='warning', article_id=article['id'], error=str(error))
+                failures.append((article['id'], str(error)[:500]))
+                failed_count += 1
+                continue
+            
+            is_fake, reason, analysis = result
+            if is_fake is not None:
+                fake_flags.append((article['id'], is_fake, reason))
+            analyses.append((article['id'], analysis))
+            analyzed_count += 1
+        
+        # Все результаты пишутся одним пакетом, сводка country_stats — в той же транзакции
+        with trace.span('analysis.write'):
+            affected_ids = []
+            if analyses:
+                analyzed_ids = [article_id for article_id, _ in analyses]
+                cur.execute("SELECT id FROM news_articles WHERE duplicate_of = ANY(%s)", (analyzed_ids,))
+                affected_ids = analyzed_ids + [row['id'] for row in cur.fetchall()]
+            
+            apply_stats_delta(affected_ids, -1, cur)
+            apply_keyword_delta(affected_ids, -1, cur)
+            update_fake_flags(fake_flags, cur)
+            save_analyses(analyses, cur)
+            complete_jobs(analyses, failures, cur)
+            release_jobs(released, cur)
+            if analyses:
+                propagate_to_duplicates(analyzed_ids, cur)
+            apply_stats_delta(affected_ids, 1, cur)
+            apply_keyword_delta(affected_ids, 1, cur)
+            
+            llm_cache.flush(conn)
+            conn.commit()
+        
+    return analyzed_count, failed_count, len(articles)
+
+
+def count_backlog(conn, country_code):
+    """Число задач, ожидающих анализа (включая просроченные аренды)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*)
+            FROM analysis_jobs
+            WHERE (%(country)s = 'ALL' OR country_code = %(country)s)
+              AND (status = 'queued' OR (status = 'leased' AND lease_until < NOW()))
+        """, {'country': country_code})
+        count = cur.fetchone()[0]
+    conn.commit()
+    return count
+
+
+def claim_jobs(country_code, limit, cur):
+    """Захват задач очереди через FOR UPDATE SKIP LOCKED с арендой на ANALYSIS_LEASE_SECONDS"""
+    cur.execute("""
+        WITH claimed AS (
+            UPDATE analysis_jobs j
+            SET status = 'leased',
+                attempts = j.attempts + 1,
+                lease_until = NOW() + %(lease)s * INTERVAL '1 second',
+                updated_at = NOW()
+            WHERE j.article_id IN (
+                SELECT article_id
+                FROM analysis_jobs
+                WHERE (%(country)s = 'ALL' OR country_code = %(country)s)
+                  AND (status = 'queued' OR (status = 'leased' AND lease_until < NOW()))
+                ORDER BY created_at
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING j.article_id, j.collected_at, j.attempts
+        )
+        SELECT n.id, n.title, n.content, c.attempts
+        FROM claimed c
+        JOIN news_articles n ON n.id = c.article_id AND n.collected_at = c.collected_at
+    """, {'country': country_code, 'limit': limit, 'lease': ANALYSIS_LEASE_SECONDS})
+    
+    claimed = cur.fetchall()
+    
+    # Задачи, исчерпавшие попытки (в том числе из-за истёкшей аренды), уходят в dead-letter
+    dead = [row['id'] for row in claimed if row['attempts'] > ANALYSIS_MAX_ATTEMPTS]
+    if dead:
+        cur.execute("""
+            UPDATE analysis_jobs
+            SET status = 'dead', lease_until = NULL, updated_at = NOW(),
+                last_error = COALESCE(last_error, 'lease expired')
+            WHERE article_id = ANY(%s)
+        """, (dead,))
+        set_analysis_status(dead, 'failed', cur)
+        log('jobs.dead_letter', jobs=len(dead))
+    
+    articles = [row for row in claimed if row['attempts'] <= ANALYSIS_MAX_ATTEMPTS]
+    set_analysis_status([row['id'] for row in articles], 'in_progress', cur)
+    return articles
+
+
+def complete_jobs(analyses, failures, cur):
+    """Завершение задач: успешные — done, упавшие — обратно в очередь или в dead-letter"""
+    if analyses:
+        cur.execute("""
+            UPDATE analysis_jobs
+            SET status = 'done', lease_until = NULL, last_error = NULL, updated_at = NOW()
+            WHERE article_id = ANY(%s)
+        """, ([article_id for article_id, _ in analyses],))
+        
+        by_model = {}
+        for article_id, analysis in analyses:
+            by_model.setdefault(analysis.get('model', ANALYSIS_MODEL_VERSION), []).append(article_id)
+        for model, article_ids in by_model.items():
+            set_analysis_status(article_ids, 'done', cur, model)
     
-    return {'analyzed': analyzed_count, 'failed': failed_count}
+    if failures:
+        execute_values(cur, """
+            UPDATE analysis_jobs j
+            SET status = CASE WHEN j.attempts >= v.max_attempts THEN 'dead' ELSE 'queued' END,
+                lease_until = NULL,
+                last_error = v.error,
+                updated_at = NOW()
+            FROM (VALUES %s) AS v(article_id, error, max_attempts)
+            WHERE j.article_id = v.article_id
+        """, [(article_id, error, ANALYSIS_MAX_ATTEMPTS) for article_id, error in failures], page_size=len(failures))
+        cur.execute("""
+            UPDATE news_articles n
+            SET analysis_status = CASE WHEN j.status = 'dead' THEN 'failed' ELSE 'pending' END
+            FROM analysis_jobs j
+            WHERE j.article_id = n.id AND n.id = ANY(%s)
+        """, ([article_id for article_id, _ in failures],))
+
+
+def release_jobs(article_ids, cur):
+    """Возврат захваченных задач в очередь без учёта попытки (LLM-вызов не начинался)"""
+    if not article_ids:
+        return
+    
+    cur.execute("""
+        UPDATE analysis_jobs
+        SET status = 'queued', attempts = GREATEST(attempts - 1, 0), lease_until = NULL, updated_at = NOW()
+        WHERE article_id = ANY(%s)
+    """, (list(article_ids),))
+    set_analysis_status(article_ids, 'pending', cur)
+    log('analysis.released', articles=len(article_ids))
+
+
+def set_analysis_status(article_ids, status, cur, model=ANALYSIS_MODEL_VERSION):
+    """Статус анализа на самих новостях (done — с версией модели)"""
+    if not article_ids:
+        return
+    
+    cur.execute("""
+        UPDATE news_articles
+        SET analysis_status = %s,
+            analysis_model = CASE WHEN %s = 'done' THEN %s ELSE analysis_model END
+        WHERE id = ANY(%s)
+    """, (status, status, model, list(article_ids)))
+
+
+def get_backlog(db_url, country_code):
+    """Глубина бэклога по статусам (по частичному индексу незавершённых новостей)"""
+    backlog = {'pending': 0, 'in_progress': 0, 'failed': 0}
+    if not db_url:
+        return {'country': country_code, 'backlog': backlog}
+    
+    with db_connection(db_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT analysis_status, COUNT(*)
+                FROM news_articles
+                WHERE analysis_status <> 'done' AND (%(country)s = 'ALL' OR country_code = %(country)s)
+                GROUP BY analysis_status
+            """, {'country': country_code})
+            for status, count in cur.fetchall():
+                backlog[status] = count
+    
+    return {'country': country_code, 'backlog': backlog}
 
 
 def calculate_statistics(db_url, country_code):
@@ -147,26 +1080,14 @@ def calculate_statistics(db_url, country_code):
         return {}
     
     try:
-        conn = psycopg2.connect(db_url)
-        try:
+        with db_connection(db_url) as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Общая статистика
+                # Сводка поддерживается инкрементально при каждой записи анализа
                 cur.execute("""
-                    SELECT 
-                        COUNT(*) as total_news,
-                        COUNT(CASE WHEN is_fake = true THEN 1 END) as fake_news,
-                        COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END) as manipulation_count,
-                        AVG(a.bias_score) as avg_bias,
-                        AVG(a.credibility_score) as avg_credibility,
-                        COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END) as positive_count,
-                        COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END) as negative_count,
-                        COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END) as neutral_count
-                    FROM news_articles n
-                    LEFT JOIN news_analysis a ON a.article_id = n.id
-                    WHERE n.country_code = %s
+                    SELECT * FROM country_stats WHERE country_code = %s
                 """, (country_code,))
                 
-                stats = cur.fetchone()
+                stats = rollup_to_stats(cur.fetchone())
                 
                 if stats:
                     return {
@@ -182,16 +1103,589 @@ def calculate_statistics(db_url, country_code):
                         'freedomScore': calculate_freedom_score(stats),
                         'pressFreedomScore': calculate_press_freedom(stats)
                     }
-                
-        finally:
-            conn.close()
             
     except Exception as e:
-        print(f'Stats calculation error: {e}')
+        log('stats.error', level='error', error=str(e))
     
     return {}
 
 
+def rollup_to_stats(row):
+    """Строка country_stats -> словарь в формате агрегата по новостям"""
+    row = row or {}
+    bias_count = row.get('bias_count') or 0
+    credibility_count = row.get('credibility_count') or 0
+    return {
+        'total_news': row.get('total_news') or 0,
+        'fake_news': row.get('fake_news') or 0,
+        'manipulation_count': row.get('manipulation_count') or 0,
+        'avg_bias': row['bias_sum'] / bias_count if bias_count else None,
+        'avg_credibility': row['credibility_sum'] / credibility_count if credibility_count else None,
+        'positive_count': row.get('positive_count') or 0,
+        'negative_count': row.get('negative_count') or 0,
+        'neutral_count': row.get('neutral_count') or 0
+    }
+
+
+STATS_COLUMNS = [
+    'total_news', 'fake_news', 'manipulation_count',
+    'bias_sum', 'bias_count', 'credibility_sum', 'credibility_count',
+    'positive_count', 'negative_count', 'neutral_count'
+]
+
+
+def rebuild_country_stats(db_url):
+    """Пересчёт country_stats из базовых таблиц и сводки архивных месяцев со сверкой с текущей сводкой"""
+    with db_connection(db_url) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("LOCK TABLE country_stats IN EXCLUSIVE MODE")
+            cur.execute(f"""
+                SELECT country_code, {', '.join(f'SUM({c})::bigint AS {c}' for c in STATS_COLUMNS)}
+                FROM (
+                SELECT
+                    n.country_code,
+                    COUNT(*) AS total_news,
+                    COUNT(CASE WHEN n.is_fake = true THEN 1 END) AS fake_news,
+                    COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END) AS manipulation_count,
+                    COALESCE(SUM(a.bias_score), 0) AS bias_sum,
+                    COUNT(a.bias_score) AS bias_count,
+                    COALESCE(SUM(a.credibility_score), 0) AS credibility_sum,
+                    COUNT(a.credibility_score) AS credibility_count,
+                    COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END) AS positive_count,
+                    COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END) AS negative_count,
+                    COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END) AS neutral_count
+                FROM news_articles n
+                LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+                WHERE n.country_code IS NOT NULL
+                GROUP BY n.country_code
+                UNION ALL
+                SELECT country_code, {', '.join(STATS_COLUMNS)}
+                FROM news_archive_stats
+                ) totals
+                GROUP BY country_code
+            """)
+            rebuilt = {row['country_code']: row for row in cur.fetchall()}
+            
+            cur.execute("SELECT * FROM country_stats")
+            live = {row['country_code']: row for row in cur.fetchall()}
+            
+            mismatches = []
+            for code in sorted(set(rebuilt) | set(live)):
+                expected = rebuilt.get(code, {})
+                actual = live.get(code, {})
+                diff = {
+                    column: {'live': actual.get(column, 0), 'rebuilt': expected.get(column, 0)}
+                    for column in STATS_COLUMNS
+                    if (actual.get(column) or 0) != (expected.get(column) or 0)
+                }
+                if diff:
+                    mismatches.append({'country': code, 'diff': diff})
+            
+            cur.execute(
+                "UPDATE country_stats SET " + ', '.join(f'{c} = 0' for c in STATS_COLUMNS)
+                + ", updated_at = NOW(), data_version = data_version + 1"
+            )
+            if rebuilt:
+                execute_values(cur, f"""
+                    INSERT INTO country_stats (country_code, {', '.join(STATS_COLUMNS)})
+                    VALUES %s
+                    ON CONFLICT (country_code) DO UPDATE SET
+                        {', '.join(f'{c} = EXCLUDED.{c}' for c in STATS_COLUMNS)},
+                        updated_at = NOW()
+                """, [(code, *[row[c] for c in STATS_COLUMNS]) for code, row in rebuilt.items()])
+            
+            conn.commit()
+    
+    log('stats.rebuilt', countries=len(rebuilt), mismatches=len(mismatches))
+    return {'countries': len(rebuilt), 'mismatches': mismatches}
+
+
+def apply_stats_delta(article_ids, sign, cur):
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад новостей в сводку country_stats"""
+    if not article_ids:
+        return
+    
+    cur.execute("""
+        INSERT INTO country_stats AS s (
+            country_code, total_news, fake_news, manipulation_count,
+            bias_sum, bias_count, credibility_sum, credibility_count,
+            positive_count, negative_count, neutral_count, updated_at, data_version
+        )
+        SELECT
+            n.country_code,
+            %(sign)s * COUNT(*),
+            %(sign)s * COUNT(CASE WHEN n.is_fake = true THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END),
+            %(sign)s * COALESCE(SUM(a.bias_score), 0),
+            %(sign)s * COUNT(a.bias_score),
+            %(sign)s * COALESCE(SUM(a.credibility_score), 0),
+            %(sign)s * COUNT(a.credibility_score),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END),
+            NOW(),
+            1
+        FROM news_articles n
+        LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+        WHERE n.id = ANY(%(ids)s) AND n.country_code IS NOT NULL
+        GROUP BY n.country_code
+        ON CONFLICT (country_code) DO UPDATE SET
+            total_news = s.total_news + EXCLUDED.total_news,
+            fake_news = s.fake_news + EXCLUDED.fake_news,
+            manipulation_count = s.manipulation_count + EXCLUDED.manipulation_count,
+            bias_sum = s.bias_sum + EXCLUDED.bias_sum,
+            bias_count = s.bias_count + EXCLUDED.bias_count,
+            credibility_sum = s.credibility_sum + EXCLUDED.credibility_sum,
+            credibility_count = s.credibility_count + EXCLUDED.credibility_count,
+            positive_count = s.positive_count + EXCLUDED.positive_count,
+            negative_count = s.negative_count + EXCLUDED.negative_count,
+            neutral_count = s.neutral_count + EXCLUDED.neutral_count,
+            updated_at = EXCLUDED.updated_at,
+            data_version = s.data_version + 1
+    """, {'sign': sign, 'ids': list(article_ids)})
+
+
+def apply_keyword_delta(article_ids, sign, cur):
+    """Добавляет (sign=1) или вычитает (sign=-1) ключевые слова анализов новостей в часовые и дневные корзины keyword_counts"""
+    if not article_ids:
+        return
+    
+    # Порядок вставки фиксирован, чтобы параллельные вызовы брали блокировки строк в одном порядке
+    cur.execute("""
+        INSERT INTO keyword_counts AS c (country_code, bucket, bucket_start, keyword, count)
+        SELECT n.country_code, b.bucket, date_trunc(b.bucket, COALESCE(n.published_at, n.collected_at)), k.keyword,
+               %(sign)s * COUNT(*)
+        FROM news_articles n
+        JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+        CROSS JOIN LATERAL (
+            SELECT DISTINCT left(lower(btrim(kw)), 100) AS keyword
+            FROM unnest(a.keywords) AS kw
+            WHERE btrim(kw) <> ''
+        ) k
+        CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+        WHERE n.id = ANY(%(ids)s) AND n.country_code IS NOT NULL AND COALESCE(n.published_at, n.collected_at) IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (country_code, bucket, bucket_start, keyword) DO UPDATE SET
+            count = c.count + EXCLUDED.count
+    """, {'sign': sign, 'ids': list(article_ids)})
+
+
+def record_history(db_url, country_code, stats):
+    """Запись рассчитанных индексов в часовую и дневную корзины country_history"""
+    if not db_url or not stats:
+        return
+    
+    scores = (stats['democracyScore'], stats['freedomScore'], stats['pressFreedomScore'])
+    
+    try:
+        with db_connection(db_url) as conn:
+            with conn.cursor() as cur:
+                insert_history([(country_code, *scores)], cur)
+                housekeeping(cur)
+                conn.commit()
+                
+    except Exception as e:
+        log('history.error', level='error', error=str(e))
+
+
+def housekeeping(cur):
+    """Не чаще раза в HISTORY_COMPACT_INTERVAL: сжатие истории, чистка keyword_counts и секции новостей наперёд"""
+    global _history_compacted_at
+    if time.monotonic() - _history_compacted_at <= HISTORY_COMPACT_INTERVAL:
+        return
+    
+    compact_history(cur)
+    prune_keyword_counts(cur)
+    ensure_news_partitions(cur)
+    _history_compacted_at = time.monotonic()
+
+
+def insert_history(entries, cur):
+    """Добавляет индексы в часовую и дневную корзины country_history: entries = [(country_code, democracy, freedom, press_freedom)]"""
+    if not entries:
+        return
+    
+    execute_values(cur, """
+        INSERT INTO country_history AS h
+        (country_code, bucket, bucket_start, democracy_score, freedom_score, press_freedom_score, samples, recorded_at)
+        VALUES %s
+        ON CONFLICT (country_code, bucket, bucket_start) DO UPDATE SET
+            democracy_score = (h.democracy_score * h.samples + EXCLUDED.democracy_score) / (h.samples + 1),
+            freedom_score = (h.freedom_score * h.samples + EXCLUDED.freedom_score) / (h.samples + 1),
+            press_freedom_score = (h.press_freedom_score * h.samples + EXCLUDED.press_freedom_score) / (h.samples + 1),
+            samples = h.samples + 1,
+            recorded_at = EXCLUDED.recorded_at
+    """, [
+        (code, bucket, bucket, *scores) for code, *scores in entries for bucket in ('hour', 'day')
+    ], template="(%s, %s, date_trunc(%s, NOW()), %s, %s, %s, 1, NOW())", page_size=2 * len(entries))
+
+
+def compact_history(cur):
+    """Даунсэмплинг: старые часовые корзины сворачиваются в дневные, старые дневные — в недельные"""
+    for source, target, days in (
+        ('hour', 'day', HISTORY_HOURLY_RETENTION_DAYS),
+        ('day', 'week', HISTORY_DAILY_RETENTION_DAYS)
+    ):
+        # Дневные корзины пишутся напрямую, поэтому часовые в них не доливаем, а только удаляем
+        if target == 'day':
+            on_conflict = 'DO NOTHING'
+        else:
+            on_conflict = """DO UPDATE SET
+                democracy_score = (h.democracy_score * h.samples + EXCLUDED.democracy_score * EXCLUDED.samples) / (h.samples + EXCLUDED.samples),
+                freedom_score = (h.freedom_score * h.samples + EXCLUDED.freedom_score * EXCLUDED.samples) / (h.samples + EXCLUDED.samples),
+                press_freedom_score = (h.press_freedom_score * h.samples + EXCLUDED.press_freedom_score * EXCLUDED.samples) / (h.samples + EXCLUDED.samples),
+                samples = h.samples + EXCLUDED.samples,
+                recorded_at = EXCLUDED.recorded_at"""
+        
+        cur.execute(f"""
+            WITH old AS (
+                DELETE FROM country_history
+                WHERE bucket = %(source)s AND bucket_start < NOW() - %(days)s * INTERVAL '1 day'
+                RETURNING country_code, bucket_start, democracy_score, freedom_score, press_freedom_score, samples
+            )
+            INSERT INTO country_history AS h
+            (country_code, bucket, bucket_start, democracy_score, freedom_score, press_freedom_score, samples, recorded_at)
+            SELECT
+                country_code, %(target)s, date_trunc(%(target)s, bucket_start),
+                SUM(democracy_score * samples) / SUM(samples),
+                SUM(freedom_score * samples) / SUM(samples),
+                SUM(press_freedom_score * samples) / SUM(samples),
+                SUM(samples), NOW()
+            FROM old
+            GROUP BY country_code, date_trunc(%(target)s, bucket_start)
+            ON CONFLICT (country_code, bucket, bucket_start) {on_conflict}
+        """, {'source': source, 'target': target, 'days': days})
+        log('history.compacted', source=source, target=target, buckets=cur.rowcount)
+
+
+def prune_keyword_counts(cur):
+    """Удаляет часовые и дневные корзины keyword_counts старше срока хранения и обнулившиеся счётчики"""
+    cur.execute("""
+        DELETE FROM keyword_counts
+        WHERE count <= 0
+           OR (bucket = 'hour' AND bucket_start < NOW() - %(hourly)s * INTERVAL '1 day')
+           OR (bucket = 'day' AND bucket_start < NOW() - %(daily)s * INTERVAL '1 day')
+    """, {'hourly': KEYWORD_HOURLY_RETENTION_DAYS, 'daily': KEYWORD_DAILY_RETENTION_DAYS})
+    log('keywords.pruned', rows=cur.rowcount)
+
+
+def ensure_news_partitions(cur, months_ahead=NEWS_PARTITIONS_AHEAD):
+    """Месячные секции news_articles/news_analysis с текущего месяца на months_ahead вперёд"""
+    cur.execute(
+        "SELECT create_news_partitions(NOW()::date, (NOW() + %s * INTERVAL '1 month')::date) AS created",
+        (months_ahead,)
+    )
+    # Вызывается и с RealDictCursor (пересчёт оценок), и с обычным курсором (CLI)
+    row = cur.fetchone()
+    created = row['created'] if isinstance(row, dict) else row[0]
+    if created:
+        log('partitions.created', months=created)
+    return created
+
+
+def apply_news_retention(db_url, months=NEWS_RETENTION_MONTHS, action=NEWS_RETENTION_ACTION):
+    """
+    Политика хранения: месячные секции новостей и анализов старше months месяцев сворачиваются в news_archive_stats
+    и отсоединяются (detach — остаются отдельными таблицами для выгрузки) или удаляются (drop).
+    country_stats не уменьшается, поэтому общая статистика стран сохраняется
+    """
+    if action not in ('detach', 'drop'):
+        raise ValueError(f'Unknown retention action: {action}')
+    result = {'action': action, 'months': months, 'partitions': []}
+    if not db_url or months <= 0:
+        return result
+    
+    with db_connection(db_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'news_articles'::regclass
+                ORDER BY c.relname
+            """)
+            names = [name for (name,) in cur.fetchall()]
+            cur.execute("SELECT (date_trunc('month', NOW()) - %s * INTERVAL '1 month')::date", (months,))
+            cutoff = cur.fetchone()[0]
+        conn.commit()
+        
+        for name in names:
+            match = re.fullmatch(r'news_articles_(p(\d{4})_(\d{2}))', name)
+            if not match:
+                continue
+            month = date(int(match.group(2)), int(match.group(3)), 1)
+            if month >= cutoff:
+                continue
+            
+            with trace.span('retention.partition'), conn.cursor() as cur:
+                result['partitions'].append(archive_news_partition(match.group(1), month, action, cur))
+            conn.commit()
+    
+    result['cutoff'] = cutoff.isoformat()
+    return result
+
+
+def archive_news_partition(suffix, month, action, cur):
+    """Сводка месяца в news_archive_stats и отсоединение (или удаление) его секций одной транзакцией"""
+    articles = f'news_articles_{suffix}'
+    analysis = f'news_analysis_{suffix}'
+    
+    # Старые месяцы почти не меняются, но до отсоединения запись в них блокируется, чтобы сводка была точной
+    cur.execute(f"LOCK TABLE {articles}, {analysis} IN EXCLUSIVE MODE")
+    cur.execute(f"""
+        INSERT INTO news_archive_stats AS s (country_code, month, {', '.join(STATS_COLUMNS)})
+        SELECT
+            n.country_code,
+            %(month)s,
+            COUNT(*),
+            COUNT(CASE WHEN n.is_fake = true THEN 1 END),
+            COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END),
+            COALESCE(SUM(a.bias_score), 0),
+            COUNT(a.bias_score),
+            COALESCE(SUM(a.credibility_score), 0),
+            COUNT(a.credibility_score),
+            COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END),
+            COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END),
+            COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END)
+        FROM {articles} n
+        LEFT JOIN {analysis} a ON a.article_id = n.id AND a.collected_at = n.collected_at
+        WHERE n.country_code IS NOT NULL
+        GROUP BY n.country_code
+        ON CONFLICT (country_code, month) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in STATS_COLUMNS)},
+            archived_at = NOW()
+        RETURNING country_code, total_news
+    """, {'month': month})
+    archived = dict(cur.fetchall())
+    
+    cur.execute("""
+        DELETE FROM analysis_jobs
+        WHERE collected_at >= %s AND collected_at < %s::date + INTERVAL '1 month'
+    """, (month, month))
+    jobs = cur.rowcount
+    
+    cur.execute(f"ALTER TABLE news_analysis DETACH PARTITION {analysis}")
+    cur.execute(f"ALTER TABLE {analysis} DROP CONSTRAINT IF EXISTS news_analysis_article_fkey")
+    cur.execute(f"ALTER TABLE news_articles DETACH PARTITION {articles}")
+    if action == 'drop':
+        cur.execute(f"DROP TABLE {analysis}")
+        cur.execute(f"DROP TABLE {articles}")
+    
+    # Ответы news-collector с новостями этих стран больше не актуальны
+    if archived:
+        cur.execute("""
+            UPDATE country_stats SET data_version = data_version + 1, updated_at = NOW()
+            WHERE country_code = ANY(%s)
+        """, (list(archived),))
+    
+    log('retention.partition', month=month.isoformat(), action=action, articles=sum(archived.values()), jobs=jobs)
+    return {'month': month.isoformat(), 'articles': sum(archived.values()), 'countries': len(archived), 'jobs': jobs}
+
+
+def get_keyword_trends(db_url, country_code, window_hours=24, k=20):
+    """
+    Топ-k ключевых слов страны (ALL — всех стран) за последние window_hours часов и самые растущие
+    относительно предыдущего такого же окна, из готовых корзин keyword_counts
+    """
+    # Окно и предыдущее окно должны уместиться в хранимые часовые корзины, иначе считаем по дневным
+    if 2 * window_hours <= KEYWORD_HOURLY_RETENTION_DAYS * 24:
+        bucket, units = 'hour', max(1, window_hours)
+    else:
+        bucket, units = 'day', -(-window_hours // 24)
+    
+    rows = []
+    if db_url:
+        with db_connection(db_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    WITH bounds AS (
+                        SELECT date_trunc(%(bucket)s, NOW()::timestamp)
+                               - (%(units)s - 1) * CASE %(bucket)s WHEN 'hour' THEN INTERVAL '1 hour' ELSE INTERVAL '1 day' END AS window_start,
+                               %(units)s * CASE %(bucket)s WHEN 'hour' THEN INTERVAL '1 hour' ELSE INTERVAL '1 day' END AS window_length
+                    )
+                    SELECT keyword,
+                           COALESCE(SUM(count) FILTER (WHERE bucket_start >= bounds.window_start), 0) AS current,
+                           COALESCE(SUM(count) FILTER (WHERE bucket_start < bounds.window_start), 0) AS previous
+                    FROM keyword_counts, bounds
+                    WHERE (%(country)s = 'ALL' OR country_code = %(country)s)
+                      AND bucket = %(bucket)s
+                      AND bucket_start >= bounds.window_start - bounds.window_length
+                    GROUP BY keyword
+                    HAVING SUM(count) > 0
+                """, {'country': country_code, 'bucket': bucket, 'units': units})
+                rows = cur.fetchall()
+    
+    top = heapq.nlargest(k, (row for row in rows if row[1] > 0), key=lambda row: (row[1], row[0]))
+    # Рост к предыдущему окну со сглаживанием +1, редкие слова отсекаются порогом
+    rising = heapq.nlargest(
+        k,
+        (row for row in rows if row[1] >= KEYWORD_RISING_MIN_COUNT and row[1] > row[2]),
+        key=lambda row: ((row[1] - row[2]) / (row[2] + 1), row[1])
+    )
+    
+    return {
+        'country': country_code,
+        'window': window_hours,
+        'bucket': bucket,
+        'top': [{'keyword': keyword, 'count': current} for keyword, current, _ in top],
+        'rising': [
+            {'keyword': keyword, 'count': current, 'previous': previous, 'growth': round((current - previous) / (previous + 1), 2)}
+            for keyword, current, previous in rising
+        ]
+    }
+
+
+def get_history(db_url, country_code, bucket='auto', date_from=None, date_to=None):
+    """Динамика индексов страны за период из готовых корзин country_history"""
+    date_to = datetime.fromisoformat(date_to) if date_to else datetime.utcnow()
+    date_from = datetime.fromisoformat(date_from) if date_from else date_to - timedelta(days=30)
+    
+    if bucket not in ('hour', 'day', 'week'):
+        span = date_to - date_from
+        bucket = 'hour' if span <= timedelta(days=2) else 'day' if span <= timedelta(days=120) else 'week'
+    
+    points = []
+    if db_url:
+        with db_connection(db_url) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                if bucket == 'week':
+                    # Недельные корзины появляются только после compact_history (старше HISTORY_DAILY_RETENTION_DAYS),
+                    # более свежие недели собираются из дневных корзин; день лежит либо в дневной, либо в недельной
+                    cur.execute("""
+                        SELECT
+                            date_trunc('week', bucket_start) AS bucket_start,
+                            SUM(democracy_score * samples) / SUM(samples) AS democracy_score,
+                            SUM(freedom_score * samples) / SUM(samples) AS freedom_score,
+                            SUM(press_freedom_score * samples) / SUM(samples) AS press_freedom_score,
+                            SUM(samples) AS samples
+                        FROM country_history
+                        WHERE country_code = %(country)s AND bucket IN ('day', 'week')
+                          AND bucket_start >= %(from)s - INTERVAL '7 days' AND bucket_start < %(to)s
+                          AND date_trunc('week', bucket_start) >= %(from)s
+                        GROUP BY date_trunc('week', bucket_start)
+                        ORDER BY 1
+                    """, {'country': country_code, 'from': date_from, 'to': date_to})
+                else:
+                    cur.execute("""
+                        SELECT bucket_start, democracy_score, freedom_score, press_freedom_score, samples
+                        FROM country_history
+                        WHERE country_code = %s AND bucket = %s AND bucket_start >= %s AND bucket_start < %s
+                        ORDER BY bucket_start
+                    """, (country_code, bucket, date_from, date_to))
+                
+                for row in cur.fetchall():
+                    points.append({
+                        'time': row['bucket_start'].isoformat(),
+                        'democracyScore': float(row['democracy_score']),
+                        'freedomScore': float(row['freedom_score']),
+                        'pressFreedomScore': float(row['press_freedom_score']),
+                        'samples': int(row['samples'])
+                    })
+    
+    return {
+        'country': country_code,
+        'bucket': bucket,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'points': points
+    }
+
+
+def score_countries(rows):
+    """
+    Индексы по строкам country_stats сразу для всех стран: те же формулы, что в calculate_democracy_score,
+    calculate_freedom_score и calculate_press_freedom, но над массивами NumPy.
+    Возвращает [(country_code, democracy, freedom, press_freedom)]
+    """
+    if not rows:
+        return []
+    
+    import numpy as np
+    
+    columns = {name: np.array([float(row[name] or 0) for row in rows]) for name in STATS_COLUMNS}
+    total = columns['total_news']
+    
+    # Как `avg or 50` в скалярных формулах: нет оценок или среднее 0 -> 50
+    avg_credibility = np.divide(columns['credibility_sum'], columns['credibility_count'],
+                                out=np.zeros_like(total), where=columns['credibility_count'] > 0)
+    avg_bias = np.divide(columns['bias_sum'], columns['bias_count'],
+                         out=np.zeros_like(total), where=columns['bias_count'] > 0)
+    credibility = np.where(avg_credibility != 0, avg_credibility, 50)
+    bias = 100 - np.where(avg_bias != 0, avg_bias, 50)
+    fake_ratio = columns['fake_news'] / np.maximum(total, 1)
+    manipulation_ratio = columns['manipulation_count'] / np.maximum(total, 1)
+    
+    empty = total == 0
+    democracy = np.where(empty, 50, np.clip(credibility * 0.4 + bias * 0.3 + (1 - fake_ratio) * 100 * 0.3, 0, 100))
+    freedom = np.where(empty, 50, np.clip(credibility * 0.6 + (1 - manipulation_ratio) * 100 * 0.4, 0, 100))
+    press_freedom = np.where(empty, 50, np.clip(bias * 0.5 + (1 - fake_ratio) * 100 * 0.5, 0, 100))
+    
+    # Округляем через round(), чтобы совпадать со скалярными функциями до последнего знака
+    return [
+        (row['country_code'], round(float(d), 1), round(float(f), 1), round(float(p), 1))
+        for row, d, f, p in zip(rows, democracy, freedom, press_freedom)
+    ]
+
+
+def recompute_country_scores(db_url):
+    """Пересчёт индексов всех стран из country_stats: countries и country_history обновляются одной транзакцией"""
+    if not db_url:
+        return {'updated': 0}
+    
+    with db_connection(db_url) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Страны без новостей сохраняют заданные значения
+            cur.execute("SELECT * FROM country_stats WHERE total_news > 0 ORDER BY country_code")
+            with trace.span('scores.compute'):
+                scores = score_countries(cur.fetchall())
+            
+            if scores:
+                execute_values(cur, """
+                    UPDATE countries c
+                    SET democracy_score = v.democracy_score,
+                        freedom_score = v.freedom_score,
+                        press_freedom_score = v.press_freedom_score,
+                        last_updated = NOW()
+                    FROM (VALUES %s) AS v(code, democracy_score, freedom_score, press_freedom_score)
+                    WHERE c.code = v.code
+                """, scores, template="(%s, %s::numeric, %s::numeric, %s::numeric)", page_size=len(scores))
+                insert_history(scores, cur)
+                housekeeping(cur)
+            conn.commit()
+    
+    log('scores.recomputed', countries=len(scores))
+    return {'updated': len(scores)}
+
+
+def get_world_map(db_url):
+    """Текущие индексы всех стран одним запросом к countries"""
+    countries = []
+    if db_url:
+        with db_connection(db_url) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT code, name, democracy_score, freedom_score, authoritarian_score, press_freedom_score,
+                           fascism_britt_score, fascism_eco_score, last_updated
+                    FROM countries
+                    ORDER BY code
+                """)
+                for row in cur.fetchall():
+                    countries.append({
+                        'code': row['code'],
+                        'name': row['name'],
+                        'democracyScore': float(row['democracy_score']) if row['democracy_score'] is not None else None,
+                        'freedomScore': float(row['freedom_score']) if row['freedom_score'] is not None else None,
+                        'authoritarianScore': row['authoritarian_score'],
+                        'pressFreedomScore': float(row['press_freedom_score']) if row['press_freedom_score'] is not None else None,
+                        'fascismBrittScore': row['fascism_britt_score'],
+                        'fascismEcoScore': row['fascism_eco_score'],
+                        'lastUpdated': row['last_updated'].isoformat() if row['last_updated'] else None
+                    })
+    
+    return {'countries': countries}
+
+
 def calculate_democracy_score(stats):
     """Расчёт индекса демократии на основе анализа"""
     if not stats or not stats['total_news']:
@@ -229,16 +1723,254 @@ def calculate_press_freedom(stats):
     return round(max(0, min(100, score)), 1)
 
 
+def article_text(title, content, max_chars):
+    """Текст новости в том виде, в каком он уходит в промпт"""
+    return f"{title}. {content or ''}"[:max_chars]
+
+
+def cache_keys(items, mode=ANALYSIS_MODE):
+    """Ключи кеша, которые понадобятся LLM-фазе для items"""
+    keys = []
+    for item in items:
+        if mode == 'combined':
+            keys.append(llm_cache.key('combined', article_text(item['title'], item['content'], 800)))
+        else:
+            keys.append(llm_cache.key('fake', article_text(item['title'], item['content'], 500)))
+            keys.append(llm_cache.key('analysis', article_text(item['title'], item['content'], 800)))
+    return keys
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'\w+', (text or '').lower()) if len(token) > 2 and not token.isdigit()]
+
+
+def tfidf_keywords(texts, top_k=PRECLASSIFY_KEYWORDS):
+    """Ключевые слова по TF-IDF внутри пачки текстов (матричный расчёт на NumPy)"""
+    import numpy as np
+    
+    vocabulary = {}
+    doc_index = []
+    term_index = []
+    for i, text in enumerate(texts):
+        for token in tokenize(text):
+            if token not in STOPWORDS:
+                doc_index.append(i)
+                term_index.append(vocabulary.setdefault(token, len(vocabulary)))
+    
+    if not vocabulary:
+        return [[] for _ in texts]
+    
+    tf = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    np.add.at(tf, (np.array(doc_index), np.array(term_index)), 1)
+    tf /= np.maximum(tf.sum(axis=1, keepdims=True), 1)
+    
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    scores = tf * idf
+    
+    terms = np.array(list(vocabulary))
+    top = np.argsort(-scores, axis=1)[:, :top_k]
+    return [[str(terms[j]) for j in top[i] if scores[i, j] > 0] for i in range(len(texts))]
+
+
+def preclassify_articles(items):
+    """Локальный первый проход: релевантность политике, тональность и маркеры манипуляции по словарям, ключевые слова по TF-IDF"""
+    texts = [article_text(item['title'], item['content'], 2000) for item in items]
+    keywords = tfidf_keywords(texts)
+    
+    results = []
+    for text, item_keywords in zip(texts, keywords):
+        tokens = tokenize(text)
+        political = sum(1 for token in tokens if token in POLITICAL_TERMS)
+        off_topic = sum(1 for token in tokens if token in OFF_TOPIC_TERMS)
+        positive = sum(1 for token in tokens if token in POSITIVE_TERMS)
+        negative = sum(1 for token in tokens if token in NEGATIVE_TERMS)
+        markers = (
+            sum(1 for token in tokens if token in MANIPULATION_MARKERS)
+            + text.count('!') // 2
+            + sum(1 for word in text.split() if len(word) > 3 and word.isupper())
+        )
+        
+        tone = (positive - negative) / max(positive + negative, 1)
+        if tone > 0.2:
+            sentiment = 'positive'
+        elif tone < -0.2:
+            sentiment = 'negative'
+        else:
+            sentiment = 'neutral'
+        
+        results.append({
+            'relevance': (political + 0.5) / (political + off_topic + 1),
+            'sentiment': sentiment,
+            'bias_score': None,
+            'credibility_score': None,
+            'manipulation_detected': markers >= 2,
+            'summary': None,
+            'keywords': item_keywords,
+            'model': LOCAL_MODEL_VERSION
+        })
+    return results
+
+
+def run_analysis(items, groq_key, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH, preclassify=PRECLASSIFY):
+    """Локальная предварительная классификация и LLM-фаза, возвращает [(item, (is_fake, reason, analysis), error)]"""
+    if not preclassify or not items:
+        return run_llm_analysis(items, groq_key, mode, batch_size)
+    
+    # Уверенно нерелевантные новости (спорт, погода и т.п.) получают локальный анализ без Groq
+    results = []
+    remote = []
+    for item, local in zip(items, preclassify_articles(items)):
+        if local['relevance'] <= 1 - PRECLASSIFY_THRESHOLD:
+            results.append((item, (None, '', local), None))
+        else:
+            remote.append((item, local))
+    log('preclassifier', local=len(results), total=len(items))
+    
+    local_keywords = {id(item): local['keywords'] for item, local in remote}
+    for item, result, error in run_llm_analysis([item for item, _ in remote], groq_key, mode, batch_size):
+        if error is None and result and result[2] is not None and not result[2].get('keywords'):
+            result = (result[0], result[1], {**result[2], 'keywords': local_keywords[id(item)]})
+        results.append((item, result, error))
+    return results
+
+
+def run_llm_analysis(items, groq_key, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH):
+    """LLM-фаза для списка новостей, возвращает [(item, (is_fake, reason, analysis), error)]"""
+    if mode != 'combined':
+        return llm_executor.map(
+            lambda item: analyze_article(item['title'], item['content'], groq_key),
+            items
+        )
+    
+    results = []
+    uncached = []
+    for item in items:
+        cached = llm_cache.get(llm_cache.key('combined', article_text(item['title'], item['content'], 800)))
+        if cached is not None:
+            results.append((item, (cached.get('is_fake'), cached.get('fake_check_reason', ''), cached), None))
+        else:
+            uncached.append(item)
+    
+    batch_size = max(1, batch_size)
+    batches = [uncached[i:i + batch_size] for i in range(0, len(uncached), batch_size)]
+    
+    fallback = []
+    for batch, batch_results, error in llm_executor.map(lambda batch: analyze_combined(batch, groq_key), batches):
+        if error is not None:
+            log('llm.combined_error', level='warning', error=str(error))
+        for i, item in enumerate(batch):
+            result = batch_results[i] if error is None else None
+            if result is None:
+                fallback.append(item)
+            else:
+                results.append((item, result, None))
+    
+    # Новости, которые не удалось разобрать из общего ответа, идут по старому пути из двух вызовов
+    if fallback:
+        log('llm.split_fallback', articles=len(fallback))
+        results.extend(llm_executor.map(
+            lambda item: analyze_article(item['title'], item['content'], groq_key),
+            fallback
+        ))
+    
+    return results
+
+
+def analyze_combined(items, groq_key):
+    """Проверка на фейк и анализ N новостей одним запросом, возвращает список (is_fake, reason, analysis) или None по индексам"""
+    texts = '\n\n'.join(
+        f"[{i}] " + article_text(item['title'], item['content'], 800)
+        for i, item in enumerate(items)
+    )
+    
+    prompt = f"""Проверь на фейк и проанализируй новости:
+
+{texts}
+
+JSON-объект с массивом results, по объекту на каждую новость:
+{{"results": [{{"index": 0, "is_fake": true/false, "fake_check_reason": "объяснение", "sentiment": "positive/negative/neutral", "bias_score": 0-100, "credibility_score": 0-100, "manipulation_detected": true/false, "summary": "текст", "keywords": ["слово1", "слово2"]}}]}}"""
+
+    answer = llm_executor.complete(
+        groq_key,
+        [
+            {'role': 'system', 'content': 'Ты эксперт по фактчекингу и анализу новостей.'},
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature=0.2,
+        max_tokens=350 * len(items)
+    )
+    
+    parsed, truncated = parse_llm_json(answer)
+    if isinstance(parsed, dict):
+        parsed = parsed['results'] if isinstance(parsed.get('results'), list) else [parsed]
+    if truncated:
+        # Последний объект обрезанного ответа мог потерять поля вместе с хвостом
+        parsed = parsed[:-1]
+    
+    by_index = {}
+    for position, entry in enumerate(parsed):
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = parse_entry_index(entry.get('index'), len(items))
+            if index in by_index:
+                raise ValueError(f'Duplicate index {index}')
+            is_fake, reason = validate_fake_check(entry, 'fake_check_reason')
+            if is_fake is None:
+                trace.incr('llm.schema_errors')
+                raise ValueError('Combined entry lacks is_fake')
+            analysis = validate_analysis(entry)
+        except ValueError as e:
+            # Неполная или не привязанная к новости запись уходит в запасной путь из двух вызовов
+            log('llm.combined_entry_rejected', level='warning', position=position, error=str(e))
+            continue
+        by_index[index] = dict(analysis, is_fake=is_fake, fake_check_reason=reason)
+    
+    results = []
+    for i in range(len(items)):
+        entry = by_index.get(i)
+        if entry is None:
+            results.append(None)
+        else:
+            if not truncated:
+                llm_cache.put(llm_cache.key('combined', article_text(items[i]['title'], items[i]['content'], 800)), entry)
+            results.append((entry.get('is_fake'), entry.get('fake_check_reason', ''), entry))
+    return results
+
+
+def parse_entry_index(value, size):
+    """Номер новости из записи общего ответа: целое в [0, size), иначе ValueError — по позиции запись не угадывается"""
+    try:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError
+        index = int(value)
+    except (TypeError, ValueError):
+        index = None
+    if index is None or not 0 <= index < size:
+        trace.incr('llm.schema_errors')
+        raise ValueError(f'Invalid index {value!r} for {size} articles')
+    return index
+
+
+def analyze_article(title, content, groq_key):
+    """Проверка на фейк и полный анализ одной новости (без записи в БД)"""
+    is_fake, reason = check_fake(title, content, groq_key)
+    analysis = analyze_news(title, content, groq_key)
+    return is_fake, reason, analysis
+
+
 def check_fake(title, content, groq_key):
     """Проверка новости на фейк через ИИ"""
     if not groq_key or not title:
         return None, None
     
     try:
-        from groq import Groq
-        client = Groq(api_key=groq_key)
-        
-        text = f"{title}. {content or ''}"[:500]
+        text = article_text(title, content, 500)
+        cache_key = llm_cache.key('fake', text)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached['is_fake'], cached['reason']
         
         prompt = f"""Проверь новость на фейк:
 
@@ -247,9 +1979,9 @@ def check_fake(title, content, groq_key):
 JSON формат:
 {{"is_fake": true/false, "reason": "объяснение"}}"""
 
-        response = client.chat.completions.create(
-            model='llama-3.1-70b-versatile',
-            messages=[
+        answer = llm_executor.complete(
+            groq_key,
+            [
                 {'role': 'system', 'content': 'Ты эксперт по фактчекингу.'},
                 {'role': 'user', 'content': prompt}
             ],
@@ -257,24 +1989,27 @@ JSON формат:
             max_tokens=150
         )
         
-        result = json.loads(response.choices[0].message.content)
-        return result.get('is_fake', False), result.get('reason', '')
+        data, truncated = parse_llm_json(answer)
+        is_fake, reason = validate_fake_check(data)
+        if not truncated:
+            llm_cache.put(cache_key, {'is_fake': is_fake, 'reason': reason})
+        return is_fake, reason
         
+    except LLMDeadlineExceeded:
+        raise
     except Exception as e:
-        print(f'Fake check error: {e}')
+        log('llm.fake_check_error', level='warning', error=str(e))
         return None, None
 
 
-def analyze_and_save(article_id, title, content, groq_key, cur):
-    """Анализ новости и сохранение в БД"""
-    if not groq_key:
-        return
-    
+def analyze_news(title, content, groq_key):
+    """Анализ новости через ИИ, возвращает словарь анализа"""
     try:
-        from groq import Groq
-        client = Groq(api_key=groq_key)
-        
-        text = f"{title}. {content or ''}"[:800]
+        text = article_text(title, content, 800)
+        cache_key = llm_cache.key('analysis', text)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         prompt = f"""Анализ новости:
 
@@ -283,9 +2018,9 @@ def analyze_and_save(article_id, title, content, groq_key, cur):
 JSON:
 {{"sentiment": "positive/negative/neutral", "bias_score": 0-100, "credibility_score": 0-100, "manipulation_detected": true/false, "summary": "текст", "keywords": ["слово1", "слово2"]}}"""
 
-        response = client.chat.completions.create(
-            model='llama-3.1-70b-versatile',
-            messages=[
+        answer = llm_executor.complete(
+            groq_key,
+            [
                 {'role': 'system', 'content': 'Анализ новостей.'},
                 {'role': 'user', 'content': prompt}
             ],
@@ -293,20 +2028,50 @@ JSON:
             max_tokens=250
         )
         
-        analysis = json.loads(response.choices[0].message.content)
+        data, truncated = parse_llm_json(answer)
+        analysis = validate_analysis(data)
+        if not truncated:
+            llm_cache.put(cache_key, analysis)
+        return analysis
         
-        cur.execute("""
-            INSERT INTO news_analysis 
-            (article_id, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (article_id) DO UPDATE SET
-                sentiment = EXCLUDED.sentiment,
-                bias_score = EXCLUDED.bias_score,
-                credibility_score = EXCLUDED.credibility_score,
-                manipulation_detected = EXCLUDED.manipulation_detected,
-                summary = EXCLUDED.summary,
-                keywords = EXCLUDED.keywords
-        """, (
+    except Exception as e:
+        log('llm.analysis_error', level='warning', error=str(e))
+        raise
+
+
+def update_fake_flags(items, cur):
+    """Обновление is_fake одним UPDATE: items = [(article_id, is_fake, reason)]"""
+    if not items:
+        return
+    
+    execute_values(cur, """
+        UPDATE news_articles n
+        SET is_fake = v.is_fake, fake_check_reason = v.reason
+        FROM (VALUES %s) AS v(id, is_fake, reason)
+        WHERE n.id = v.id
+    """, items, template='(%s, %s::boolean, %s)', page_size=len(items))
+
+
+def save_analyses(items, cur):
+    """Сохранение анализов одним multi-row upsert: items = [(article_id, analysis)]"""
+    if not items:
+        return
+    
+    execute_values(cur, """
+        INSERT INTO news_analysis 
+        (article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        SELECT v.article_id, n.collected_at, v.sentiment, v.bias_score, v.credibility_score, v.manipulation_detected, v.summary, v.keywords
+        FROM (VALUES %s) AS v(article_id, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        JOIN news_articles n ON n.id = v.article_id
+        ON CONFLICT (article_id, collected_at) DO UPDATE SET
+            sentiment = EXCLUDED.sentiment,
+            bias_score = EXCLUDED.bias_score,
+            credibility_score = EXCLUDED.credibility_score,
+            manipulation_detected = EXCLUDED.manipulation_detected,
+            summary = EXCLUDED.summary,
+            keywords = EXCLUDED.keywords
+    """, [
+        (
             article_id,
             analysis.get('sentiment'),
             analysis.get('bias_score'),
@@ -314,8 +2079,59 @@ JSON:
             analysis.get('manipulation_detected'),
             analysis.get('summary'),
             analysis.get('keywords', [])
-        ))
-        
-    except Exception as e:
-        print(f'Analysis error: {e}')
-        raise
+        )
+        for article_id, analysis in items
+    ], template='(%s, %s, %s::integer, %s::integer, %s::boolean, %s, %s::text[])', page_size=len(items))
+
+
+def save_analysis(article_id, analysis, cur):
+    """Сохранение анализа новости в БД"""
+    save_analyses([(article_id, analysis)], cur)
+
+
+def propagate_to_duplicates(article_ids, cur):
+    """Перенос проверки на фейк и анализа канонических новостей на их почти-дубли"""
+    cur.execute("""
+        UPDATE news_articles d
+        SET is_fake = c.is_fake, fake_check_reason = c.fake_check_reason,
+            analysis_status = c.analysis_status, analysis_model = c.analysis_model
+        FROM news_articles c
+        WHERE d.duplicate_of = c.id AND c.id = ANY(%s)
+    """, (article_ids,))
+    cur.execute("""
+        INSERT INTO news_analysis 
+        (article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        SELECT d.id, d.collected_at, a.sentiment, a.bias_score, a.credibility_score, a.manipulation_detected, a.summary, a.keywords
+        FROM news_articles d
+        JOIN news_analysis a ON a.article_id = d.duplicate_of
+        WHERE d.duplicate_of = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM news_analysis x WHERE x.article_id = d.id)
+    """, (article_ids,))
+
+
+def analyze_and_save(article_id, title, content, groq_key, cur):
+    """Анализ новости и сохранение в БД"""
+    if not groq_key:
+        return
+    
+    analysis = analyze_news(title, content, groq_key)
+    save_analysis(article_id, analysis, cur)
+
+
+if __name__ == '__main__':
+    import sys
+    
+    if sys.argv[1:] == ['rebuild-stats']:
+        print(json.dumps(rebuild_country_stats(os.environ['DATABASE_URL']), default=str, ensure_ascii=False, indent=2))
+    elif sys.argv[1:] == ['recompute-scores']:
+        print(json.dumps(recompute_country_scores(os.environ['DATABASE_URL']), ensure_ascii=False, indent=2))
+    elif sys.argv[1:] == ['partitions']:
+        with db_connection(os.environ['DATABASE_URL']) as conn:
+            with conn.cursor() as cur:
+                print(json.dumps({'created': ensure_news_partitions(cur)}))
+            conn.commit()
+    elif sys.argv[1:2] == ['retention']:
+        months = int(sys.argv[2]) if len(sys.argv) > 2 else NEWS_RETENTION_MONTHS
+        print(json.dumps(apply_news_retention(os.environ['DATABASE_URL'], months), ensure_ascii=False, indent=2))
+    else:
+        print('Usage: python index.py rebuild-stats | recompute-scores | partitions | retention [months]')
@@ -1,14 +1,888 @@
+import base64
+import functools
+import gzip
+import hashlib
+import io
 import json
 import os
-from datetime import datetime
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+
+LLM_MODEL = 'llama-3.1-70b-versatile'
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '8'))
+GROQ_RPM = int(os.environ.get('GROQ_RPM', '30'))
+GROQ_TPM = int(os.environ.get('GROQ_TPM', '0'))
+ANALYSIS_MODE = os.environ.get('ANALYSIS_MODE', 'split')
+ANALYSIS_BATCH = int(os.environ.get('ANALYSIS_BATCH', '5'))
+LLM_CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', '5000'))
+LLM_JSON_MODE = os.environ.get('LLM_JSON_MODE', '1') == '1'
+PROMPT_VERSION = '2'
+ANALYSIS_MODEL_VERSION = f'{LLM_MODEL}/v{PROMPT_VERSION}'
+PRECLASSIFY = os.environ.get('PRECLASSIFY', '1') == '1'
+PRECLASSIFY_THRESHOLD = float(os.environ.get('PRECLASSIFY_THRESHOLD', '0.8'))
+PRECLASSIFY_KEYWORDS = 5
+LOCAL_MODEL_VERSION = 'local-lexicon/v1'
+
+STOPWORDS = frozenset('''
+the and for that with from this have has had was were are been will would could should their they them there
+what when where which who whom into over after before about than then also just more most some such only other
+said says new its his her our your not but all can may one two out year years time today week
+это как что для его она они при над под без или так уже еще ещё был была были будет также после которые который
+'''.split())
+
+POLITICAL_TERMS = frozenset('''
+election elections vote voters voting ballot referendum parliament parliamentary senate congress duma bundestag
+government minister ministers president presidential prime premier chancellor cabinet kremlin regime
+opposition party parties coalition campaign candidate democracy democratic authoritarian dictator
+law laws legislation bill court courts judge ruling constitution constitutional sanctions sanction
+protest protests protesters rally crackdown arrest arrested detained prisoner dissident censorship
+diplomat diplomatic embassy treaty summit nato military army troops war invasion ceasefire policy
+corruption propaganda journalist journalists media press freedom rights activist activists
+выборы голосование парламент правительство министр президент премьер оппозиция партия закон суд
+санкции протест протесты митинг задержан арест цензура журналист свобода война армия политика
+'''.split())
+
+OFF_TOPIC_TERMS = frozenset('''
+football soccer basketball tennis hockey league match goal goals score scored championship tournament
+olympic olympics athlete coach playoff fans stadium weather forecast rain snow temperature sunny storm
+recipe recipes cooking restaurant celebrity actress actor movie film album singer concert fashion
+iphone smartphone gadget game gaming videogame review trailer horoscope lottery
+футбол хоккей матч чемпионат турнир погода прогноз рецепт фильм сериал концерт
+'''.split())
+
+POSITIVE_TERMS = frozenset('''
+agreement agree peace progress growth improve improved improvement success successful win support
+welcome welcomed praise praised reform reforms release released cooperation stable recovery boost
+соглашение мир рост успех поддержка реформа сотрудничество
+'''.split())
+
+NEGATIVE_TERMS = frozenset('''
+crisis attack attacks killed death deaths war conflict violence crackdown arrest arrested threat threats
+collapse decline sanctions condemn condemned accuse accused scandal corruption fraud protest protests
+кризис атака погибли смерть война конфликт насилие угроза скандал коррупция
+'''.split())
+
+MANIPULATION_MARKERS = frozenset('''
+shocking shock unbelievable outrageous exposed secret secretly bombshell scandalous truth hidden
+everyone nobody always never must urgent destroy destroyed traitor traitors enemy enemies
+шок сенсация разоблачение предатель враг позор
+'''.split())
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_HEALTHCHECK_IDLE = int(os.environ.get('DB_HEALTHCHECK_IDLE', '30'))
+TRACE_DEBUG = os.environ.get('TRACE_DEBUG', '0') == '1'
+MAX_PAGE_SIZE = 100
+NEWS_HOT_DAYS = int(os.environ.get('NEWS_HOT_DAYS', '45'))
+SEARCH_MAX_MATCHES = int(os.environ.get('SEARCH_MAX_MATCHES', '5000'))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '15'))
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5
+NEWSAPI_URL = os.environ.get('NEWSAPI_URL', 'https://newsapi.org/v2/everything')
+NEWSAPI_PAGE_SIZE = int(os.environ.get('NEWSAPI_PAGE_SIZE', '10'))
+NEWSAPI_MAX_PAGES = int(os.environ.get('NEWSAPI_MAX_PAGES', '5'))
+NEWS_PARTITIONS_AHEAD = int(os.environ.get('NEWS_PARTITIONS_AHEAD', '3'))
+ANALYSIS_TIME_BUDGET = float(os.environ.get('ANALYSIS_TIME_BUDGET', '25'))
+ANALYSIS_SAFETY_MARGIN = float(os.environ.get('ANALYSIS_SAFETY_MARGIN', '3'))
+ANALYSIS_LEASE_SECONDS = int(os.environ.get('ANALYSIS_LEASE_SECONDS', '300'))
+BACKFILL_CHUNK = int(os.environ.get('BACKFILL_CHUNK', '1000'))
+BACKFILL_COLUMNS = (
+    'id', 'country_code', 'title', 'content', 'source', 'source_type', 'url', 'published_at', 'collected_at',
+    'minhash', 'minhash_bands', 'duplicate_of', 'analysis_status'
+)
+
+COUNTRY_KEYWORDS = {
+    'RU': 'Russia OR Россия',
+    'US': 'USA OR America',
+    'DE': 'Germany OR Deutschland',
+    'CN': 'China',
+    'NO': 'Norway',
+    'BY': 'Belarus',
+    'FR': 'France',
+    'JP': 'Japan'
+}
+
+NEWS_FIELDS = {
+    'id': 'n.id',
+    'title': 'n.title',
+    'content': 'n.content',
+    'source': 'n.source',
+    'source_type': 'n.source_type',
+    'url': 'n.url',
+    'published_at': 'n.published_at',
+    'is_fake': 'n.is_fake',
+    'fake_check_reason': 'n.fake_check_reason',
+    'sentiment': 'a.sentiment',
+    'bias_score': 'a.bias_score',
+    'credibility_score': 'a.credibility_score',
+    'manipulation_detected': 'a.manipulation_detected',
+    'summary': 'a.summary'
+}
+COMPACT_EXCLUDED_FIELDS = ('content', 'fake_check_reason')
+
+_module_loaded_at = time.perf_counter()
+_invocations = 0
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+MINHASH_THRESHOLD = float(os.environ.get('MINHASH_THRESHOLD', '0.7'))
+MERSENNE_PRIME = (1 << 61) - 1
+MINHASH_COEFFICIENTS = [
+    (random.Random(seed).randrange(1, MERSENNE_PRIME), random.Random(-seed).randrange(MERSENNE_PRIME))
+    for seed in range(1, MINHASH_PERMUTATIONS + 1)
+]
+
+
+_db_pool = None
+_db_pool_url = None
+_db_last_used = {}
+_groq_client = None
+_groq_client_key = None
+_http_session = None
+_resources_lock = threading.Lock()
+
+
+class Trace:
+    """Метрики одного вызова: спаны по стадиям (число, сумма и максимум времени), счётчики и токены LLM"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, invocation=None, debug=TRACE_DEBUG):
+        with self.lock:
+            self.invocation = invocation
+            self.debug = debug
+            self.started = time.perf_counter()
+            self.spans = {}
+            self.counters = {}
+            self.tokens = {'prompt': 0, 'completion': 0}
+
+    @contextmanager
+    def span(self, name):
+        """Замер стадии; исключение внутри считается в счётчике <name>.errors"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incr(f'{name}.errors')
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self.lock:
+            span = self.spans.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            span['count'] += 1
+            span['total_ms'] += seconds * 1000
+            span['max_ms'] = max(span['max_ms'], seconds * 1000)
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_usage(self, usage):
+        """Токены из usage ответа Groq"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        with self.lock:
+            self.tokens['prompt'] += prompt_tokens
+            self.tokens['completion'] += completion_tokens
+        return prompt_tokens, completion_tokens
+
+    def summary(self):
+        with self.lock:
+            return {
+                'invocation': self.invocation,
+                'duration_ms': round((time.perf_counter() - self.started) * 1000, 1),
+                'spans': {
+                    name: {'count': span['count'], 'total_ms': round(span['total_ms'], 1), 'max_ms': round(span['max_ms'], 1)}
+                    for name, span in sorted(self.spans.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'tokens': dict(self.tokens)
+            }
+
+
+trace = Trace()
+
+
+def log(event, level='info', **fields):
+    """Структурированный лог: одна строка JSON на событие"""
+    print(json.dumps({'level': level, 'event': event, 'invocation': trace.invocation, **fields}, default=str, ensure_ascii=False))
+
+
+def attach_trace(response, summary):
+    """Сводка вызова в заголовке X-Trace ответа (в режиме debug)"""
+    headers = response.setdefault('headers', {})
+    headers['X-Trace'] = json.dumps(summary, separators=(',', ':'))
+    exposed = headers.get('Access-Control-Expose-Headers')
+    headers['Access-Control-Expose-Headers'] = f'{exposed}, X-Trace' if exposed else 'X-Trace'
+
+
+def sql_span(query):
+    """Имя спана запроса по первой команде SQL: db.select, db.insert, db.with..."""
+    head = query[:64].decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)[:64]
+    words = head.split(None, 1)
+    return f'db.{words[0].lower()}' if words else 'db.query'
+
+
+_traced_cursors = {}
+
+
+def traced_cursor(base):
+    """Подкласс курсора base, который пишет каждый запрос в спан trace"""
+    if base not in _traced_cursors:
+        class TracedCursor(base):
+            def execute(self, query, vars=None):
+                with trace.span(sql_span(query)):
+                    return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                with trace.span(sql_span(query)):
+                    return super().executemany(query, vars_list)
+
+            def copy_expert(self, sql, file, size=8192):
+                with trace.span('db.copy'):
+                    return super().copy_expert(sql, file, size)
+
+        _traced_cursors[base] = TracedCursor
+    return _traced_cursors[base]
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    """Соединение пула: курсоры любого cursor_factory оборачиваются в traced_cursor"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=traced_cursor(base), **kwargs)
+
+
+def parse_llm_json(answer):
+    """
+    JSON из ответа LLM -> (значение, truncated): строгий разбор, иначе извлечение из markdown-блока или текста вокруг
+    и починка обрезанного по max_tokens ответа (truncated=True — недописанный хвост отброшен, кешировать такое нельзя).
+    Счётчики: llm.json_parsed, llm.json_repaired, llm.json_truncated, llm.parse_errors
+    """
+    try:
+        parsed = json.loads(answer)
+        trace.incr('llm.json_parsed')
+        return parsed, False
+    except (TypeError, ValueError):
+        pass
+    
+    parsed, truncated = extract_json(answer or '')
+    if parsed is None:
+        trace.incr('llm.parse_errors')
+        raise ValueError(f'Unparseable LLM response: {(answer or "")[:200]!r}')
+    trace.incr('llm.json_parsed')
+    trace.incr('llm.json_repaired')
+    if truncated:
+        trace.incr('llm.json_truncated')
+    return parsed, truncated
+
+
+def extract_json(text):
+    """Первый JSON-объект или массив в тексте (с преамбулой, ```json-блоком, хвостом или обрывом) -> (значение или None, обрыв)"""
+    fenced = re.search(r'```(?:json)?\s*(.*?)(?:```|$)', text, re.DOTALL | re.IGNORECASE)
+    candidates = [fenced.group(1)] if fenced else []
+    candidates.append(text)
+    
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        starts = [i for i in (candidate.find('{'), candidate.find('[')) if i >= 0]
+        if not starts:
+            continue
+        body = candidate[min(starts):]
+        for attempt in (body, re.sub(r',\s*([}\]])', r'\1', body)):
+            try:
+                return decoder.raw_decode(attempt)[0], False
+            except ValueError:
+                pass
+        repaired = close_truncated_json(body)
+        if repaired is not None:
+            return repaired, True
+    return None, False
+
+
+def close_truncated_json(text):
+    """Дописывает закрывающие кавычки и скобки обрезанному JSON, отбрасывая недописанный хвост"""
+    stack = []
+    in_string = False
+    escaped = False
+    # Позиции, после которых JSON можно корректно закрыть: конец значения на любом уровне вложенности
+    cut_points = []
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+                cut_points.append((i + 1, list(stack)))
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, list(stack)))
+            if not stack:
+                break
+        elif char == ',':
+            cut_points.append((i, list(stack)))
+    
+    if in_string and stack:
+        # Обрыв внутри строкового значения: дописываем кавычку, чтобы сохранить начало текста
+        cut_points.append((len(text), stack + ['"']))
+    
+    for end, open_brackets in reversed(cut_points[-50:]):
+        candidate = re.sub(r'[\s,:]+$', '', text[:end])
+        candidate += ''.join(reversed(open_brackets))
+        try:
+            return json.loads(re.sub(r',\s*([}\]])', r'\1', candidate))
+        except ValueError:
+            continue
+    return None
+
+
+def to_score(value):
+    """Оценка 0-100 из числа или строки ('75', '75%', '7.5'); вне диапазона — обрезается, мусор — None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, str):
+        match = re.search(r'-?\d+(?:[.,]\d+)?', value)
+        if not match:
+            return None
+        value = float(match.group(0).replace(',', '.'))
+    if not isinstance(value, (int, float)) or value != value:
+        return None
+    clamped = min(100, max(0, value))
+    if clamped != value:
+        trace.incr('llm.values_clamped')
+    return int(round(clamped))
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    text = str(value).strip().lower()
+    if text in ('true', 'yes', 'да', '1'):
+        return True
+    if text in ('false', 'no', 'нет', '0'):
+        return False
+    return None
+
+
+def normalize_sentiment(value):
+    """positive/negative/neutral из ответа модели (регистр, русские варианты, mixed -> neutral)"""
+    if not value:
+        return None
+    text = str(value).strip().lower()
+    if text.startswith(('pos', 'позит', 'полож')):
+        return 'positive'
+    if text.startswith(('neg', 'негат', 'отриц')):
+        return 'negative'
+    return 'neutral'
+
+
+def normalize_keywords(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        return []
+    keywords = []
+    for keyword in value:
+        keyword = str(keyword).strip()[:100] if keyword is not None else ''
+        if keyword and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords[:10]
+
+
+def validate_analysis(data):
+    """
+    Приводит ответ модели к схеме news_analysis: оценки 0-100, sentiment из трёх значений, список ключевых слов.
+    Без sentiment, bias_score или credibility_score анализ не принимается: новость осталась бы done с пустыми полями
+    """
+    if not isinstance(data, dict):
+        trace.incr('llm.schema_errors')
+        raise ValueError('Analysis is not a JSON object')
+    analysis = dict(
+        data,
+        sentiment=normalize_sentiment(data.get('sentiment')),
+        bias_score=to_score(data.get('bias_score')),
+        credibility_score=to_score(data.get('credibility_score')),
+        manipulation_detected=to_bool(data.get('manipulation_detected')),
+        summary=str(data.get('summary') or '')[:2000],
+        keywords=normalize_keywords(data.get('keywords'))
+    )
+    missing = [field for field in ('sentiment', 'bias_score', 'credibility_score') if analysis[field] is None]
+    if missing:
+        trace.incr('llm.schema_errors')
+        raise ValueError(f"Analysis lacks {', '.join(missing)}")
+    return analysis
+
+
+def validate_fake_check(data, reason_key='reason'):
+    """Ответ проверки на фейк -> (is_fake или None, если модель не дала однозначного ответа, reason)"""
+    if not isinstance(data, dict):
+        trace.incr('llm.schema_errors')
+        raise ValueError('Fake check is not a JSON object')
+    return to_bool(data.get('is_fake')), str(data.get(reason_key) or '')[:1000]
+
+
+def get_db_pool(db_url):
+    """Пул соединений процесса, переживает тёплые вызовы"""
+    global _db_pool, _db_pool_url
+    with _resources_lock:
+        if _db_pool is None or _db_pool.closed or _db_pool_url != db_url:
+            from psycopg2.pool import ThreadedConnectionPool
+            if _db_pool is not None and not _db_pool.closed:
+                _db_pool.closeall()
+            _db_pool = ThreadedConnectionPool(1, DB_POOL_SIZE, db_url, connection_factory=TracedConnection)
+            _db_pool_url = db_url
+        return _db_pool
+
+
+def is_connection_alive(conn):
+    """Проверка соединения: давно простаивавшее пингуем через SELECT 1"""
+    if conn.closed:
+        return False
+    last_used = _db_last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_HEALTHCHECK_IDLE:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def db_connection(db_url):
+    """Соединение из пула с переподключением; незакоммиченная транзакция откатывается при возврате"""
+    pool = get_db_pool(db_url)
+    conn = pool.getconn()
+    attempts = 0
+    while not is_connection_alive(conn) and attempts < DB_POOL_SIZE:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+        attempts += 1
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        _db_last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def get_groq_client(groq_key):
+    """Один клиент Groq на процесс: HTTP-соединение и TLS переиспользуются"""
+    global _groq_client, _groq_client_key
+    with _resources_lock:
+        if _groq_client is None or _groq_client_key != groq_key:
+            from groq import Groq
+            _groq_client = Groq(api_key=groq_key)
+            _groq_client_key = groq_key
+        return _groq_client
+
+
+def get_http_session():
+    """Один requests.Session на процесс для запросов к NewsAPI"""
+    global _http_session
+    with _resources_lock:
+        if _http_session is None:
+            import requests
+            _http_session = requests.Session()
+        return _http_session
+
+
+class TokenBucket:
+    """Потокобезопасное ведро токенов для лимита «N в минуту»"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+    def acquire(self, amount=1, deadline=None):
+        """Ждёт токены; если их не накопится к deadline (time.monotonic()), сразу возвращает False, ничего не списав"""
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LLMDeadlineExceeded(Exception):
+    """Лимит RPM/TPM не даст сделать вызов до дедлайна вызова функции"""
+
+
+class LLMExecutor:
+    """Параллельное выполнение LLM-вызовов с ограничением RPM/TPM"""
+
+    def __init__(self, workers=LLM_CONCURRENCY, rpm=GROQ_RPM, tpm=GROQ_TPM):
+        self.workers = max(1, workers)
+        self.requests_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens_bucket = TokenBucket(tpm) if tpm > 0 else None
+        # time.monotonic(), после которого новые вызовы не начинаются (ставит collect_news)
+        self.deadline = None
+
+    def throttle(self, estimated_tokens):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise LLMDeadlineExceeded('Invocation deadline reached')
+        if self.requests_bucket and not self.requests_bucket.acquire(1, self.deadline):
+            raise LLMDeadlineExceeded('Request rate limit would outlast the invocation')
+        if self.tokens_bucket and not self.tokens_bucket.acquire(estimated_tokens, self.deadline):
+            raise LLMDeadlineExceeded('Token rate limit would outlast the invocation')
+
+    def available_requests(self):
+        """Запросы, доступные без ожидания по RPM (None — лимита нет)"""
+        return self.requests_bucket.available() if self.requests_bucket else None
+
+    def complete(self, groq_key, messages, temperature, max_tokens, json_mode=LLM_JSON_MODE):
+        """Один chat completion с учётом лимитов, возвращает текст ответа (json_mode — response_format json_object)"""
+        prompt_chars = sum(len(m['content']) for m in messages)
+        with trace.span('groq.throttle'):
+            self.throttle(prompt_chars // 4 + max_tokens)
+
+        client = get_groq_client(groq_key)
+        started = time.perf_counter()
+        with trace.span('groq.call'):
+            response = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **({'response_format': {'type': 'json_object'}} if json_mode else {})
+            )
+        prompt_tokens, completion_tokens = trace.add_usage(getattr(response, 'usage', None))
+        if trace.debug:
+            log('groq.call', duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return response.choices[0].message.content
+
+    def map(self, fn, items):
+        """Применяет fn к items в пуле потоков, возвращает [(item, result, error)] в исходном порядке"""
+        items = list(items)
+        if not items:
+            return []
+
+        def run(item):
+            try:
+                return item, fn(item), None
+            except Exception as e:
+                return item, None, e
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as pool:
+            return list(pool.map(run, items))
+
+
+llm_executor = LLMExecutor()
+
+
+class LLMCache:
+    """LRU-кеш результатов LLM по хешу нормализованного текста с таблицей llm_cache в БД"""
+
+    def __init__(self, max_size=LLM_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, text):
+        normalized = ' '.join((text or '').lower().split())
+        raw = f'{LLM_MODEL}|{PROMPT_VERSION}|{kind}|{normalized}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, persist=True):
+        with self.lock:
+            self._store(key, value)
+            if persist:
+                self.pending[key] = value
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def preload(self, conn, keys):
+        """Подгружает из БД записи, которых нет в памяти, одним запросом"""
+        with self.lock:
+            missing = [k for k in set(keys) if k not in self.entries]
+        if not missing:
+            return
+        with conn.cursor() as cur:
+            cur.execute("SELECT cache_key, result FROM llm_cache WHERE cache_key = ANY(%s)", (missing,))
+            rows = cur.fetchall()
+        with self.lock:
+            for cache_key, result in rows:
+                self._store(cache_key, result)
+
+    def flush(self, conn):
+        """Сохраняет новые записи в БД (в текущей транзакции)"""
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending.clear()
+        if not pending:
+            return
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO llm_cache (cache_key, model, prompt_version, result)
+                VALUES %s
+                ON CONFLICT (cache_key) DO NOTHING
+            """, [(k, LLM_MODEL, PROMPT_VERSION, Json(v)) for k, v in pending])
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+llm_cache = LLMCache()
+
+
+class ResponseCache:
+    """TTL/LRU-кеш готовых ответов GET с привязкой к версии данных страны"""
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version=None):
+        """Без version — запись, свежая по TTL; с version — запись той же версии (TTL продлевается)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if version is None:
+                if time.monotonic() - entry['checked_at'] > self.ttl:
+                    return None
+            elif entry['version'] != version:
+                return None
+            entry['checked_at'] = time.monotonic()
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body):
+        etag = '"' + hashlib.sha1(f'{version}|{key}'.encode('utf-8')).hexdigest()[:20] + '"'
+        entry = {'version': version, 'etag': etag, 'body': body, 'checked_at': time.monotonic()}
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, country_code):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == country_code]:
+                del self.entries[key]
+
+
+response_cache = ResponseCache()
+
+
+def json_value(value):
+    """Значение для JSON без fallback default=str: даты форматируются напрямую в том же виде, что str()"""
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def encode_news(rows, fmt=None):
+    """
+    Новости для ответа: список объектов (по умолчанию) или format=columns —
+    имена полей один раз и массивы значений по строкам
+    """
+    if not rows:
+        return {'columns': [], 'rows': []} if fmt == 'columns' else []
+    columns = list(rows[0])
+    # Колонки с датами/Decimal определяются по первой строке с непустым значением, остальные копируются как есть
+    converted = set()
+    for column in columns:
+        sample = next((row[column] for row in rows if row[column] is not None), None)
+        if isinstance(sample, (datetime, date, Decimal)):
+            converted.add(column)
+    if fmt == 'columns':
+        return {
+            'columns': columns,
+            'rows': [[json_value(row[c]) if c in converted else row[c] for c in columns] for row in rows]
+        }
+    # Строки — собственные dict из курсора, значения заменяются на месте без копирования
+    for row in rows:
+        for column in converted:
+            row[column] = json_value(row[column])
+    return rows
+
+
+def dump_json(payload):
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def accepted_encoding(accept_encoding):
+    """br или gzip из Accept-Encoding клиента (с учётом q=0), иначе None"""
+    accepted = {}
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    for encoding in ('br', 'gzip'):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body, encoding):
+    """Сжатое тело в base64 для ответа с isBase64Encoded"""
+    data = body.encode('utf-8')
+    if encoding == 'br':
+        import brotli
+        data = brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+    return base64.b64encode(data).decode('ascii')
+
+
+def response_encoding(body, request_headers):
+    """Кодирование, в котором уйдёт тело: br/gzip по Accept-Encoding или None (маленькие тела не сжимаются)"""
+    if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return None
+    return accepted_encoding(request_headers.get('accept-encoding'))
+
+
+def encoding_etag(etag, encoding):
+    """Сильный ETag отдельного представления: у сжатых вариантов суффикс кодирования ("…-gzip", "…-br")"""
+    if not etag or not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def encoded_response(body, headers, request_headers, entry=None):
+    """
+    Ответ 200 с телом, сжатым по Accept-Encoding клиента; маленькие тела отдаются как есть.
+    Сжатые варианты кешируются в записи кеша ответов вместе с телом, ETag получает суффикс кодирования
+    """
+    encoding = response_encoding(body, request_headers)
+    headers['Vary'] = 'Accept-Encoding'
+    if encoding is None:
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': body,
+            'isBase64Encoded': False
+        }
+    
+    variants = entry.setdefault('encoded', {}) if entry is not None else {}
+    if encoding not in variants:
+        with trace.span('compress'):
+            variants[encoding] = compress_body(body, encoding)
+    headers['Content-Encoding'] = encoding
+    if headers.get('ETag'):
+        headers['ETag'] = encoding_etag(headers['ETag'], encoding)
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': variants[encoding],
+        'isBase64Encoded': True
+    }
 
 
 def handler(event, context):
     """
     Автоматический сбор новостей из различных источников с проверкой на фейки для политического анализа
     """
+    global _invocations
+    started = time.perf_counter()
+    cold = _invocations == 0
+    _invocations += 1
+    params = event.get('queryStringParameters') or {}
+    trace.reset(getattr(context, 'request_id', None) or _invocations, TRACE_DEBUG or params.get('debug') == '1')
+    
+    response = None
+    try:
+        response = handle_request(event, context)
+        return response
+    finally:
+        summary = trace.summary()
+        log(
+            'invocation',
+            cold=cold,
+            since_load_ms=round((started - _module_loaded_at) * 1000, 1),
+            status=response['statusCode'] if response else None,
+            **{key: value for key, value in summary.items() if key != 'invocation'}
+        )
+        if response is not None and trace.debug:
+            attach_trace(response, summary)
+
+
+def handle_request(event, context):
+    """Обработка HTTP-запроса"""
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -17,7 +891,7 @@ def handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, Accept-Encoding',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -27,36 +901,109 @@ def handler(event, context):
     try:
         params = event.get('queryStringParameters') or {}
         country_code = params.get('country', 'RU')
-        limit = int(params.get('limit', '20'))
+        limit = min(int(params.get('limit', '20')), MAX_PAGE_SIZE)
+        cursor = params.get('cursor')
+        fields = parse_fields(params.get('fields'), params.get('view'))
+        mode = params.get('mode', ANALYSIS_MODE)
+        batch_size = int(params.get('batch', ANALYSIS_BATCH))
+        fmt = 'columns' if params.get('format') == 'columns' else None
+        request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
         
         db_url = os.environ.get('DATABASE_URL')
         news_api_key = os.environ.get('NEWS_API_KEY')
         groq_key = os.environ.get('GROQ_API_KEY')
         
-        print(f'Method: {method}, Country: {country_code}')
-        print(f'Has NEWS_API_KEY: {bool(news_api_key)}, Has GROQ_KEY: {bool(groq_key)}')
+        log('request', method=method, country=country_code, has_news_api_key=bool(news_api_key), has_groq_key=bool(groq_key))
+        
+        if method == 'GET' and params.get('action') == 'search':
+            news, next_cursor = search_news(db_url, parse_search_filters(params), limit, cursor, fields)
+            with trace.span('serialize'):
+                body = dump_json({
+                    'news': encode_news(news, fmt),
+                    'count': len(news),
+                    'nextCursor': next_cursor
+                })
+            
+            return encoded_response(body, {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            }, request_headers)
+        
+        if method == 'POST':
+            if news_api_key:
+                with trace.span('collect'):
+                    summary = collect_news(db_url, news_api_key, groq_key, country_code, mode, batch_size, context)
+            else:
+                summary = {'countries': [], 'collected': 0, 'analyzed': 0, 'queued': 0}
+            for collected in summary['countries']:
+                response_cache.invalidate(collected)
+            
+            # Новости после сбора клиент читает отдельным GET: анализ части из них ещё в очереди analyze-news
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(summary),
+                'isBase64Encoded': False
+            }
         
-        if method == 'POST' and news_api_key:
-            print('Starting news collection...')
-            collect_news(db_url, news_api_key, groq_key, country_code)
-            print('News collection completed')
+        # Повторные опросы отдаются из кеша: в пределах TTL без запросов к БД,
+        # после TTL — одной проверкой версии данных страны
+        cache_key = (country_code, limit, cursor, ','.join(fields), fmt)
+        entry = response_cache.get(cache_key) if method == 'GET' else None
+        if entry is None:
+            version = get_data_version(db_url, country_code)
+            entry = response_cache.get(cache_key, version)
+        if entry is None:
+            news, next_cursor = get_news_from_db(db_url, country_code, limit, cursor, fields)
+            with trace.span('serialize'):
+                body = dump_json({
+                    'news': encode_news(news, fmt),
+                    'count': len(news),
+                    'country': country_code,
+                    'nextCursor': next_cursor
+                })
+            # Без версии (ошибка чтения) ответ не кешируем
+            entry = response_cache.put(cache_key, version, body) if version is not None else {'etag': None, 'body': body}
         
-        news = get_news_from_db(db_url, country_code, limit)
+        # Сжатый и несжатый варианты — разные представления, у каждого свой ETag
+        etag = encoding_etag(entry['etag'], response_encoding(entry['body'], request_headers))
+        if etag and request_headers.get('if-none-match') == etag:
+            return {
+                'statusCode': 304,
+                'headers': {
+                    'ETag': etag,
+                    'Vary': 'Accept-Encoding',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'ETag'
+                },
+                'body': '',
+                'isBase64Encoded': False
+            }
         
+        headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+        if entry['etag']:
+            headers['ETag'] = entry['etag']
+        
+        return encoded_response(entry['body'], headers, request_headers, entry)
+        
+    except ValueError as e:
+        # Некорректные параметры запроса (cursor, limit, batch, from/to) — ошибка клиента, а не сервера
         return {
-            'statusCode': 200,
+            'statusCode': 400,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'news': news,
-                'count': len(news),
-                'country': country_code
-            }, default=str),
+            'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
-        
     except Exception as e:
         return {
             'statusCode': 500,
@@ -69,109 +1016,1373 @@ def handler(event, context):
         }
 
 
-def get_news_from_db(db_url, country_code, limit):
-    """Получение новостей из БД"""
+def get_data_version(db_url, country_code):
+    """Версия данных страны (country_stats.data_version растёт при каждой записи новостей и анализов)"""
     if not db_url:
-        return []
+        return 0
     
     try:
-        conn = psycopg2.connect(db_url)
-        try:
+        with db_connection(db_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT data_version FROM country_stats WHERE country_code = %s", (country_code,))
+                row = cur.fetchone()
+                return row[0] if row else 0
+    except Exception as e:
+        log('data_version.error', level='error', error=str(e))
+        return None
+
+
+def parse_fields(fields=None, view=None):
+    """Список полей ответа: явный fields=a,b,c или view=compact без тяжёлых текстовых полей"""
+    if fields:
+        selected = [name for name in fields.split(',') if name in NEWS_FIELDS]
+    elif view == 'compact':
+        selected = [name for name in NEWS_FIELDS if name not in COMPACT_EXCLUDED_FIELDS]
+    else:
+        selected = list(NEWS_FIELDS)
+    
+    # id и published_at нужны для курсора
+    for required in ('published_at', 'id'):
+        if required not in selected:
+            selected.insert(0, required)
+    return selected
+
+
+def encode_cursor(published_at, article_id):
+    raw = json.dumps([published_at.isoformat(), article_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Курсор (published_at, id) из encode_cursor; испорченный курсор — ValueError, обработчик ответит 400"""
+    try:
+        published_at, article_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(published_at), int(article_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def decode_rank_cursor(cursor):
+    """Курсор поиска (rank, id); испорченный курсор — ValueError, обработчик ответит 400"""
+    try:
+        rank, article_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(rank), int(article_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def get_news_from_db(db_url, country_code, limit, cursor=None, fields=None):
+    """
+    Получение страницы новостей из БД (keyset-пагинация по published_at, id), возвращает (новости, курсор).
+    Сначала читаются только секции последних NEWS_HOT_DAYS дней по collected_at, весь архив — если их не хватило
+    """
+    if not db_url:
+        return [], None
+    
+    fields = fields or list(NEWS_FIELDS)
+    columns = ', '.join(f'{NEWS_FIELDS[name]} AS {name}' for name in fields)
+    join = 'LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at' if any(NEWS_FIELDS[name].startswith('a.') for name in fields) else ''
+    
+    after = ''
+    after_params = []
+    if cursor:
+        after = 'AND (n.published_at, n.id) < (%s, %s)'
+        after_params = list(decode_cursor(cursor))
+    
+    # Новость публикуется раньше, чем собирается, поэтому в старых секциях published_at < hot_since.
+    # Страница из свежих секций точна, если её последняя новость новее hot_since (с запасом на разницу часовых поясов)
+    hot_since = datetime.now() - timedelta(days=NEWS_HOT_DAYS)
+    margin = timedelta(days=1)
+    
+    try:
+        with db_connection(db_url) as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        n.id, n.title, n.content, n.source, n.source_type,
-                        n.url, n.published_at, n.is_fake, n.fake_check_reason,
-                        a.sentiment, a.bias_score, a.credibility_score,
-                        a.manipulation_detected, a.summary
-                    FROM news_articles n
-                    LEFT JOIN news_analysis a ON a.article_id = n.id
-                    WHERE n.country_code = %s
-                    ORDER BY n.published_at DESC
-                    LIMIT %s
-                """, (country_code, limit))
+                rows = None
+                if NEWS_HOT_DAYS > 0 and (not after_params or after_params[0] >= hot_since + margin):
+                    cur.execute(f"""
+                        SELECT {columns}
+                        FROM news_articles n
+                        {join}
+                        WHERE n.country_code = %s AND n.collected_at >= %s {after}
+                        ORDER BY n.published_at DESC, n.id DESC
+                        LIMIT %s
+                    """, [country_code, hot_since, *after_params, limit])
+                    rows = [dict(row) for row in cur.fetchall()]
+                    if len(rows) < limit or rows[-1]['published_at'] is None or rows[-1]['published_at'] < hot_since + margin:
+                        trace.incr('news.hot_miss')
+                        rows = None
                 
-                rows = cur.fetchall()
-                return [dict(row) for row in rows]
-        finally:
-            conn.close()
+                if rows is None:
+                    cur.execute(f"""
+                        SELECT {columns}
+                        FROM news_articles n
+                        {join}
+                        WHERE n.country_code = %s {after}
+                        ORDER BY n.published_at DESC, n.id DESC
+                        LIMIT %s
+                    """, [country_code, *after_params, limit])
+                    rows = [dict(row) for row in cur.fetchall()]
+                
+                next_cursor = None
+                if len(rows) == limit and rows[-1]['published_at'] is not None:
+                    next_cursor = encode_cursor(rows[-1]['published_at'], rows[-1]['id'])
+                return rows, next_cursor
     except Exception:
-        return []
+        return [], None
+
+
+def parse_search_filters(params):
+    """Фильтры поиска из query-параметров: q, keywords=a,b, country (ALL — все), from, to, fake, manipulation"""
+    def flag(value):
+        return None if not value else value.lower() in ('1', 'true', 'yes')
+    
+    country = params.get('country')
+    return {
+        'q': (params.get('q') or '').strip() or None,
+        'keywords': [keyword.strip() for keyword in (params.get('keywords') or '').split(',') if keyword.strip()],
+        'country': country if country and country != 'ALL' else None,
+        'from': datetime.fromisoformat(params['from']) if params.get('from') else None,
+        'to': datetime.fromisoformat(params['to']) if params.get('to') else None,
+        'is_fake': flag(params.get('fake')),
+        'manipulation': flag(params.get('manipulation'))
+    }
+
+
+def search_filter_sql(filters):
+    """Условия WHERE по фильтрам поиска (алиасы n — news_articles, a — news_analysis)"""
+    conditions = []
+    if filters['country']:
+        conditions.append('n.country_code = %(country)s')
+    if filters['from']:
+        conditions.append('n.published_at >= %(from)s')
+    if filters['to']:
+        conditions.append('n.published_at < %(to)s')
+    if filters['is_fake'] is not None:
+        conditions.append('n.is_fake = %(is_fake)s')
+    if filters['manipulation'] is not None:
+        conditions.append('a.manipulation_detected = %(manipulation)s')
+    if filters['keywords']:
+        # GIN-индекс по news_analysis.keywords
+        conditions.append('a.keywords @> %(keywords)s::text[]')
+    return ''.join(f' AND {condition}' for condition in conditions)
+
+
+def search_news(db_url, filters, limit, cursor=None, fields=None):
+    """
+    Поиск новостей, возвращает (новости, курсор).
+    С q — полнотекстовый поиск по title/content (search_vector) и summary анализа (summary_vector),
+    сортировка по релевантности, курсор по (rank, id); ранжируются не более SEARCH_MAX_MATCHES
+    самых свежих совпадений каждого индекса. Без q — фильтры и keyset по (published_at, id)
+    """
+    if not db_url:
+        return [], None
+    
+    fields = fields or list(NEWS_FIELDS)
+    columns = ', '.join(f'{NEWS_FIELDS[name]} AS {name}' for name in fields)
+    filter_sql = search_filter_sql(filters)
+    query_params = dict(filters, limit=limit, max_matches=SEARCH_MAX_MATCHES)
+    
+    after = ''
+    if cursor and filters['q']:
+        rank, article_id = decode_rank_cursor(cursor)
+        query_params.update(after_rank=rank, after_id=article_id)
+        after = 'AND (r.rank, n.id) < (%(after_rank)s::float8, %(after_id)s)'
+    elif cursor:
+        published_at, article_id = decode_cursor(cursor)
+        query_params.update(after_published=published_at, after_id=article_id)
+        after = 'AND (n.published_at, n.id) < (%(after_published)s, %(after_id)s)'
+    
+    if filters['q']:
+        # Каждая ветка идёт по своему GIN-индексу; OR между таблицами индексы бы не использовал
+        sql = f"""
+            WITH query AS (
+                SELECT websearch_to_tsquery('english', %(q)s) AS en, websearch_to_tsquery('russian', %(q)s) AS ru
+            ),
+            matched AS (
+                (SELECT n.id, ts_rank_cd(n.search_vector, query.en) AS rank
+                 FROM query, news_articles n
+                 LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+                 WHERE n.search_vector @@ query.en {filter_sql}
+                 ORDER BY n.published_at DESC NULLS LAST
+                 LIMIT %(max_matches)s)
+                UNION ALL
+                (SELECT n.id, ts_rank_cd(a.summary_vector, query.ru) AS rank
+                 FROM query, news_analysis a
+                 JOIN news_articles n ON n.id = a.article_id AND n.collected_at = a.collected_at
+                 WHERE a.summary_vector @@ query.ru {filter_sql}
+                 ORDER BY n.published_at DESC NULLS LAST
+                 LIMIT %(max_matches)s)
+            ),
+            ranked AS (
+                SELECT id, MAX(rank)::float8 AS rank FROM matched GROUP BY id
+            )
+            SELECT {columns}, r.rank AS rank
+            FROM ranked r
+            JOIN news_articles n ON n.id = r.id
+            LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+            WHERE TRUE {after}
+            ORDER BY r.rank DESC, n.id DESC
+            LIMIT %(limit)s
+        """
+    else:
+        sql = f"""
+            SELECT {columns}
+            FROM news_articles n
+            LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+            WHERE TRUE {filter_sql} {after}
+            ORDER BY n.published_at DESC, n.id DESC
+            LIMIT %(limit)s
+        """
+    
+    try:
+        with db_connection(db_url) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, query_params)
+                rows = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        log('search.error', level='error', error=str(e))
+        return [], None
+    
+    next_cursor = None
+    if len(rows) == limit and filters['q']:
+        raw = json.dumps([rows[-1]['rank'], rows[-1]['id']])
+        next_cursor = base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+    elif len(rows) == limit and rows[-1]['published_at'] is not None:
+        next_cursor = encode_cursor(rows[-1]['published_at'], rows[-1]['id'])
+    return rows, next_cursor
 
 
-def collect_news(db_url, news_api_key, groq_key, country_code):
-    """Сбор новостей через News API"""
-    print(f'collect_news called for {country_code}')
+def collect_news(db_url, news_api_key, groq_key, country_code, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH, context=None):
+    """
+    Сбор новостей через News API (country_code='ALL' — все страны параллельно).
+    Возвращает сводку: countries — обработанные страны, collected — вставленные новости,
+    analyzed — проанализированные сразу, queued — оставленные в очереди analysis_jobs.
+    Анализ в том же вызове — пока хватает времени (context) и лимита RPM, остальное доделает analyze-news
+    """
+    started = time.monotonic()
+    countries = list(COUNTRY_KEYWORDS) if country_code == 'ALL' else [country_code]
+    summary = {'countries': countries, 'collected': 0, 'analyzed': 0, 'queued': 0}
+    log('collect.start', countries=countries)
+    
     try:
-        import requests
-        print('Requests imported')
+        with db_connection(db_url) as conn:
+            # Секция текущего месяца нужна вставке независимо от того, вызывалась ли analyze-news
+            ensure_news_partitions(conn)
+            states = load_collection_state(conn, countries)
+            conn.commit()
         
-        country_keywords = {
-            'RU': 'Russia OR Россия',
-            'US': 'USA OR America',
-            'DE': 'Germany OR Deutschland',
-            'CN': 'China',
-            'NO': 'Norway',
-            'BY': 'Belarus',
-            'FR': 'France',
-            'JP': 'Japan'
-        }
+        # Запросы к NewsAPI по всем странам идут одновременно через общий Session
+        with trace.span('collect.fetch'), ThreadPoolExecutor(max_workers=len(countries)) as pool:
+            pages = dict(zip(countries, pool.map(
+                lambda code: fetch_country(news_api_key, code, states.get(code)),
+                countries
+            )))
+        fetched = {code: articles for code, (articles, _) in pages.items()}
+        states = {code: state for code, (_, state) in pages.items()}
         
-        keyword = country_keywords.get(country_code, 'news')
+        rows = []
+        for code, articles in fetched.items():
+            rows.extend(normalize_article(article, code) for article in articles)
+        log('collect.fetched', articles=len(rows), countries=len(countries))
         
-        url = 'https://newsapi.org/v2/everything'
-        params = {
-            'q': keyword,
-            'apiKey': news_api_key,
-            'pageSize': 10,
-            'sortBy': 'publishedAt',
-            'language': 'en'
-        }
+        with db_connection(db_url) as conn:
+            with trace.span('collect.dedup'):
+                rows = find_duplicates(conn, rows)
+            
+            # Сначала новости: они сохраняются со статусом pending до LLM-фазы, поэтому ошибка или таймаут Groq
+            # ничего не теряют — задачи остаются в очереди analyze-news
+            with trace.span('collect.write'), conn.cursor() as cur:
+                insert_articles([row for row in rows if 'duplicate_of_row' not in row], cur)
+                
+                row_duplicates = [row for row in rows if 'duplicate_of_row' in row]
+                for row in row_duplicates:
+                    row['duplicate_of'] = row['duplicate_of_row'].get('id')
+                insert_articles(row_duplicates, cur)
+                
+                rows = [row for row in rows if row.get('id')]
+                copy_analyses([(row['id'], row['duplicate_of']) for row in rows if row.get('duplicate_of')], cur)
+                apply_stats_delta([row['id'] for row in rows], 1, cur)
+                apply_keyword_delta([row['id'] for row in rows], 1, cur)
+                
+                # Задачи на свои новости сразу арендуются этим вызовом, чтобы analyze-news не взял их параллельно
+                unique_rows = [row for row in rows if not row.get('duplicate_of')]
+                enqueue_analysis(unique_rows, cur, leased=bool(groq_key))
+                save_collection_state(states, cur)
+            conn.commit()
+            summary['collected'] = len(rows)
+            summary['queued'] = len(unique_rows)
+            
+            if not groq_key or not unique_rows:
+                return summary
+            
+            # Сразу анализируем не больше новостей, чем позволяют накопленный лимит RPM и оставшееся время вызова
+            inline = unique_rows[:inline_limit(mode, batch_size)] if remaining_seconds(context, started) > ANALYSIS_SAFETY_MARGIN else []
+            results = [(row, None, None) for row in unique_rows[len(inline):]]
+            log('collect.inline_analysis', articles=len(inline), queued=len(results))
+            
+            if inline:
+                llm_cache.preload(conn, cache_keys(inline, mode))
+                conn.commit()
+                
+                # LLM-вызовы идут параллельно, транзакция на это время закрыта; новые вызовы не начинаются
+                # позже, чем за ANALYSIS_SAFETY_MARGIN до таймаута
+                llm_executor.deadline = time.monotonic() + remaining_seconds(context, started) - ANALYSIS_SAFETY_MARGIN
+                try:
+                    with trace.span('collect.analysis'):
+                        results.extend(run_analysis(inline, groq_key, mode, batch_size))
+                finally:
+                    llm_executor.deadline = None
+                log('llm.cache', **llm_cache.stats())
+            
+            # Вторым шагом — анализы; новости без результата возвращаются в очередь
+            with trace.span('collect.write_analysis'), conn.cursor() as cur:
+                summary['analyzed'] = save_results(results, cur)
+                llm_cache.flush(conn)
+            conn.commit()
+            summary['queued'] -= summary['analyzed']
+            
+    except Exception as e:
+        log('collect.error', level='error', error=str(e))
+    
+    return summary
+
+
+def remaining_seconds(context, started):
+    """Оставшееся время вызова: из context, а без него — по ANALYSIS_TIME_BUDGET"""
+    getter = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(getter):
+        return getter() / 1000
+    return ANALYSIS_TIME_BUDGET - (time.monotonic() - started)
+
+
+def inline_limit(mode, batch_size):
+    """Сколько новостей можно проанализировать без ожидания по RPM: split — два вызова на новость, combined — один на пачку"""
+    available = llm_executor.available_requests()
+    if available is None:
+        return None
+    per_article = 1 / max(1, batch_size) if mode == 'combined' else 2
+    return int(available / per_article)
+
+
+def fetch_articles(news_api_key, country_code, since=None, until=None, max_pages=NEWSAPI_MAX_PAGES):
+    """
+    Новости страны из NewsAPI в окне (since, until], с перелистыванием до max_pages страниц -> (статьи, complete).
+    complete — листание дошло до since (короткая страница или получены все totalResults);
+    иначе между since и самой старой полученной статьёй остались не скачанные новости
+    """
+    keyword = COUNTRY_KEYWORDS.get(country_code, 'news')
+    params = {
+        'q': keyword,
+        'apiKey': news_api_key,
+        'pageSize': NEWSAPI_PAGE_SIZE,
+        'sortBy': 'publishedAt',
+        'language': 'en'
+    }
+    if since:
+        params['from'] = since.isoformat()
+    if until:
+        params['to'] = until.isoformat()
+    
+    articles = []
+    complete = False
+    for page in range(1, max_pages + 1):
+        params['page'] = page
+        try:
+            with trace.span('newsapi.fetch'):
+                response = get_http_session().get(NEWSAPI_URL, params=params, timeout=10)
+                data = response.json()
+        except Exception as e:
+            log('newsapi.error', level='warning', country=country_code, page=page, error=str(e))
+            break
         
-        print(f'Requesting NewsAPI with keyword: {keyword}')
-        response = requests.get(url, params=params, timeout=10)
-        print(f'NewsAPI response status: {response.status_code}')
+        if data.get('status') != 'ok':
+            trace.incr('newsapi.errors')
+            log('newsapi.error', level='warning', country=country_code, page=page, error=data.get('message', 'Unknown error'))
+            break
         
-        data = response.json()
-        print(f'NewsAPI response: {data}')
+        batch = data.get('articles', [])
+        articles.extend(batch)
+        log('newsapi.page', country=country_code, page=page, articles=len(batch), total=data.get('totalResults'))
         
-        if data.get('status') != 'ok':
-            print(f'NewsAPI error: {data.get("message", "Unknown error")}')
-            return
+        if len(batch) < NEWSAPI_PAGE_SIZE or len(articles) >= (data.get('totalResults') or 0):
+            complete = True
+            break
+    
+    return articles, complete
+
+
+def fetch_country(news_api_key, country_code, state=None):
+    """
+    Новости страны с учётом collection_state -> (статьи, новое состояние).
+    Без отметки берётся только первая страница. Иначе сначала всё новее отметки; если не уместилось в
+    NEWSAPI_MAX_PAGES страниц, остаток запоминается окном (gap_after, gap_before), которое дочитывают следующие вызовы
+    """
+    state = state or {}
+    mark = state.get('last_published_at')
+    gap_after, gap_before = state.get('gap_after'), state.get('gap_before')
+    
+    if mark is None:
+        articles, _ = fetch_articles(news_api_key, country_code, max_pages=1)
+        return articles, {'last_published_at': newest_published(articles), 'gap_after': None, 'gap_before': None}
+    
+    articles, complete = fetch_articles(news_api_key, country_code, since=mark)
+    if not complete and articles:
+        # Окно расширяется до прежней отметки; уже полученное внутри него отсеет дедупликация по url
+        gap_after = gap_after or mark
+        gap_before = oldest_published(articles)
+        log('newsapi.incomplete', level='warning', country=country_code, articles=len(articles), gap_after=gap_after, gap_before=gap_before)
+    elif complete and gap_before is not None:
+        older, gap_closed = fetch_articles(news_api_key, country_code, since=gap_after, until=gap_before)
+        articles.extend(older)
+        if gap_closed:
+            log('newsapi.gap_closed', country=country_code, articles=len(older), gap_after=gap_after)
+            gap_after, gap_before = None, None
+        elif older:
+            gap_before = oldest_published(older)
+            log('newsapi.gap', country=country_code, articles=len(older), gap_after=gap_after, gap_before=gap_before)
+    
+    newest = newest_published(articles)
+    return articles, {
+        'last_published_at': max(mark, newest) if newest else mark,
+        'gap_after': gap_after,
+        'gap_before': gap_before
+    }
+
+
+def newest_published(articles):
+    """Самый свежий publishedAt среди статей (datetime UTC) или None"""
+    published = [parse_published(article['publishedAt']) for article in articles if article.get('publishedAt')]
+    return max((value for value in published if value), default=None)
+
+
+def oldest_published(articles):
+    """Самый старый publishedAt среди статей (datetime UTC) или None"""
+    published = [parse_published(article['publishedAt']) for article in articles if article.get('publishedAt')]
+    return min((value for value in published if value), default=None)
+
+
+def normalize_article(article, country_code):
+    """Статья NewsAPI -> строка для news_articles с обрезкой полей под схему"""
+    return {
+        'country_code': country_code,
+        'title': (article.get('title') or '')[:500],
+        'content': (article.get('description') or '')[:2000],
+        'source': ((article.get('source') or {}).get('name') or 'Unknown')[:200],
+        'url': (article.get('url') or '')[:500],
+        'published': article.get('publishedAt') or datetime.now().isoformat()
+    }
+
+
+def ensure_news_partitions(conn, months_ahead=NEWS_PARTITIONS_AHEAD):
+    """Месячные секции news_articles/news_analysis с текущего месяца на months_ahead вперёд"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT create_news_partitions(NOW()::date, (NOW() + %s * INTERVAL '1 month')::date)",
+                (months_ahead,)
+            )
+            created = cur.fetchone()[0]
+        conn.commit()
+    except psycopg2.Error as e:
+        # Параллельный вызов мог создать ту же секцию первым
+        conn.rollback()
+        log('partitions.error', level='warning', error=str(e))
+        return 0
+    if created:
+        log('partitions.created', months=created)
+    return created
+
+
+def load_collection_state(conn, countries):
+    """Отметка последнего полученного publishedAt и недочитанное окно по каждой стране"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT country_code, last_published_at, gap_after, gap_before
+            FROM collection_state
+            WHERE country_code = ANY(%s)
+        """, (countries,))
+        return {
+            code: {'last_published_at': last_published_at, 'gap_after': gap_after, 'gap_before': gap_before}
+            for code, last_published_at, gap_after, gap_before in cur.fetchall()
+        }
+
+
+def save_collection_state(states, cur):
+    """Сохраняет состояние сбора по странам; отметка только растёт, окно берётся из последнего вызова"""
+    values = [
+        (code, state['last_published_at'], state['gap_after'], state['gap_before'])
+        for code, state in states.items()
+        if state['last_published_at'] is not None
+    ]
+    if not values:
+        return
+    
+    execute_values(cur, """
+        INSERT INTO collection_state AS s (country_code, last_published_at, gap_after, gap_before, updated_at)
+        VALUES %s
+        ON CONFLICT (country_code) DO UPDATE SET
+            last_published_at = GREATEST(s.last_published_at, EXCLUDED.last_published_at),
+            gap_after = EXCLUDED.gap_after,
+            gap_before = EXCLUDED.gap_before,
+            updated_at = EXCLUDED.updated_at
+    """, values, template='(%s, %s, %s, %s, NOW())')
+
+
+def minhash(text):
+    """MinHash-подпись множества слов текста (MINHASH_PERMUTATIONS значений под INTEGER)"""
+    tokens = {
+        int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+        for token in re.findall(r'\w+', (text or '').lower())
+    }
+    if not tokens:
+        return [0] * MINHASH_PERMUTATIONS
+    return [
+        min((a * token + b) % MERSENNE_PRIME for token in tokens) & 0x7FFFFFFF
+        for a, b in MINHASH_COEFFICIENTS
+    ]
+
+
+def minhash_bands(signature):
+    """LSH-полосы подписи: похожие тексты с высокой вероятностью совпадают хотя бы в одной"""
+    rows_per_band = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    bands = []
+    for band in range(MINHASH_BANDS):
+        chunk = ','.join(map(str, signature[band * rows_per_band:(band + 1) * rows_per_band]))
+        digest = int.from_bytes(hashlib.blake2b(chunk.encode('ascii'), digest_size=4).digest(), 'big')
+        bands.append(band << 28 | digest & 0x0FFFFFFF)
+    return bands
+
+
+def similarity(a, b):
+    """Оценка коэффициента Жаккара по двум MinHash-подписям"""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def title_hashes(cur, titles):
+    """
+    md5(lower(title)) по списку заголовков, посчитанный самой БД: lower() зависит от правил сортировки базы
+    (в C-локали кириллица не переводится в нижний регистр), поэтому хеш в Python разошёлся бы с индексом idx_news_title_hash
+    """
+    cur.execute("""
+        SELECT md5(lower(title))
+        FROM unnest(%s::text[]) WITH ORDINALITY AS t(title, position)
+        ORDER BY position
+    """, ([title or '' for title in titles],))
+    return [value for (value,) in cur.fetchall()]
+
+
+def find_duplicates(conn, rows):
+    """Отсеивает точные дубли и размечает почти-дубли (duplicate_of / duplicate_of_row)"""
+    for row in rows:
+        # Подписи могут быть уже посчитаны (бэкфилл считает их в процессах пула)
+        if 'minhash' not in row:
+            row['minhash'] = minhash(f"{row['title']} {row['content']}")
+            row['minhash_bands'] = minhash_bands(row['minhash'])
+    
+    if not rows:
+        return []
+    
+    with conn.cursor() as cur:
+        for row, value in zip(rows, title_hashes(cur, [row['title'] for row in rows])):
+            row['title_hash'] = value
+        cur.execute("""
+            SELECT id, country_code, url, md5(lower(title)), minhash, minhash_bands
+            FROM news_articles
+            WHERE duplicate_of IS NULL AND (
+                minhash_bands && %s::integer[]
+                OR url = ANY(%s)
+                OR md5(lower(title)) = ANY(%s)
+            )
+            ORDER BY id
+        """, (
+            sorted({band for row in rows for band in row['minhash_bands']}),
+            [row['url'] for row in rows if row['url']],
+            [row['title_hash'] for row in rows]
+        ))
+        existing = cur.fetchall()
+    
+    # Кандидаты по URL, заголовку и полосам MinHash: строка сравнивается только с теми, с кем делит ключ,
+    # а не со всей выборкой (на бэкфилле полосы пачки совпадают с десятками тысяч строк)
+    existing_urls, existing_titles, existing_bands = {}, {}, {}
+    for position, (_, code, url, existing_title, _, bands) in enumerate(existing):
+        if url:
+            existing_urls.setdefault(url, []).append(position)
+        existing_titles.setdefault(existing_title, []).append(position)
+        for band in bands or ():
+            existing_bands.setdefault(band, []).append(position)
+    kept_urls, kept_titles, kept_bands = set(), {}, {}
+    
+    kept = []
+    for row in rows:
+        row_title = row['title_hash']
+        url_matches = existing_urls.get(row['url'], []) if row['url'] else []
+        
+        if any(existing[position][1] == row['country_code'] for position in url_matches):
+            continue
+        if row['url'] and (row['country_code'], row['url']) in kept_urls:
+            continue
         
-        articles = data.get('articles', [])
-        print(f'Found {len(articles)} articles')
+        candidates = set(url_matches).union(existing_titles.get(row_title, ()))
+        for band in row['minhash_bands']:
+            candidates.update(existing_bands.get(band, ()))
+        for position in sorted(candidates):
+            article_id, _, url, existing_title, existing_minhash, _ = existing[position]
+            if (row['url'] and url == row['url']) or existing_title == row_title or (
+                existing_minhash and similarity(existing_minhash, row['minhash']) >= MINHASH_THRESHOLD
+            ):
+                row['duplicate_of'] = article_id
+                break
+        else:
+            candidates = set(kept_titles.get(row_title, ()))
+            for band in row['minhash_bands']:
+                candidates.update(kept_bands.get(band, ()))
+            for position in sorted(candidates):
+                other = kept[position]
+                if other['title_hash'] == row_title or similarity(other['minhash'], row['minhash']) >= MINHASH_THRESHOLD:
+                    row['duplicate_of_row'] = other
+                    break
         
-        conn = psycopg2.connect(db_url)
+        if row['url']:
+            kept_urls.add((row['country_code'], row['url']))
+        if 'duplicate_of' not in row and 'duplicate_of_row' not in row:
+            kept_titles.setdefault(row_title, []).append(len(kept))
+            for band in row['minhash_bands']:
+                kept_bands.setdefault(band, []).append(len(kept))
+        kept.append(row)
+    
+    log('dedup', fetched=len(rows), kept=len(kept), near_duplicates=sum(1 for r in kept if 'duplicate_of' in r or 'duplicate_of_row' in r))
+    return kept
+
+
+def insert_articles(rows, cur):
+    """Вставка новостей одним multi-row INSERT, проставляет row['id'] и row['collected_at'] (пропущенным по конфликту id не достаётся)"""
+    if not rows:
+        return
+    
+    inserted = execute_values(cur, """
+        INSERT INTO news_articles 
+        (country_code, title, content, source, source_type, url, published_at, is_fake, fake_check_reason,
+         minhash, minhash_bands, duplicate_of, analysis_status, analysis_model)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING id, url, title, collected_at
+    """, [
+        (row['country_code'], row['title'], row['content'], row['source'], 'independent', row['url'], row['published'],
+         row.get('result', (None, None, None))[0], row.get('result', (None, None, None))[1],
+         row['minhash'], row['minhash_bands'], row.get('duplicate_of'),
+         'done' if row.get('result', (None, None, None))[2] else 'pending',
+         (row.get('result', (None, None, None))[2] or {}).get('model', ANALYSIS_MODEL_VERSION) if row.get('result', (None, None, None))[2] else None)
+        for row in rows
+    ], page_size=len(rows), fetch=True)
+    
+    ids = {}
+    for article_id, url, title, collected_at in inserted:
+        ids.setdefault((url, title), []).append((article_id, collected_at))
+    for row in rows:
+        queue = ids.get((row['url'], row['title']))
+        if queue:
+            row['id'], row['collected_at'] = queue.pop(0)
+
+
+def copy_analyses(pairs, cur):
+    """Переиспользует проверку на фейк и анализ канонических новостей для дублей: pairs = [(article_id, canonical_id)]"""
+    if not pairs:
+        return
+    
+    execute_values(cur, """
+        UPDATE news_articles d
+        SET is_fake = c.is_fake, fake_check_reason = c.fake_check_reason,
+            analysis_status = c.analysis_status, analysis_model = c.analysis_model
+        FROM (VALUES %s) AS v(article_id, canonical_id)
+        JOIN news_articles c ON c.id = v.canonical_id
+        WHERE d.id = v.article_id
+    """, pairs, page_size=len(pairs))
+    execute_values(cur, """
+        INSERT INTO news_analysis 
+        (article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        SELECT DISTINCT ON (v.article_id)
+            v.article_id, d.collected_at, a.sentiment, a.bias_score, a.credibility_score, a.manipulation_detected, a.summary, a.keywords
+        FROM (VALUES %s) AS v(article_id, canonical_id)
+        JOIN news_articles d ON d.id = v.article_id
+        JOIN news_analysis a ON a.article_id = v.canonical_id
+    """, pairs, page_size=len(pairs))
+
+
+def enqueue_analysis(rows, cur, leased=False):
+    """
+    Новости без анализа ставятся в очередь analysis_jobs для analyze-news.
+    leased=True — задача сразу арендована текущим вызовом (первая попытка) на ANALYSIS_LEASE_SECONDS
+    """
+    if not rows:
+        return
+    
+    execute_values(cur, """
+        INSERT INTO analysis_jobs (article_id, country_code, collected_at, status, attempts, lease_until)
+        VALUES %s
+        ON CONFLICT (article_id) DO NOTHING
+    """, [
+        (row['id'], row['country_code'], row['collected_at'], 'leased' if leased else 'queued', 1 if leased else 0,
+         ANALYSIS_LEASE_SECONDS if leased else None)
+        for row in rows
+    ], template="(%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')", page_size=len(rows))
+
+
+def save_results(results, cur):
+    """
+    Результаты LLM-фазы по уже вставленным новостям: results = [(row, (is_fake, reason, analysis), error)].
+    Анализы пишутся вместе с переносом на почти-дубли и пересчётом сводок, задачи без результата возвращаются в очередь.
+    Возвращает число сохранённых анализов
+    """
+    analyses = []
+    fake_flags = []
+    released = []
+    for row, result, error in results:
+        if error is not None or not result or result[2] is None:
+            released.append(row['id'])
+            continue
+        is_fake, reason, analysis = result
+        if is_fake is not None:
+            fake_flags.append((row['id'], is_fake, reason))
+        analyses.append((row['id'], analysis))
+    
+    affected_ids = []
+    if analyses:
+        analyzed_ids = [article_id for article_id, _ in analyses]
+        cur.execute("SELECT id FROM news_articles WHERE duplicate_of = ANY(%s)", (analyzed_ids,))
+        affected_ids = analyzed_ids + [article_id for (article_id,) in cur.fetchall()]
+    
+    apply_stats_delta(affected_ids, -1, cur)
+    apply_keyword_delta(affected_ids, -1, cur)
+    update_fake_flags(fake_flags, cur)
+    save_analyses(analyses, cur)
+    complete_jobs(analyses, cur)
+    if analyses:
+        propagate_to_duplicates(analyzed_ids, cur)
+    apply_stats_delta(affected_ids, 1, cur)
+    apply_keyword_delta(affected_ids, 1, cur)
+    release_jobs(released, cur)
+    return len(analyses)
+
+
+def update_fake_flags(items, cur):
+    """Обновление is_fake одним UPDATE: items = [(article_id, is_fake, reason)]"""
+    if not items:
+        return
+    
+    execute_values(cur, """
+        UPDATE news_articles n
+        SET is_fake = v.is_fake, fake_check_reason = v.reason
+        FROM (VALUES %s) AS v(id, is_fake, reason)
+        WHERE n.id = v.id
+    """, items, template='(%s, %s::boolean, %s)', page_size=len(items))
+
+
+def complete_jobs(analyses, cur):
+    """Задачи проанализированных новостей — done, на самих новостях статус done с версией модели"""
+    if not analyses:
+        return
+    
+    cur.execute("""
+        UPDATE analysis_jobs
+        SET status = 'done', lease_until = NULL, last_error = NULL, updated_at = NOW()
+        WHERE article_id = ANY(%s)
+    """, ([article_id for article_id, _ in analyses],))
+    
+    by_model = {}
+    for article_id, analysis in analyses:
+        by_model.setdefault(analysis.get('model', ANALYSIS_MODEL_VERSION), []).append(article_id)
+    for model, article_ids in by_model.items():
+        cur.execute("""
+            UPDATE news_articles
+            SET analysis_status = 'done', analysis_model = %s
+            WHERE id = ANY(%s)
+        """, (model, article_ids))
+
+
+def release_jobs(article_ids, cur):
+    """Возврат арендованных задач в очередь без учёта попытки: анализ достанется analyze-news"""
+    if not article_ids:
+        return
+    
+    cur.execute("""
+        UPDATE analysis_jobs
+        SET status = 'queued', attempts = GREATEST(attempts - 1, 0), lease_until = NULL, updated_at = NOW()
+        WHERE article_id = ANY(%s)
+    """, (list(article_ids),))
+    log('analysis.released', articles=len(article_ids))
+
+
+def propagate_to_duplicates(article_ids, cur):
+    """Перенос проверки на фейк и анализа канонических новостей на их почти-дубли"""
+    cur.execute("""
+        UPDATE news_articles d
+        SET is_fake = c.is_fake, fake_check_reason = c.fake_check_reason,
+            analysis_status = c.analysis_status, analysis_model = c.analysis_model
+        FROM news_articles c
+        WHERE d.duplicate_of = c.id AND c.id = ANY(%s)
+    """, (article_ids,))
+    cur.execute("""
+        INSERT INTO news_analysis 
+        (article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        SELECT d.id, d.collected_at, a.sentiment, a.bias_score, a.credibility_score, a.manipulation_detected, a.summary, a.keywords
+        FROM news_articles d
+        JOIN news_analysis a ON a.article_id = d.duplicate_of
+        WHERE d.duplicate_of = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM news_analysis x WHERE x.article_id = d.id)
+    """, (article_ids,))
+
+
+def apply_stats_delta(article_ids, sign, cur):
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад новостей в сводку country_stats"""
+    if not article_ids:
+        return
+    
+    cur.execute("""
+        INSERT INTO country_stats AS s (
+            country_code, total_news, fake_news, manipulation_count,
+            bias_sum, bias_count, credibility_sum, credibility_count,
+            positive_count, negative_count, neutral_count, updated_at, data_version
+        )
+        SELECT
+            n.country_code,
+            %(sign)s * COUNT(*),
+            %(sign)s * COUNT(CASE WHEN n.is_fake = true THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END),
+            %(sign)s * COALESCE(SUM(a.bias_score), 0),
+            %(sign)s * COUNT(a.bias_score),
+            %(sign)s * COALESCE(SUM(a.credibility_score), 0),
+            %(sign)s * COUNT(a.credibility_score),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END),
+            %(sign)s * COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END),
+            NOW(),
+            1
+        FROM news_articles n
+        LEFT JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+        WHERE n.id = ANY(%(ids)s) AND n.country_code IS NOT NULL
+        GROUP BY n.country_code
+        ON CONFLICT (country_code) DO UPDATE SET
+            total_news = s.total_news + EXCLUDED.total_news,
+            fake_news = s.fake_news + EXCLUDED.fake_news,
+            manipulation_count = s.manipulation_count + EXCLUDED.manipulation_count,
+            bias_sum = s.bias_sum + EXCLUDED.bias_sum,
+            bias_count = s.bias_count + EXCLUDED.bias_count,
+            credibility_sum = s.credibility_sum + EXCLUDED.credibility_sum,
+            credibility_count = s.credibility_count + EXCLUDED.credibility_count,
+            positive_count = s.positive_count + EXCLUDED.positive_count,
+            negative_count = s.negative_count + EXCLUDED.negative_count,
+            neutral_count = s.neutral_count + EXCLUDED.neutral_count,
+            updated_at = EXCLUDED.updated_at,
+            data_version = s.data_version + 1
+    """, {'sign': sign, 'ids': list(article_ids)})
+
+
+def apply_keyword_delta(article_ids, sign, cur):
+    """Добавляет (sign=1) или вычитает (sign=-1) ключевые слова анализов новостей в часовые и дневные корзины keyword_counts"""
+    if not article_ids:
+        return
+    
+    # Порядок вставки фиксирован, чтобы параллельные вызовы брали блокировки строк в одном порядке
+    cur.execute("""
+        INSERT INTO keyword_counts AS c (country_code, bucket, bucket_start, keyword, count)
+        SELECT n.country_code, b.bucket, date_trunc(b.bucket, COALESCE(n.published_at, n.collected_at)), k.keyword,
+               %(sign)s * COUNT(*)
+        FROM news_articles n
+        JOIN news_analysis a ON a.article_id = n.id AND a.collected_at = n.collected_at
+        CROSS JOIN LATERAL (
+            SELECT DISTINCT left(lower(btrim(kw)), 100) AS keyword
+            FROM unnest(a.keywords) AS kw
+            WHERE btrim(kw) <> ''
+        ) k
+        CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+        WHERE n.id = ANY(%(ids)s) AND n.country_code IS NOT NULL AND COALESCE(n.published_at, n.collected_at) IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (country_code, bucket, bucket_start, keyword) DO UPDATE SET
+            count = c.count + EXCLUDED.count
+    """, {'sign': sign, 'ids': list(article_ids)})
+
+
+def read_backfill_lines(path, start=0):
+    """Непустые строки JSONL/NDJSON-файла (в том числе .gz) начиная со строки start: (номер строки, текст)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for number, line in enumerate(f):
+            if number >= start and line.strip():
+                yield number, line
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_published(value):
+    """publishedAt NewsAPI -> datetime UTC без часового пояса, None если не разбирается"""
+    try:
+        published = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if published.tzinfo is not None:
+        published = published.astimezone(timezone.utc).replace(tzinfo=None)
+    return published
+
+
+def parse_backfill_lines(lines, country_code=None):
+    """
+    Пачка строк дампа -> (номер следующей строки, число строк, строки для news_articles, число отброшенных).
+    Строка — статья NewsAPI или целый ответ NewsAPI ({"articles": [...]}); страна — из поля country_code/country статьи
+    или country_code. Выполняется и в процессах пула, поэтому MinHash считается здесь же
+    """
+    rows = []
+    invalid = 0
+    for _, line in lines:
         try:
-            with conn.cursor() as cur:
-                for article in articles:
-                    title = article.get('title', '')[:500]
-                    content = article.get('description', '')[:2000]
-                    source = article.get('source', {}).get('name', 'Unknown')[:200]
-                    article_url = article.get('url', '')[:500]
-                    published = article.get('publishedAt', datetime.now().isoformat())
-                    
-                    is_fake, reason = check_fake(title, content, groq_key)
-                    
-                    cur.execute("""
-                        INSERT INTO news_articles 
-                        (country_code, title, content, source, source_type, url, published_at, is_fake, fake_check_reason)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    """, (country_code, title, content, source, 'independent', article_url, published, is_fake, reason))
-                    
-                    result = cur.fetchone()
-                    if result:
-                        article_id = result[0]
-                        analyze_and_save(article_id, title, content, groq_key, cur)
-                
-                conn.commit()
-        finally:
-            conn.close()
+            data = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        articles = data['articles'] if isinstance(data, dict) and isinstance(data.get('articles'), list) else [data]
+        
+        for article in articles:
+            code = isinstance(article, dict) and (article.get('country_code') or article.get('country') or country_code)
+            published = parse_published(article.get('publishedAt')) if code and article.get('publishedAt') else None
+            if not code or not article.get('title') or published is None:
+                invalid += 1
+                continue
             
-    except Exception as e:
-        print(f'Error collecting news: {e}')
+            row = normalize_article(article, str(code).upper()[:3])
+            row['published'] = published
+            row['minhash'] = minhash(f"{row['title']} {row['content']}")
+            row['minhash_bands'] = minhash_bands(row['minhash'])
+            rows.append(row)
+    
+    return lines[-1][0] + 1, len(lines), rows, invalid
+
+
+def parallel_map(fn, items, workers):
+    """
+    map по процессному пулу с сохранением порядка; в работе не больше 2 * workers задач,
+    поэтому память не растёт с длиной items. workers <= 1 — в текущем процессе
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, list):
+        return '{' + ','.join(map(str, value)) + '}'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r').replace('\x00', '')
+
+
+def copy_articles(rows, cur):
+    """COPY новостей с заранее выделенными id (строки пачки уже прошли find_duplicates)"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in (
+            row['id'], row['country_code'], row['title'], row['content'], row['source'], 'independent', row['url'],
+            row['published'], row['collected_at'], row['minhash'], row['minhash_bands'], row.get('duplicate_of'), 'pending'
+        )) + '\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY news_articles ({', '.join(BACKFILL_COLUMNS)}) FROM STDIN", buffer)
+
+
+def backfill_chunk(conn, rows):
+    """
+    Пачка дампа одной транзакцией: дедупликация против базы и внутри пачки, COPY, сводки и очередь анализа.
+    collected_at исторических новостей = published_at, чтобы они ложились в секции своих месяцев.
+    Возвращает (вставлено, поставлено в очередь, пропущено в месяцах, уже снятых политикой хранения)
+    """
+    retired = retired_months(conn, {row['published'].date().replace(day=1) for row in rows})
+    if retired:
+        count = len(rows)
+        rows = [row for row in rows if row['published'].date().replace(day=1) not in retired]
+        retired = count - len(rows)
+        log('backfill.retired_skipped', articles=retired)
+    else:
+        retired = 0
+    
+    with trace.span('backfill.dedup'):
+        rows = find_duplicates(conn, rows)
+    if not rows:
+        conn.commit()
+        return 0, 0, retired
+    
+    with trace.span('backfill.write'), conn.cursor() as cur:
+        cur.execute(
+            "SELECT create_news_partitions(%s, %s)",
+            (min(row['published'] for row in rows).date(), max(row['published'] for row in rows).date())
+        )
+        cur.execute("SELECT nextval('news_articles_id_seq') FROM generate_series(1, %s)", (len(rows),))
+        for row, (article_id,) in zip(rows, cur.fetchall()):
+            row['id'] = article_id
+            row['collected_at'] = row['published']
+        for row in rows:
+            if 'duplicate_of_row' in row:
+                row['duplicate_of'] = row['duplicate_of_row']['id']
+        
+        copy_articles(rows, cur)
+        copy_analyses([(row['id'], row['duplicate_of']) for row in rows if row.get('duplicate_of')], cur)
+        apply_stats_delta([row['id'] for row in rows], 1, cur)
+        apply_keyword_delta([row['id'] for row in rows], 1, cur)
+        queued = [row for row in rows if not row.get('duplicate_of')]
+        enqueue_analysis(queued, cur)
+    conn.commit()
+    return len(rows), len(queued), retired
+
+
+def retired_months(conn, months):
+    """
+    Месяцы из months, снятые политикой хранения: уже свёрнутые в news_archive_stats или с отсоединённой секцией.
+    Новая секция там не создастся (таблица с тем же именем существует), а вставка испортила бы архивную сводку
+    """
+    if not months:
+        return set()
+    
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT month FROM news_archive_stats WHERE month = ANY(%(months)s::date[])
+            UNION
+            SELECT m::date
+            FROM unnest(%(months)s::date[]) AS m,
+                 LATERAL to_regclass('news_articles_' || to_char(m, '"p"YYYY_MM')) AS partition
+            WHERE partition IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM pg_inherits i
+                WHERE i.inhrelid = partition AND i.inhparent = 'news_articles'::regclass
+            )
+        """, {'months': sorted(months)})
+        return {month for (month,) in cur.fetchall()}
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path, checkpoint):
+    """Атомарная запись чекпойнта: при падении остаётся предыдущая версия"""
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def backfill(db_url, paths, country_code=None, chunk_size=BACKFILL_CHUNK, workers=0,
+             checkpoint_path='backfill.checkpoint.json', restart=False):
+    """
+    Потоковая загрузка исторических дампов NewsAPI: чтение -> разбор и MinHash (опционально в пуле процессов) ->
+    дедупликация -> COPY пачками -> очередь анализа. Память ограничена размером пачки и числом задач в пуле.
+    После каждой пачки в чекпойнт пишется номер следующей строки файла, повторный запуск продолжает с него
+    """
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    totals = {'lines': 0, 'articles': 0, 'inserted': 0, 'queued': 0, 'skipped': 0, 'retired': 0, 'invalid': 0}
+    started = time.monotonic()
+    parse = functools.partial(parse_backfill_lines, country_code=country_code)
+    
+    for path in paths:
+        state = checkpoint.setdefault(os.path.abspath(path), {'line': 0, 'done': False})
+        if state['done']:
+            log('backfill.file_skipped', file=path)
+            continue
+        if state['line']:
+            log('backfill.resume', file=path, line=state['line'])
+        
+        chunks = chunked(read_backfill_lines(path, state['line']), chunk_size)
+        for next_line, lines, rows, invalid in parallel_map(parse, chunks, workers):
+            for attempt in range(2):
+                try:
+                    with db_connection(db_url) as conn:
+                        # Копии строк: повторная попытка начинает дедупликацию заново
+                        inserted, queued, retired = backfill_chunk(conn, [dict(row) for row in rows])
+                    break
+                except psycopg2.IntegrityError as e:
+                    # Те же URL успел вставить параллельный сбор: повторная дедупликация их отсеет
+                    if attempt:
+                        raise
+                    log('backfill.retry', level='warning', file=path, line=next_line, error=str(e))
+            
+            totals['lines'] += lines
+            totals['articles'] += len(rows)
+            totals['inserted'] += inserted
+            totals['queued'] += queued
+            totals['skipped'] += len(rows) - inserted
+            totals['retired'] += retired
+            totals['invalid'] += invalid
+            state['line'] = next_line
+            save_checkpoint(checkpoint_path, checkpoint)
+            
+            elapsed = time.monotonic() - started
+            log('backfill.progress', file=path, line=next_line,
+                articles_per_sec=round(totals['articles'] / elapsed, 1) if elapsed else None, **totals)
+        
+        state['done'] = True
+        save_checkpoint(checkpoint_path, checkpoint)
+    
+    totals['seconds'] = round(time.monotonic() - started, 1)
+    log('backfill.done', **totals)
+    return totals
+
+
+def article_text(title, content, max_chars):
+    """Текст новости в том виде, в каком он уходит в промпт"""
+    return f"{title}. {content or ''}"[:max_chars]
+
+
+def cache_keys(items, mode=ANALYSIS_MODE):
+    """Ключи кеша, которые понадобятся LLM-фазе для items"""
+    keys = []
+    for item in items:
+        if mode == 'combined':
+            keys.append(llm_cache.key('combined', article_text(item['title'], item['content'], 800)))
+        else:
+            keys.append(llm_cache.key('fake', article_text(item['title'], item['content'], 500)))
+            keys.append(llm_cache.key('analysis', article_text(item['title'], item['content'], 800)))
+    return keys
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'\w+', (text or '').lower()) if len(token) > 2 and not token.isdigit()]
+
+
+def tfidf_keywords(texts, top_k=PRECLASSIFY_KEYWORDS):
+    """Ключевые слова по TF-IDF внутри пачки текстов (матричный расчёт на NumPy)"""
+    import numpy as np
+    
+    vocabulary = {}
+    doc_index = []
+    term_index = []
+    for i, text in enumerate(texts):
+        for token in tokenize(text):
+            if token not in STOPWORDS:
+                doc_index.append(i)
+                term_index.append(vocabulary.setdefault(token, len(vocabulary)))
+    
+    if not vocabulary:
+        return [[] for _ in texts]
+    
+    tf = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    np.add.at(tf, (np.array(doc_index), np.array(term_index)), 1)
+    tf /= np.maximum(tf.sum(axis=1, keepdims=True), 1)
+    
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    scores = tf * idf
+    
+    terms = np.array(list(vocabulary))
+    top = np.argsort(-scores, axis=1)[:, :top_k]
+    return [[str(terms[j]) for j in top[i] if scores[i, j] > 0] for i in range(len(texts))]
+
+
+def preclassify_articles(items):
+    """Локальный первый проход: релевантность политике, тональность и маркеры манипуляции по словарям, ключевые слова по TF-IDF"""
+    texts = [article_text(item['title'], item['content'], 2000) for item in items]
+    keywords = tfidf_keywords(texts)
+    
+    results = []
+    for text, item_keywords in zip(texts, keywords):
+        tokens = tokenize(text)
+        political = sum(1 for token in tokens if token in POLITICAL_TERMS)
+        off_topic = sum(1 for token in tokens if token in OFF_TOPIC_TERMS)
+        positive = sum(1 for token in tokens if token in POSITIVE_TERMS)
+        negative = sum(1 for token in tokens if token in NEGATIVE_TERMS)
+        markers = (
+            sum(1 for token in tokens if token in MANIPULATION_MARKERS)
+            + text.count('!') // 2
+            + sum(1 for word in text.split() if len(word) > 3 and word.isupper())
+        )
+        
+        tone = (positive - negative) / max(positive + negative, 1)
+        if tone > 0.2:
+            sentiment = 'positive'
+        elif tone < -0.2:
+            sentiment = 'negative'
+        else:
+            sentiment = 'neutral'
+        
+        results.append({
+            'relevance': (political + 0.5) / (political + off_topic + 1),
+            'sentiment': sentiment,
+            'bias_score': None,
+            'credibility_score': None,
+            'manipulation_detected': markers >= 2,
+            'summary': None,
+            'keywords': item_keywords,
+            'model': LOCAL_MODEL_VERSION
+        })
+    return results
+
+
+def run_analysis(items, groq_key, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH, preclassify=PRECLASSIFY):
+    """Локальная предварительная классификация и LLM-фаза, возвращает [(item, (is_fake, reason, analysis), error)]"""
+    if not preclassify or not items:
+        return run_llm_analysis(items, groq_key, mode, batch_size)
+    
+    # Уверенно нерелевантные новости (спорт, погода и т.п.) получают локальный анализ без Groq
+    results = []
+    remote = []
+    for item, local in zip(items, preclassify_articles(items)):
+        if local['relevance'] <= 1 - PRECLASSIFY_THRESHOLD:
+            results.append((item, (None, '', local), None))
+        else:
+            remote.append((item, local))
+    log('preclassifier', local=len(results), total=len(items))
+    
+    local_keywords = {id(item): local['keywords'] for item, local in remote}
+    for item, result, error in run_llm_analysis([item for item, _ in remote], groq_key, mode, batch_size):
+        if error is None and result and result[2] is not None and not result[2].get('keywords'):
+            result = (result[0], result[1], {**result[2], 'keywords': local_keywords[id(item)]})
+        results.append((item, result, error))
+    return results
+
+
+def run_llm_analysis(items, groq_key, mode=ANALYSIS_MODE, batch_size=ANALYSIS_BATCH):
+    """LLM-фаза для списка новостей, возвращает [(item, (is_fake, reason, analysis), error)]"""
+    if mode != 'combined':
+        return llm_executor.map(
+            lambda item: analyze_article(item['title'], item['content'], groq_key),
+            items
+        )
+    
+    results = []
+    uncached = []
+    for item in items:
+        cached = llm_cache.get(llm_cache.key('combined', article_text(item['title'], item['content'], 800)))
+        if cached is not None:
+            results.append((item, (cached.get('is_fake'), cached.get('fake_check_reason', ''), cached), None))
+        else:
+            uncached.append(item)
+    
+    batch_size = max(1, batch_size)
+    batches = [uncached[i:i + batch_size] for i in range(0, len(uncached), batch_size)]
+    
+    fallback = []
+    for batch, batch_results, error in llm_executor.map(lambda batch: analyze_combined(batch, groq_key), batches):
+        if error is not None:
+            log('llm.combined_error', level='warning', error=str(error))
+        for i, item in enumerate(batch):
+            result = batch_results[i] if error is None else None
+            if result is None:
+                fallback.append(item)
+            else:
+                results.append((item, result, None))
+    
+    # Новости, которые не удалось разобрать из общего ответа, идут по старому пути из двух вызовов
+    if fallback:
+        log('llm.split_fallback', articles=len(fallback))
+        results.extend(llm_executor.map(
+            lambda item: analyze_article(item['title'], item['content'], groq_key),
+            fallback
+        ))
+    
+    return results
+
+
+def analyze_combined(items, groq_key):
+    """Проверка на фейк и анализ N новостей одним запросом, возвращает список (is_fake, reason, analysis) или None по индексам"""
+    texts = '\n\n'.join(
+        f"[{i}] " + article_text(item['title'], item['content'], 800)
+        for i, item in enumerate(items)
+    )
+    
+    prompt = f"""Проверь на фейк и проанализируй новости:
+
+{texts}
+
+JSON-объект с массивом results, по объекту на каждую новость:
+{{"results": [{{"index": 0, "is_fake": true/false, "fake_check_reason": "объяснение", "sentiment": "positive/negative/neutral", "bias_score": 0-100, "credibility_score": 0-100, "manipulation_detected": true/false, "summary": "текст", "keywords": ["слово1", "слово2"]}}]}}"""
+
+    answer = llm_executor.complete(
+        groq_key,
+        [
+            {'role': 'system', 'content': 'Ты эксперт по фактчекингу и анализу новостей.'},
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature=0.2,
+        max_tokens=350 * len(items)
+    )
+    
+    parsed, truncated = parse_llm_json(answer)
+    if isinstance(parsed, dict):
+        parsed = parsed['results'] if isinstance(parsed.get('results'), list) else [parsed]
+    if truncated:
+        # Последний объект обрезанного ответа мог потерять поля вместе с хвостом
+        parsed = parsed[:-1]
+    
+    by_index = {}
+    for position, entry in enumerate(parsed):
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = parse_entry_index(entry.get('index'), len(items))
+            if index in by_index:
+                raise ValueError(f'Duplicate index {index}')
+            is_fake, reason = validate_fake_check(entry, 'fake_check_reason')
+            if is_fake is None:
+                trace.incr('llm.schema_errors')
+                raise ValueError('Combined entry lacks is_fake')
+            analysis = validate_analysis(entry)
+        except ValueError as e:
+            # Неполная или не привязанная к новости запись уходит в запасной путь из двух вызовов
+            log('llm.combined_entry_rejected', level='warning', position=position, error=str(e))
+            continue
+        by_index[index] = dict(analysis, is_fake=is_fake, fake_check_reason=reason)
+    
+    results = []
+    for i in range(len(items)):
+        entry = by_index.get(i)
+        if entry is None:
+            results.append(None)
+        else:
+            if not truncated:
+                llm_cache.put(llm_cache.key('combined', article_text(items[i]['title'], items[i]['content'], 800)), entry)
+            results.append((entry.get('is_fake'), entry.get('fake_check_reason', ''), entry))
+    return results
+
+
+def parse_entry_index(value, size):
+    """Номер новости из записи общего ответа: целое в [0, size), иначе ValueError — по позиции запись не угадывается"""
+    try:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError
+        index = int(value)
+    except (TypeError, ValueError):
+        index = None
+    if index is None or not 0 <= index < size:
+        trace.incr('llm.schema_errors')
+        raise ValueError(f'Invalid index {value!r} for {size} articles')
+    return index
+
+
+def analyze_article(title, content, groq_key):
+    """Проверка на фейк и полный анализ одной новости (без записи в БД)"""
+    is_fake, reason = check_fake(title, content, groq_key)
+    analysis = analyze_news(title, content, groq_key)
+    return is_fake, reason, analysis
 
 
 def check_fake(title, content, groq_key):
@@ -180,10 +2391,11 @@ def check_fake(title, content, groq_key):
         return None, None
     
     try:
-        from groq import Groq
-        client = Groq(api_key=groq_key)
-        
-        text = f"{title}. {content or ''}"[:500]
+        text = article_text(title, content, 500)
+        cache_key = llm_cache.key('fake', text)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached['is_fake'], cached['reason']
         
         prompt = f"""Проверь новость на фейк:
 
@@ -192,9 +2404,9 @@ def check_fake(title, content, groq_key):
 JSON формат:
 {{"is_fake": true/false, "reason": "объяснение"}}"""
 
-        response = client.chat.completions.create(
-            model='llama-3.1-70b-versatile',
-            messages=[
+        answer = llm_executor.complete(
+            groq_key,
+            [
                 {'role': 'system', 'content': 'Ты эксперт по фактчекингу.'},
                 {'role': 'user', 'content': prompt}
             ],
@@ -202,23 +2414,29 @@ JSON формат:
             max_tokens=150
         )
         
-        result = json.loads(response.choices[0].message.content)
-        return result.get('is_fake', False), result.get('reason', '')
+        data, truncated = parse_llm_json(answer)
+        is_fake, reason = validate_fake_check(data)
+        if not truncated:
+            llm_cache.put(cache_key, {'is_fake': is_fake, 'reason': reason})
+        return is_fake, reason
         
+    except LLMDeadlineExceeded:
+        raise
     except Exception:
         return None, None
 
 
-def analyze_and_save(article_id, title, content, groq_key, cur):
-    """Анализ новости и сохранение в БД"""
+def analyze_news(title, content, groq_key):
+    """Анализ новости через ИИ, возвращает словарь анализа или None"""
     if not groq_key:
-        return
+        return None
     
     try:
-        from groq import Groq
-        client = Groq(api_key=groq_key)
-        
-        text = f"{title}. {content or ''}"[:800]
+        text = article_text(title, content, 800)
+        cache_key = llm_cache.key('analysis', text)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         prompt = f"""Анализ новости:
 
@@ -227,9 +2445,9 @@ def analyze_and_save(article_id, title, content, groq_key, cur):
 JSON:
 {{"sentiment": "positive/negative/neutral", "bias_score": 0-100, "credibility_score": 0-100, "manipulation_detected": true/false, "summary": "текст", "keywords": ["слово1", "слово2"]}}"""
 
-        response = client.chat.completions.create(
-            model='llama-3.1-70b-versatile',
-            messages=[
+        answer = llm_executor.complete(
+            groq_key,
+            [
                 {'role': 'system', 'content': 'Анализ новостей.'},
                 {'role': 'user', 'content': prompt}
             ],
@@ -237,13 +2455,30 @@ JSON:
             max_tokens=250
         )
         
-        analysis = json.loads(response.choices[0].message.content)
+        data, truncated = parse_llm_json(answer)
+        analysis = validate_analysis(data)
+        if not truncated:
+            llm_cache.put(cache_key, analysis)
+        return analysis
         
-        cur.execute("""
-            INSERT INTO news_analysis 
-            (article_id, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
+    except Exception as e:
+        log('llm.analysis_error', level='warning', error=str(e))
+        return None
+
+
+def save_analyses(items, cur):
+    """Сохранение анализов одним multi-row INSERT: items = [(article_id, analysis)]"""
+    if not items:
+        return
+    
+    execute_values(cur, """
+        INSERT INTO news_analysis 
+        (article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        SELECT v.article_id, n.collected_at, v.sentiment, v.bias_score, v.credibility_score, v.manipulation_detected, v.summary, v.keywords
+        FROM (VALUES %s) AS v(article_id, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords)
+        JOIN news_articles n ON n.id = v.article_id
+    """, [
+        (
             article_id,
             analysis.get('sentiment'),
             analysis.get('bias_score'),
@@ -251,7 +2486,38 @@ JSON:
             analysis.get('manipulation_detected'),
             analysis.get('summary'),
             analysis.get('keywords', [])
-        ))
-        
-    except Exception as e:
-        print(f'Analysis error: {e}')
\ No newline at end of file
+        )
+        for article_id, analysis in items
+    ], template='(%s, %s, %s::integer, %s::integer, %s::boolean, %s, %s::text[])', page_size=len(items))
+
+
+def save_analysis(article_id, analysis, cur):
+    """Сохранение анализа новости в БД"""
+    save_analyses([(article_id, analysis)], cur)
+
+
+def analyze_and_save(article_id, title, content, groq_key, cur):
+    """Анализ новости и сохранение в БД"""
+    analysis = analyze_news(title, content, groq_key)
+    if analysis:
+        save_analysis(article_id, analysis, cur)
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Загрузка исторических дампов NewsAPI (JSONL/NDJSON, можно .gz)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill')
+    backfill_parser.add_argument('files', nargs='+')
+    backfill_parser.add_argument('--country', help='страна статей без поля country_code/country')
+    backfill_parser.add_argument('--chunk', type=int, default=BACKFILL_CHUNK, help='статей в одной транзакции COPY')
+    backfill_parser.add_argument('--workers', type=int, default=0, help='процессов для разбора и MinHash (0 — без пула)')
+    backfill_parser.add_argument('--checkpoint', default='backfill.checkpoint.json')
+    backfill_parser.add_argument('--restart', action='store_true', help='игнорировать чекпойнт и начать файлы сначала')
+    args = parser.parse_args()
+    
+    trace.reset('backfill', False)
+    print(json.dumps(backfill(
+        os.environ['DATABASE_URL'], args.files, args.country, args.chunk, args.workers, args.checkpoint, args.restart
+    ), ensure_ascii=False, indent=2))
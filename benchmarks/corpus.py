@@ -0,0 +1,244 @@
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+SOURCES = ['Reuters', 'Associated Press', 'BBC News', 'Deutsche Welle', 'Le Monde', 'NHK', 'Meduza', 'Xinhua', 'NRK', 'Nasha Niva']
+
+ACTORS = ['The president', 'The prime minister', 'Parliament', 'The opposition party', 'The constitutional court',
+          'The foreign minister', 'Protesters', 'The ruling coalition', 'Independent journalists', 'The election commission']
+ACTIONS = ['approved new legislation on', 'condemned the government over', 'announced sanctions related to',
+           'called a referendum on', 'detained activists protesting', 'opened talks with NATO about',
+           'accused officials of corruption in', 'proposed a constitutional reform of', 'held a rally against',
+           'signed a treaty covering']
+TOPICS = ['press freedom', 'media censorship', 'the election campaign', 'military spending', 'human rights',
+          'the budget crisis', 'border security', 'judicial independence', 'energy policy', 'the ceasefire']
+
+OFF_TOPIC = ['The national football team won the championship match after a late goal',
+             'Weather forecast: heavy rain and snow expected, temperature drops this weekend',
+             'New smartphone review: the gadget impresses with its camera and gaming performance',
+             'Celebrity actress stars in a new movie trailer released ahead of the film festival',
+             'Tennis: the tournament favourite advances after a straight-sets match',
+             'Recipe of the week: a restaurant chef shares three cooking tips']
+
+MARKERS = ['Shocking', 'Exposed', 'Bombshell', 'Secret']
+
+
+def synthetic_article(query, index, seed=0, duplicate_rate=0.1, off_topic_rate=0.3):
+    """
+    Статья index ленты query в формате NewsAPI и индекс статьи, которую она пересказывает (или None).
+    Генерация детерминирована по (seed, query, index), поэтому префикс ленты не зависит от её длины
+    """
+    rnd = random.Random(f'{seed}|{query}|{index}')
+    if index > 0 and rnd.random() < duplicate_rate:
+        source_index = rnd.randrange(max(0, index - 200), index)
+        original, _ = synthetic_article(query, source_index, seed, 0.0, off_topic_rate)
+        words = original['title'].split()
+        # Перепечатка: другой источник и URL, заголовок с мелкой правкой
+        if len(words) > 4:
+            words[rnd.randrange(1, len(words) - 1)] = rnd.choice(['reportedly', 'now', 'again', 'officially'])
+        original.update({
+            'source': {'id': None, 'name': rnd.choice(SOURCES)},
+            'title': ' '.join(words),
+            'url': f'https://news.example.com/{query.split()[0].lower()}/{seed}/{index}'
+        })
+        return original, source_index
+
+    if rnd.random() < off_topic_rate:
+        title = rnd.choice(OFF_TOPIC) + f' ({index})'
+        description = f'{title}. Fans and readers reacted online.'
+    else:
+        title = f'{rnd.choice(ACTORS)} {rnd.choice(ACTIONS)} {rnd.choice(TOPICS)} in {query.split()[0]}'
+        if rnd.random() < 0.1:
+            title = f'{rnd.choice(MARKERS)}: {title}'
+        description = (
+            f'{title}. Officials said the decision follows weeks of debate; '
+            f'critics and opposition lawmakers said it would affect {rnd.choice(TOPICS)} and {rnd.choice(TOPICS)}.'
+        )
+
+    return {
+        'source': {'id': None, 'name': rnd.choice(SOURCES)},
+        'author': None,
+        'title': title,
+        'description': description,
+        'url': f'https://news.example.com/{query.split()[0].lower()}/{seed}/{index}',
+        'urlToImage': None,
+        'publishedAt': None,
+        'content': description
+    }, None
+
+
+def generate_articles(query, count, seed=0, duplicate_rate=0.1, off_topic_rate=0.3, start=0):
+    """Статьи start..start+count-1 ленты query в формате NewsAPI"""
+    for index in range(start, start + count):
+        yield synthetic_article(query, index, seed, duplicate_rate, off_topic_rate)[0]
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        return '{' + ','.join('"' + str(item).replace('\\', '\\\\\\\\').replace('"', '\\\\"') + '"' for item in value) + '}'
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def apply_migrations(conn):
+    """Накатывает db_migrations на пустую базу; на уже размеченной ничего не делает"""
+    from benchmarks.harness import MIGRATIONS
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.countries')")
+        if cur.fetchone()[0] is not None:
+            print('Schema already present, skipping migrations')
+            return
+        for path in sorted(MIGRATIONS.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0])):
+            print(f'Applying {path.name}')
+            cur.execute(path.read_text(encoding='utf-8'))
+    conn.commit()
+
+
+def load_corpus(database_url, rows, seed=0, days=30, analyzed=0.8, duplicate_rate=0.1, off_topic_rate=0.3,
+                chunk=50000, with_minhash=True):
+    """
+    Загружает rows синтетических новостей, равномерно по странам из countries, через COPY пачками по chunk.
+    Доля analyzed получает анализ, остальные ставятся в analysis_jobs; дубли ссылаются на оригинал.
+    После загрузки пересчитывается country_stats. Возвращает {'rows', 'seconds'}
+    """
+    import psycopg2
+    from benchmarks.harness import load_function
+
+    collector = load_function('news-collector')
+    analyzer = load_function('analyze-news')
+    started = time.monotonic()
+
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT code FROM countries ORDER BY code")
+            countries = [code for (code,) in cur.fetchall()]
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM news_articles")
+            base_id = cur.fetchone()[0] + 1
+
+            per_country = -(-rows // len(countries))
+            now = datetime.now().replace(microsecond=0)
+            step = timedelta(days=days) / max(1, per_country)
+            # Месячные секции на весь период корпуса
+            cur.execute("SELECT create_news_partitions(%s, %s)", ((now - timedelta(days=days + 1)).date(), (now + timedelta(days=1)).date()))
+        conn.commit()
+
+        loaded = 0
+
+        for offset in range(0, per_country, chunk):
+            count = min(chunk, per_country - offset)
+            articles, analyses, jobs = [], [], []
+            for position, code in enumerate(countries):
+                for index in range(offset, offset + count):
+                    if loaded + len(articles) >= rows:
+                        break
+                    article_id = base_id + index * len(countries) + position
+                    article, source_index = synthetic_article(code, base_id + index, seed, duplicate_rate, off_topic_rate)
+                    canonical = source_index if source_index is not None and source_index >= base_id else None
+                    canonical_id = base_id + (canonical - base_id) * len(countries) + position if canonical is not None else None
+
+                    # Оригинал и его перепечатки получают одинаковый результат анализа
+                    rnd = random.Random(f'{seed}|{code}|analysis|{canonical if canonical is not None else base_id + index}')
+                    done = rnd.random() < analyzed
+                    is_fake = rnd.random() < 0.1 if done else None
+                    published = now - step * (per_country - index)
+                    collected = published + timedelta(minutes=rnd.randint(1, 30))
+                    signature = collector.minhash(f"{article['title']} {article['description']}") if with_minhash else None
+
+                    articles.append((
+                        article_id, code, article['title'], article['description'], article['source']['name'], 'independent',
+                        article['url'], published, collected,
+                        is_fake, ('Синтетическая проверка' if done else None),
+                        signature, collector.minhash_bands(signature) if signature else None, canonical_id,
+                        'done' if done else 'pending', collector.ANALYSIS_MODEL_VERSION if done else None
+                    ))
+                    if done:
+                        analyses.append((
+                            article_id, collected, rnd.choice(['positive', 'negative', 'neutral']), rnd.randint(0, 100),
+                            rnd.randint(0, 100), rnd.random() < 0.2, 'Синтетический анализ',
+                            rnd.sample(['выборы', 'парламент', 'санкции', 'протест', 'закон', 'министр', 'суд'], 3)
+                        ))
+                    elif canonical_id is None:
+                        jobs.append((article_id, code, published, collected))
+
+            # Физический порядок по id, как при обычной вставке
+            articles.sort(key=lambda row: row[0])
+            with conn.cursor() as cur:
+                copy_rows(cur, 'news_articles', (
+                    'id', 'country_code', 'title', 'content', 'source', 'source_type', 'url', 'published_at', 'collected_at',
+                    'is_fake', 'fake_check_reason', 'minhash', 'minhash_bands', 'duplicate_of', 'analysis_status', 'analysis_model'
+                ), articles)
+                copy_rows(cur, 'news_analysis', (
+                    'article_id', 'collected_at', 'sentiment', 'bias_score', 'credibility_score', 'manipulation_detected', 'summary', 'keywords'
+                ), analyses)
+                copy_rows(cur, 'analysis_jobs', ('article_id', 'country_code', 'created_at', 'collected_at'), jobs)
+            conn.commit()
+            loaded += len(articles)
+            print(f'Loaded {loaded}/{rows} articles ({loaded / (time.monotonic() - started):.0f}/s)')
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT setval('news_articles_id_seq', (SELECT MAX(id) FROM news_articles))")
+            cur.execute("SELECT setval('news_analysis_id_seq', (SELECT MAX(id) FROM news_analysis))")
+        conn.commit()
+
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE news_articles")
+            cur.execute("ANALYZE news_analysis")
+            cur.execute("ANALYZE analysis_jobs")
+    finally:
+        conn.close()
+
+    analyzer.rebuild_country_stats(database_url)
+    return {'rows': loaded, 'seconds': round(time.monotonic() - started, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a synthetic news corpus into a local Postgres')
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--rows', type=int, default=1000, help='articles to load (1k..10M)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--days', type=int, default=30, help='publication window')
+    parser.add_argument('--analyzed', type=float, default=0.8, help='share of articles that already have an analysis')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--off-topic-rate', type=float, default=0.3)
+    parser.add_argument('--chunk', type=int, default=50000, help='rows per country per COPY batch')
+    parser.add_argument('--no-minhash', action='store_true', help='skip MinHash signatures (much faster for 1M+ rows)')
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations to an empty database first')
+    args = parser.parse_args()
+
+    if args.migrate:
+        import psycopg2
+        conn = psycopg2.connect(args.database_url)
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
+
+    result = load_corpus(
+        args.database_url, args.rows, seed=args.seed, days=args.days, analyzed=args.analyzed,
+        duplicate_rate=args.duplicate_rate, off_topic_rate=args.off_topic_rate,
+        chunk=args.chunk, with_minhash=not args.no_minhash
+    )
+    print(f"Loaded {result['rows']} articles in {result['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
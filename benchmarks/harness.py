@@ -0,0 +1,158 @@
+import importlib.util
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+
+_loaded = {}
+
+
+def load_function(name):
+    """Свежий экземпляр модуля облачной функции backend/<name>/index.py (как холодный старт)"""
+    previous = _loaded.pop(name, None)
+    if previous is not None:
+        close_function(previous)
+
+    spec = importlib.util.spec_from_file_location(f'bench_{name.replace("-", "_")}', BACKEND / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _loaded[name] = module
+    return module
+
+
+def close_function(module):
+    """Закрывает пул соединений модуля, чтобы не копить соединения между сценариями"""
+    pool = getattr(module, '_db_pool', None)
+    if pool is not None and not pool.closed:
+        pool.closeall()
+
+
+class Context:
+    """Контекст вызова с оставшимся временем, как у облачной функции"""
+
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class QueryCounter:
+    """Счётчик SQL-запросов всех соединений процесса"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount=1):
+        with self.lock:
+            self.count += amount
+
+    def take(self):
+        with self.lock:
+            count, self.count = self.count, 0
+            return count
+
+
+query_counter = QueryCounter()
+_cursor_classes = {}
+
+
+def counting_cursor(base):
+    """Подкласс курсора base, который считает execute/executemany/copy_*"""
+    if base not in _cursor_classes:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                query_counter.add()
+                return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                query_counter.add()
+                return super().executemany(query, vars_list)
+
+            def copy_expert(self, sql, file, size=8192):
+                query_counter.add()
+                return super().copy_expert(sql, file, size)
+
+        _cursor_classes[base] = CountingCursor
+    return _cursor_classes[base]
+
+
+_connection_classes = {}
+
+
+def counting_connection(base):
+    """Подкласс соединения base (в том числе TracedConnection функций), курсоры которого считают запросы"""
+    if base not in _connection_classes:
+        class CountingConnection(base):
+            def cursor(self, *args, **kwargs):
+                cursor_base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+                return super().cursor(*args, cursor_factory=counting_cursor(cursor_base), **kwargs)
+
+        _connection_classes[base] = CountingConnection
+    return _connection_classes[base]
+
+
+def install_query_counter():
+    """Все новые соединения psycopg2 (в том числе из пулов функций) считают свои запросы"""
+    if getattr(psycopg2.connect, 'counting', False):
+        return
+    original = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        kwargs['connection_factory'] = counting_connection(kwargs.get('connection_factory') or psycopg2.extensions.connection)
+        return original(*args, **kwargs)
+
+    connect.counting = True
+    psycopg2.connect = connect
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(durations):
+    """p50/p95/p99/max в миллисекундах"""
+    ms = [d * 1000 for d in durations]
+    return {
+        'p50': percentile(ms, 50),
+        'p95': percentile(ms, 95),
+        'p99': percentile(ms, 99),
+        'max': max(ms) if ms else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def git_dirty():
+    try:
+        return bool(subprocess.check_output(['git', 'status', '--porcelain', '--', 'backend', 'db_migrations'], cwd=ROOT, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+def set_env(**values):
+    """Переменные окружения функций; читаются при импорте модуля, поэтому задаются до load_function"""
+    for key, value in values.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = str(value)
@@ -0,0 +1,177 @@
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.harness import git_commit, git_dirty, install_query_counter, set_env
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.stubs import GroqStub, NewsAPIStub, StubBehavior
+
+BENCH_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCH_DIR / 'results'
+BASELINES_DIR = BENCH_DIR / 'baselines'
+
+# Метрика -> True, если больше значит лучше
+COMPARED_METRICS = {
+    'articles_per_sec': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'queries_per_invocation': False
+}
+
+
+def metric(report, path):
+    value = report
+    for part in path.split('.'):
+        value = (value or {}).get(part)
+    return value
+
+
+def compare(current, baseline, tolerance):
+    """Сравнение отчёта с базовым: [(сценарий, метрика, было, стало, изменение, регрессия)]"""
+    rows = []
+    for name, report in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            before, after = metric(base, path), metric(report, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append((name, path, before, after, change, regressed))
+    return rows
+
+
+def print_report(report):
+    print(f"\nCommit {report['commit']}{' (dirty)' if report['dirty'] else ''}")
+    print(f"{'scenario':<12} {'calls':>6} {'err':>4} {'articles':>9} {'art/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'q/call':>7}")
+    for name, result in report['scenarios'].items():
+        latency = result['latency_ms']
+        print(
+            f"{name:<12} {result['invocations']:>6} {result['errors']:>4} {result['articles']:>9} "
+            f"{result['articles_per_sec'] if result['articles_per_sec'] is not None else '-':>9} "
+            f"{latency['p50'] if latency['p50'] is not None else '-':>9} "
+            f"{latency['p95'] if latency['p95'] is not None else '-':>9} "
+            f"{latency['p99'] if latency['p99'] is not None else '-':>9} "
+            f"{result['queries_per_invocation'] if result['queries_per_invocation'] is not None else '-':>7}"
+        )
+
+
+def print_comparison(rows, baseline):
+    print(f"\nAgainst baseline {baseline['commit']} ({baseline['timestamp']}):")
+    for name, path, before, after, change, regressed in rows:
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {name:<12} {path:<24} {before:>10} -> {after:<10} {change:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for news-collector and analyze-news')
+    parser.add_argument('--database-url', required=True, help='local Postgres reserved for benchmarks')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30, help='simulated function timeout, seconds')
+    parser.add_argument('--pages', type=int, default=5, help='pages per country in read scenarios')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=0, help='load a synthetic corpus of this size first')
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations to an empty database first')
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--newsapi-articles', type=int, default=100, help='articles per query on the first poll')
+    parser.add_argument('--newsapi-grow', type=int, default=20, help='new articles per query on every later poll')
+    parser.add_argument('--newsapi-latency-ms', type=float, default=50)
+    parser.add_argument('--newsapi-error-rate', type=float, default=0.0)
+    parser.add_argument('--newsapi-rpm', type=int, default=0, help='429 above this many requests per minute (0 = off)')
+    parser.add_argument('--groq-latency-ms', type=float, default=300)
+    parser.add_argument('--groq-tokens-per-second', type=float, default=0, help='extra latency per completion token')
+    parser.add_argument('--groq-error-rate', type=float, default=0.0)
+    parser.add_argument('--groq-malformed-rate', type=float, default=0.0)
+    parser.add_argument('--groq-rpm', type=int, default=0, help='429 above this many requests per minute (0 = off)')
+    parser.add_argument('--client-rpm', type=int, default=0, help='GROQ_RPM for the functions (0 = no client throttling)')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra function environment')
+
+    parser.add_argument('--save-baseline', metavar='NAME', help=f'also store the report as {BASELINES_DIR.name}/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    install_query_counter()
+
+    if args.migrate or args.rows:
+        from benchmarks.corpus import apply_migrations, load_corpus
+        import psycopg2
+        if args.migrate:
+            conn = psycopg2.connect(args.database_url)
+            try:
+                apply_migrations(conn)
+            finally:
+                conn.close()
+        if args.rows:
+            print(f"Corpus: {load_corpus(args.database_url, args.rows, seed=args.seed)}")
+
+    newsapi = NewsAPIStub(
+        articles=args.newsapi_articles, grow=args.newsapi_grow, seed=args.seed,
+        behavior=StubBehavior(args.newsapi_latency_ms, args.newsapi_latency_ms / 5, args.newsapi_error_rate, args.newsapi_rpm, args.seed)
+    )
+    groq = GroqStub(
+        tokens_per_second=args.groq_tokens_per_second, malformed_rate=args.groq_malformed_rate,
+        behavior=StubBehavior(args.groq_latency_ms, args.groq_latency_ms / 5, args.groq_error_rate, args.groq_rpm, args.seed)
+    )
+
+    with newsapi, groq:
+        set_env(
+            DATABASE_URL=args.database_url,
+            NEWS_API_KEY='bench',
+            GROQ_API_KEY='bench',
+            NEWSAPI_URL=f'{newsapi.url}/v2/everything',
+            GROQ_BASE_URL=groq.url,
+            GROQ_RPM=args.client_rpm
+        )
+        set_env(**dict(item.split('=', 1) for item in args.env))
+
+        scenarios = {}
+        for name in names:
+            print(f'Running {name}...')
+            scenarios[name] = SCENARIOS[name](args)
+        stubs = {'newsapi': newsapi.stats(), 'groq': groq.stats()}
+
+    report = {
+        'commit': git_commit(),
+        'dirty': git_dirty(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('database_url', 'save_baseline', 'compare')},
+        'scenarios': scenarios,
+        'stubs': stubs
+    }
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{report['commit']}{'-dirty' if report['dirty'] else ''}-{time.strftime('%Y%m%d%H%M%S')}.json"
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    print_report(report)
+    print(f'\nStubs: {stubs}')
+    print(f'Report: {path}')
+
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        baseline_path = BASELINES_DIR / f'{args.save_baseline}.json'
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f'Baseline: {baseline_path}')
+
+    if args.compare:
+        baseline = json.loads((BASELINES_DIR / f'{args.compare}.json').read_text(encoding='utf-8'))
+        rows = compare(report, baseline, args.tolerance)
+        print_comparison(rows, baseline)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import base64
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from benchmarks.corpus import generate_articles
+from benchmarks.harness import Context, latency_summary, load_function, query_counter
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+class Recorder:
+    """Замеры одного сценария: длительность, ответ и число SQL-запросов каждого вызова"""
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.queries = []
+        self.errors = 0
+        self.articles = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        query_counter.take()
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.durations.append(time.perf_counter() - started)
+        self.queries.append(query_counter.take())
+        if isinstance(result, dict) and result.get('statusCode', 200) >= 400:
+            self.errors += 1
+        return result
+
+    def invoke(self, module, method, params, headers=None, timeout=30):
+        """Вызов handler облачной функции с событием как от API Gateway"""
+        event = {'httpMethod': method, 'queryStringParameters': params, 'headers': headers or {}}
+        response = self.call(module.handler, event, Context(timeout))
+        if response['statusCode'] == 200 and response['body']:
+            return response, json.loads(self.decode(response))
+        return response, None
+
+    def decode(self, response):
+        """Тело ответа как его получит клиент: base64 и Content-Encoding снимаются, размер учитывается до распаковки"""
+        body = response['body']
+        if not response.get('isBase64Encoded'):
+            self.bytes += len(body.encode('utf-8'))
+            return body
+        data = base64.b64decode(body)
+        self.bytes += len(data)
+        encoding = response['headers'].get('Content-Encoding')
+        if encoding == 'gzip':
+            return gzip.decompress(data)
+        if encoding == 'br':
+            import brotli
+            return brotli.decompress(data)
+        return data
+
+    def report(self):
+        seconds = time.monotonic() - self.started
+        handler_seconds = sum(self.durations)
+        return {
+            'invocations': len(self.durations),
+            'errors': self.errors,
+            'articles': self.articles,
+            'seconds': round(seconds, 3),
+            'bytes': self.bytes,
+            'bytes_per_article': round(self.bytes / self.articles, 1) if self.articles else None,
+            'articles_per_sec': round(self.articles / handler_seconds, 2) if self.articles and handler_seconds else None,
+            'latency_ms': {key: round(value, 2) if value is not None else None for key, value in latency_summary(self.durations).items()},
+            'queries': sum(self.queries),
+            'queries_per_invocation': round(sum(self.queries) / len(self.queries), 2) if self.queries else None
+        }
+
+
+def count_articles(database_url):
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM news_articles")
+            count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+def countries(database_url):
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT code FROM countries ORDER BY code")
+            codes = [code for (code,) in cur.fetchall()]
+    conn.close()
+    return codes
+
+
+@scenario('collect')
+def collect(config):
+    """POST news-collector country=ALL: лента заглушки NewsAPI растёт между вызовами, articles — вставленные строки"""
+    collector = load_function('news-collector')
+    recorder = Recorder('collect')
+    for _ in range(config.iterations):
+        before = count_articles(config.database_url)
+        recorder.invoke(collector, 'POST', {'country': 'ALL', 'limit': '1'}, timeout=config.timeout)
+        recorder.articles += count_articles(config.database_url) - before
+    return recorder.report()
+
+
+@scenario('analyze')
+def analyze(config):
+    """POST analyze-news country=ALL до опустошения очереди или config.iterations вызовов"""
+    analyzer = load_function('analyze-news')
+    recorder = Recorder('analyze')
+    for _ in range(config.iterations):
+        _, body = recorder.invoke(analyzer, 'POST', {'country': 'ALL'}, timeout=config.timeout)
+        if body is None:
+            continue
+        recorder.articles += body['analyzed']
+        if not body['remaining_backlog']:
+            break
+    return recorder.report()
+
+
+@scenario('statistics')
+def statistics(config):
+    """calculate_statistics по каждой стране (handler считает её только после анализа, поэтому вызываем напрямую)"""
+    analyzer = load_function('analyze-news')
+    recorder = Recorder('statistics')
+    codes = countries(config.database_url)
+    for _ in range(config.iterations):
+        for code in codes:
+            recorder.call(analyzer.calculate_statistics, config.database_url, code)
+    return recorder.report()
+
+
+@scenario('history')
+def history(config):
+    """GET analyze-news action=history по каждой стране"""
+    analyzer = load_function('analyze-news')
+    recorder = Recorder('history')
+    for _ in range(config.iterations):
+        for code in countries(config.database_url):
+            recorder.invoke(analyzer, 'GET', {'action': 'history', 'country': code})
+    return recorder.report()
+
+
+def read_pages(recorder, collector, code, config, before_request=None, extra_params=None, headers=None):
+    cursor = None
+    for _ in range(config.pages):
+        params = {'country': code, 'limit': str(config.page_size), **(extra_params or {})}
+        if cursor:
+            params['cursor'] = cursor
+        if before_request:
+            before_request()
+        _, body = recorder.invoke(collector, 'GET', params, headers)
+        if body is None:
+            break
+        recorder.articles += body['count']
+        cursor = body['nextCursor']
+        if not cursor:
+            break
+
+
+@scenario('read_cold')
+def read_cold(config):
+    """GET news-collector с keyset-пагинацией, кеш ответов сбрасывается перед каждым запросом"""
+    collector = load_function('news-collector')
+    recorder = Recorder('read_cold')
+
+    def reset_cache():
+        collector.response_cache = collector.ResponseCache()
+
+    for _ in range(config.iterations):
+        for code in countries(config.database_url):
+            read_pages(recorder, collector, code, config, reset_cache)
+    return recorder.report()
+
+
+@scenario('read_warm')
+def read_warm(config):
+    """Те же страницы после прогрева: ответы из кеша процесса и 304 по If-None-Match"""
+    collector = load_function('news-collector')
+    codes = countries(config.database_url)
+    for code in codes:
+        read_pages(Recorder('warmup'), collector, code, config)
+
+    recorder = Recorder('read_warm')
+    for _ in range(config.iterations):
+        for code in codes:
+            read_pages(recorder, collector, code, config)
+            response, _ = recorder.invoke(collector, 'GET', {'country': code, 'limit': str(config.page_size)})
+            etag = response['headers'].get('ETag')
+            if etag:
+                recorder.invoke(collector, 'GET', {'country': code, 'limit': str(config.page_size)}, {'If-None-Match': etag})
+    return recorder.report()
+
+
+@scenario('read_encoded')
+def read_encoded(config):
+    """Холодное чтение с format=columns и сжатием gzip: сравнивается с read_cold по bytes_per_article"""
+    collector = load_function('news-collector')
+    recorder = Recorder('read_encoded')
+
+    def reset_cache():
+        collector.response_cache = collector.ResponseCache()
+
+    for _ in range(config.iterations):
+        for code in countries(config.database_url):
+            read_pages(recorder, collector, code, config, reset_cache, {'format': 'columns'}, {'Accept-Encoding': 'gzip'})
+    return recorder.report()
+
+
+@scenario('search')
+def search(config):
+    """GET news-collector action=search: полнотекстовый запрос, ключевые слова и фильтры по всем странам"""
+    collector = load_function('news-collector')
+    recorder = Recorder('search')
+    queries = [
+        {'q': 'election'},
+        {'q': 'press freedom', 'country': 'RU'},
+        {'q': 'sanctions -football', 'manipulation': 'true'},
+        {'keywords': 'выборы'},
+        {'keywords': 'санкции,суд', 'fake': 'false'}
+    ]
+    for _ in range(config.iterations):
+        for query in queries:
+            cursor = None
+            for _ in range(config.pages):
+                params = dict(query, action='search', limit=str(config.page_size))
+                if cursor:
+                    params['cursor'] = cursor
+                _, body = recorder.invoke(collector, 'GET', params)
+                if body is None:
+                    break
+                recorder.articles += body['count']
+                cursor = body['nextCursor']
+                if not cursor:
+                    break
+    return recorder.report()
+
+
+@scenario('scores')
+def scores(config):
+    """Пересчёт индексов стран (как python index.py recompute-scores) и GET action=map (вся карта одним запросом)"""
+    analyzer = load_function('analyze-news')
+    recorder = Recorder('scores')
+    for _ in range(config.iterations):
+        recorder.call(analyzer.recompute_country_scores, config.database_url)
+        recorder.invoke(analyzer, 'GET', {'action': 'map'})
+    return recorder.report()
+
+
+@scenario('backfill')
+def backfill(config):
+    """
+    Импорт дампа JSONL бэкфиллом news-collector: 2000 синтетических статей на итерацию. Разбор в текущем процессе —
+    модуль функции загружен по пути файла, и процессы пула не смогли бы его импортировать
+    """
+    collector = load_function('news-collector')
+    recorder = Recorder('backfill')
+    codes = countries(config.database_url)
+    with tempfile.TemporaryDirectory() as directory:
+        for iteration in range(config.iterations):
+            path = os.path.join(directory, f'dump{iteration}.jsonl')
+            published = datetime.now() - timedelta(days=365)
+            with open(path, 'w', encoding='utf-8') as dump:
+                for index, article in enumerate(generate_articles('Backfill', 2000, seed=int(time.time()), duplicate_rate=0.1)):
+                    article['publishedAt'] = (published + timedelta(hours=4 * index)).strftime('%Y-%m-%dT%H:%M:%SZ')
+                    article['country_code'] = codes[index % len(codes)]
+                    dump.write(json.dumps(article) + '\n')
+            totals = recorder.call(
+                collector.backfill, config.database_url, [path], workers=0,
+                checkpoint_path=os.path.join(directory, 'checkpoint.json'), restart=True
+            )
+            recorder.articles += totals['inserted']
+    return recorder.report()
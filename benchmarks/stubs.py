@@ -0,0 +1,274 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.corpus import generate_articles
+
+
+class StubBehavior:
+    """Задержка, доля ошибок и лимит запросов в минуту (429) заглушки"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit_rpm=0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.random = random.Random(seed)
+        self.window = deque()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+
+    def admit(self):
+        """Решение по запросу: 'ok', 'error' или 'rate_limited'; задержка выдерживается здесь же"""
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency_ms + self.random.uniform(0, self.jitter_ms)
+            failing = self.random.random() < self.error_rate
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 60:
+                self.window.popleft()
+            limited = bool(self.rate_limit_rpm) and len(self.window) >= self.rate_limit_rpm
+            if not limited:
+                self.window.append(now)
+        time.sleep(delay / 1000)
+
+        with self.lock:
+            if limited:
+                self.stats['rate_limited'] += 1
+                return 'rate_limited'
+            if failing:
+                self.stats['errors'] += 1
+                return 'error'
+            return 'ok'
+
+
+class StubServer:
+    """HTTP-сервер заглушки на 127.0.0.1 в фоновом потоке"""
+
+    def __init__(self, handler_class, behavior):
+        self.behavior = behavior
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.behavior.lock:
+            return dict(self.behavior.stats)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NewsAPIHandler(StubHandler):
+    """GET /v2/everything: лента синтетических статей по запросу q, новые сверху, с учётом from, to и page"""
+
+    def do_GET(self):
+        stub = self.server.stub
+        parsed = urlparse(self.path)
+        if parsed.path != '/v2/everything':
+            return self.send_json(404, {'status': 'error', 'code': 'notFound', 'message': 'Unknown endpoint'})
+
+        decision = stub.behavior.admit()
+        if decision == 'rate_limited':
+            return self.send_json(429, {'status': 'error', 'code': 'rateLimited', 'message': 'Too many requests'})
+        if decision == 'error':
+            return self.send_json(500, {'status': 'error', 'code': 'unexpectedError', 'message': 'Stub failure'})
+
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        page = int(params.get('page', '1'))
+        page_size = int(params.get('pageSize', '20'))
+        feed = stub.feed(params.get('q', ''), grow=page == 1)
+        if params.get('from'):
+            since = datetime.fromisoformat(params['from'].replace('Z', '+00:00'))
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            feed = [article for article in feed if datetime.fromisoformat(article['publishedAt'].replace('Z', '+00:00')) > since]
+        if params.get('to'):
+            until = datetime.fromisoformat(params['to'].replace('Z', '+00:00'))
+            if until.tzinfo is None:
+                until = until.replace(tzinfo=timezone.utc)
+            feed = [article for article in feed if datetime.fromisoformat(article['publishedAt'].replace('Z', '+00:00')) <= until]
+
+        start = (page - 1) * page_size
+        self.send_json(200, {
+            'status': 'ok',
+            'totalResults': len(feed),
+            'articles': feed[start:start + page_size]
+        })
+
+
+class NewsAPIStub(StubServer):
+    """Заглушка NewsAPI: articles статей на запрос, лента растёт на grow при каждом запросе первой страницы"""
+
+    def __init__(self, articles=100, grow=0, duplicate_rate=0.1, off_topic_rate=0.3, behavior=None, seed=0):
+        super().__init__(NewsAPIHandler, behavior or StubBehavior(seed=seed))
+        self.articles = articles
+        self.grow = grow
+        self.duplicate_rate = duplicate_rate
+        self.off_topic_rate = off_topic_rate
+        self.seed = seed
+        self.started_at = datetime.now(timezone.utc).replace(microsecond=0)
+        self.polls = {}
+        self.lock = threading.Lock()
+
+    def feed(self, query, grow=False):
+        """Лента запроса: детерминированна по (seed, q), свежие статьи дописываются поверх старых"""
+        with self.lock:
+            polls = self.polls.get(query, 0)
+            if grow:
+                self.polls[query] = polls + 1
+        size = self.articles + self.grow * polls
+        query_seed = int(hashlib.sha256(f'{self.seed}|{query}'.encode('utf-8')).hexdigest()[:8], 16)
+        articles = list(generate_articles(
+            query, size, seed=query_seed,
+            duplicate_rate=self.duplicate_rate, off_topic_rate=self.off_topic_rate
+        ))
+        # Статья i опубликована на i минут раньше самой свежей; новые статьи получают время позже старта
+        newest = self.started_at + timedelta(minutes=self.grow * polls)
+        for i, article in enumerate(articles):
+            article['publishedAt'] = (newest - timedelta(minutes=size - 1 - i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        articles.reverse()
+        return articles
+
+
+class GroqHandler(StubHandler):
+    """POST /openai/v1/chat/completions: детерминированные JSON-ответы под промпты анализа"""
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if urlparse(self.path).path != '/openai/v1/chat/completions':
+            return self.send_json(404, {'error': {'message': 'Unknown endpoint', 'type': 'invalid_request_error'}})
+
+        decision = stub.behavior.admit()
+        if decision == 'rate_limited':
+            return self.send_json(
+                429,
+                {'error': {'message': 'Rate limit reached', 'type': 'tokens', 'code': 'rate_limit_exceeded'}},
+                {'retry-after': str(stub.retry_after)}
+            )
+        if decision == 'error':
+            return self.send_json(500, {'error': {'message': 'Stub failure', 'type': 'internal_server_error'}})
+
+        prompt = request['messages'][-1]['content']
+        json_mode = (request.get('response_format') or {}).get('type') == 'json_object'
+        content = stub.answer(prompt, json_mode)
+        completion_tokens = len(content) // 4
+        if stub.tokens_per_second:
+            time.sleep(completion_tokens / stub.tokens_per_second)
+
+        self.send_json(200, {
+            'id': 'chatcmpl-' + hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:24],
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': len(prompt) // 4,
+                'completion_tokens': completion_tokens,
+                'total_tokens': len(prompt) // 4 + completion_tokens
+            }
+        })
+
+
+class GroqStub(StubServer):
+    """Заглушка Groq chat completions; malformed_rate — доля ответов с невалидным JSON"""
+
+    def __init__(self, tokens_per_second=0, malformed_rate=0.0, retry_after=1, behavior=None, seed=0):
+        super().__init__(GroqHandler, behavior or StubBehavior(seed=seed))
+        self.tokens_per_second = tokens_per_second
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.stats_by_kind = {'fake': 0, 'analysis': 0, 'combined': 0}
+        self.lock = threading.Lock()
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats.update(self.stats_by_kind)
+        return stats
+
+    def answer(self, prompt, json_mode=False):
+        rnd = random.Random(prompt)
+        if prompt.startswith('Проверь на фейк и проанализируй'):
+            kind = 'combined'
+            indexes = [int(i) for i in re.findall(r'^\[(\d+)\] ', prompt, re.MULTILINE)]
+            payload = [dict(index=i, **self.fake_result(rnd), **self.analysis_result(rnd)) for i in indexes]
+            for entry in payload:
+                entry['fake_check_reason'] = entry.pop('reason')
+            if json_mode:
+                payload = {'results': payload}
+        elif prompt.startswith('Проверь новость на фейк'):
+            kind = 'fake'
+            payload = self.fake_result(rnd)
+        else:
+            kind = 'analysis'
+            payload = self.analysis_result(rnd)
+
+        with self.lock:
+            self.stats_by_kind[kind] += 1
+        if rnd.random() < self.malformed_rate:
+            return 'Вот результат анализа: ' + json.dumps(payload, ensure_ascii=False)[:-1]
+        return json.dumps(payload, ensure_ascii=False)
+
+    @staticmethod
+    def fake_result(rnd):
+        is_fake = rnd.random() < 0.1
+        return {'is_fake': is_fake, 'reason': 'Противоречит другим источникам' if is_fake else 'Подтверждается источниками'}
+
+    @staticmethod
+    def analysis_result(rnd):
+        return {
+            'sentiment': rnd.choice(['positive', 'negative', 'neutral']),
+            'bias_score': rnd.randint(0, 100),
+            'credibility_score': rnd.randint(0, 100),
+            'manipulation_detected': rnd.random() < 0.2,
+            'summary': 'Краткое содержание синтетической новости',
+            'keywords': rnd.sample(['выборы', 'парламент', 'санкции', 'протест', 'закон', 'министр', 'суд'], 3)
+        }
@@ -0,0 +1,10 @@
+-- Кеш результатов LLM по хешу нормализованного текста, модели и версии промпта
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    model VARCHAR(100) NOT NULL,
+    prompt_version VARCHAR(20) NOT NULL,
+    result JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at);
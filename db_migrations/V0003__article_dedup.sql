@@ -0,0 +1,22 @@
+-- Дедупликация новостей при сборе: точные совпадения URL/заголовка и MinHash-подписи с LSH-полосами
+
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS minhash INTEGER[];
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS minhash_bands INTEGER[];
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS duplicate_of INTEGER REFERENCES news_articles(id);
+
+-- Уже накопленные точные дубли привязываем к самой ранней копии
+UPDATE news_articles n
+SET duplicate_of = d.canonical_id
+FROM (
+    SELECT id, MIN(id) OVER (PARTITION BY country_code, url) AS canonical_id
+    FROM news_articles
+    WHERE url IS NOT NULL AND url <> ''
+) d
+WHERE n.id = d.id AND d.canonical_id <> n.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_news_country_url_unique
+    ON news_articles(country_code, url)
+    WHERE duplicate_of IS NULL AND url <> '';
+CREATE INDEX IF NOT EXISTS idx_news_title_hash ON news_articles(md5(lower(title)));
+CREATE INDEX IF NOT EXISTS idx_news_minhash_bands ON news_articles USING GIN (minhash_bands);
+CREATE INDEX IF NOT EXISTS idx_news_duplicate_of ON news_articles(duplicate_of) WHERE duplicate_of IS NOT NULL;
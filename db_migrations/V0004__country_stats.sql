@@ -0,0 +1,39 @@
+-- Инкрементальная сводка статистики по странам (суммы и счётчики для calculate_statistics)
+CREATE TABLE IF NOT EXISTS country_stats (
+    country_code VARCHAR(3) PRIMARY KEY REFERENCES countries(code),
+    total_news BIGINT NOT NULL DEFAULT 0,
+    fake_news BIGINT NOT NULL DEFAULT 0,
+    manipulation_count BIGINT NOT NULL DEFAULT 0,
+    bias_sum BIGINT NOT NULL DEFAULT 0,
+    bias_count BIGINT NOT NULL DEFAULT 0,
+    credibility_sum BIGINT NOT NULL DEFAULT 0,
+    credibility_count BIGINT NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    neutral_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Начальное заполнение из базовых таблиц
+INSERT INTO country_stats (
+    country_code, total_news, fake_news, manipulation_count,
+    bias_sum, bias_count, credibility_sum, credibility_count,
+    positive_count, negative_count, neutral_count
+)
+SELECT
+    n.country_code,
+    COUNT(*),
+    COUNT(CASE WHEN n.is_fake = true THEN 1 END),
+    COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END),
+    COALESCE(SUM(a.bias_score), 0),
+    COUNT(a.bias_score),
+    COALESCE(SUM(a.credibility_score), 0),
+    COUNT(a.credibility_score),
+    COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END),
+    COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END),
+    COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END)
+FROM news_articles n
+LEFT JOIN news_analysis a ON a.article_id = n.id
+WHERE n.country_code IS NOT NULL
+GROUP BY n.country_code
+ON CONFLICT (country_code) DO NOTHING;
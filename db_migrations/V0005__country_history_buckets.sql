@@ -0,0 +1,16 @@
+-- Временные корзины истории показателей стран (час / день / неделя)
+
+ALTER TABLE country_history ADD COLUMN IF NOT EXISTS bucket VARCHAR(10);
+ALTER TABLE country_history ADD COLUMN IF NOT EXISTS bucket_start TIMESTAMP;
+ALTER TABLE country_history ADD COLUMN IF NOT EXISTS samples INTEGER NOT NULL DEFAULT 1;
+
+-- Средние по корзине храним с одним знаком после запятой, как их считает calculate_statistics
+ALTER TABLE country_history ALTER COLUMN democracy_score TYPE NUMERIC(5,1);
+ALTER TABLE country_history ALTER COLUMN freedom_score TYPE NUMERIC(5,1);
+ALTER TABLE country_history ALTER COLUMN authoritarian_score TYPE NUMERIC(5,1);
+ALTER TABLE country_history ALTER COLUMN press_freedom_score TYPE NUMERIC(5,1);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_history_bucket
+    ON country_history(country_code, bucket, bucket_start);
+CREATE INDEX IF NOT EXISTS idx_history_bucket_start
+    ON country_history(bucket, bucket_start);
@@ -0,0 +1,10 @@
+-- Составной индекс под выборку новостей страны с keyset-пагинацией по (published_at, id)
+
+-- Ключ пагинации не должен содержать NULL
+UPDATE news_articles SET published_at = collected_at WHERE published_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_news_country_published_id
+    ON news_articles(country_code, published_at DESC, id DESC);
+
+-- Покрывается префиксом составного индекса
+DROP INDEX IF EXISTS idx_news_country;
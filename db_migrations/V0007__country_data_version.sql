@@ -0,0 +1,7 @@
+-- Версия данных страны для инвалидации кеша ответов news-collector:
+-- увеличивается каждой транзакцией, меняющей новости или анализы страны
+ALTER TABLE country_stats ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
+
+INSERT INTO country_stats (country_code)
+SELECT code FROM countries
+ON CONFLICT (country_code) DO NOTHING;
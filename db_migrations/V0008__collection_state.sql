@@ -0,0 +1,13 @@
+-- Отметка последнего полученного publishedAt по стране для инкрементального сбора из NewsAPI
+CREATE TABLE IF NOT EXISTS collection_state (
+    country_code VARCHAR(3) PRIMARY KEY REFERENCES countries(code),
+    last_published_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO collection_state (country_code, last_published_at)
+SELECT country_code, MAX(published_at)
+FROM news_articles
+WHERE country_code IS NOT NULL
+GROUP BY country_code
+ON CONFLICT (country_code) DO NOTHING;
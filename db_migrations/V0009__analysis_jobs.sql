@@ -0,0 +1,67 @@
+-- Очередь задач анализа: захват через FOR UPDATE SKIP LOCKED, аренда с истечением, попытки и dead-letter
+
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    article_id INTEGER PRIMARY KEY REFERENCES news_articles(id),
+    country_code VARCHAR(3),
+    status VARCHAR(10) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'leased', 'done', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_claim
+    ON analysis_jobs(country_code, created_at)
+    WHERE status IN ('queued', 'leased');
+
+-- Один анализ на новость: оставляем самый поздний
+DELETE FROM news_analysis a
+USING news_analysis b
+WHERE a.article_id = b.article_id AND a.id < b.id;
+
+ALTER TABLE news_analysis ADD CONSTRAINT news_analysis_article_id_key UNIQUE (article_id);
+DROP INDEX IF EXISTS idx_analysis_article;
+
+-- Сводка считала повторные анализы, пересчитываем её
+UPDATE country_stats s
+SET total_news = COALESCE(r.total_news, 0),
+    fake_news = COALESCE(r.fake_news, 0),
+    manipulation_count = COALESCE(r.manipulation_count, 0),
+    bias_sum = COALESCE(r.bias_sum, 0),
+    bias_count = COALESCE(r.bias_count, 0),
+    credibility_sum = COALESCE(r.credibility_sum, 0),
+    credibility_count = COALESCE(r.credibility_count, 0),
+    positive_count = COALESCE(r.positive_count, 0),
+    negative_count = COALESCE(r.negative_count, 0),
+    neutral_count = COALESCE(r.neutral_count, 0),
+    updated_at = NOW(),
+    data_version = s.data_version + 1
+FROM countries c
+LEFT JOIN (
+    SELECT
+        n.country_code,
+        COUNT(*) AS total_news,
+        COUNT(CASE WHEN n.is_fake = true THEN 1 END) AS fake_news,
+        COUNT(CASE WHEN a.manipulation_detected = true THEN 1 END) AS manipulation_count,
+        COALESCE(SUM(a.bias_score), 0) AS bias_sum,
+        COUNT(a.bias_score) AS bias_count,
+        COALESCE(SUM(a.credibility_score), 0) AS credibility_sum,
+        COUNT(a.credibility_score) AS credibility_count,
+        COUNT(CASE WHEN a.sentiment = 'positive' THEN 1 END) AS positive_count,
+        COUNT(CASE WHEN a.sentiment = 'negative' THEN 1 END) AS negative_count,
+        COUNT(CASE WHEN a.sentiment = 'neutral' THEN 1 END) AS neutral_count
+    FROM news_articles n
+    LEFT JOIN news_analysis a ON a.article_id = n.id
+    WHERE n.country_code IS NOT NULL
+    GROUP BY n.country_code
+) r ON r.country_code = c.code
+WHERE s.country_code = c.code;
+
+-- Ставим в очередь уже собранные, но не проанализированные новости
+INSERT INTO analysis_jobs (article_id, country_code, created_at)
+SELECT n.id, n.country_code, n.collected_at
+FROM news_articles n
+LEFT JOIN news_analysis a ON a.article_id = n.id
+WHERE a.id IS NULL AND n.duplicate_of IS NULL
+ON CONFLICT (article_id) DO NOTHING;
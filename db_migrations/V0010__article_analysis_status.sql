@@ -0,0 +1,22 @@
+-- Явный статус анализа новости и версия модели, которой она проанализирована
+
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS analysis_status VARCHAR(12) NOT NULL DEFAULT 'pending'
+    CHECK (analysis_status IN ('pending', 'in_progress', 'done', 'failed'));
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS analysis_model VARCHAR(100);
+
+UPDATE news_articles n
+SET analysis_status = 'done'
+WHERE EXISTS (SELECT 1 FROM news_analysis a WHERE a.article_id = n.id);
+
+UPDATE news_articles n
+SET analysis_status = CASE j.status WHEN 'dead' THEN 'failed' WHEN 'leased' THEN 'in_progress' ELSE n.analysis_status END
+FROM analysis_jobs j
+WHERE j.article_id = n.id AND j.status IN ('dead', 'leased');
+
+-- Поиск очередной пачки и глубина бэклога стоят пропорционально бэклогу, а не архиву
+CREATE INDEX IF NOT EXISTS idx_news_pending
+    ON news_articles(country_code, collected_at)
+    WHERE analysis_status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_news_unfinished
+    ON news_articles(country_code, analysis_status)
+    WHERE analysis_status <> 'done';
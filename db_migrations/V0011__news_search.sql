@@ -0,0 +1,16 @@
+-- Полнотекстовый поиск: генерируемые tsvector по заголовку/тексту и саммари анализа, GIN по ключевым словам
+-- Добавление STORED-колонок переписывает таблицы, на больших архивах миграцию лучше катить в окно обслуживания
+
+ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED;
+
+-- Саммари пишет LLM по русскому промпту
+ALTER TABLE news_analysis ADD COLUMN IF NOT EXISTS summary_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', coalesce(summary, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_news_search ON news_articles USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_analysis_summary_search ON news_analysis USING GIN (summary_vector);
+CREATE INDEX IF NOT EXISTS idx_analysis_keywords ON news_analysis USING GIN (keywords);
@@ -0,0 +1,28 @@
+-- Частоты ключевых слов анализов по стране и временной корзине (час / день), обновляются инкрементально при записи анализов
+
+CREATE TABLE IF NOT EXISTS keyword_counts (
+    country_code VARCHAR(3) NOT NULL,
+    bucket VARCHAR(4) NOT NULL CHECK (bucket IN ('hour', 'day')),
+    bucket_start TIMESTAMP NOT NULL,
+    keyword VARCHAR(100) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (country_code, bucket, bucket_start, keyword)
+);
+
+CREATE INDEX IF NOT EXISTS idx_keyword_counts_bucket_start
+    ON keyword_counts(bucket, bucket_start);
+
+-- Заполнение по уже накопленным анализам
+INSERT INTO keyword_counts (country_code, bucket, bucket_start, keyword, count)
+SELECT n.country_code, b.bucket, date_trunc(b.bucket, COALESCE(n.published_at, n.collected_at)), k.keyword, COUNT(*)
+FROM news_articles n
+JOIN news_analysis a ON a.article_id = n.id
+CROSS JOIN LATERAL (
+    SELECT DISTINCT left(lower(btrim(kw)), 100) AS keyword
+    FROM unnest(a.keywords) AS kw
+    WHERE btrim(kw) <> ''
+) k
+CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+WHERE n.country_code IS NOT NULL AND COALESCE(n.published_at, n.collected_at) IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (country_code, bucket, bucket_start, keyword) DO NOTHING;
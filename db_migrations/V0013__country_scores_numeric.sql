@@ -0,0 +1,5 @@
+-- Индексы стран пересчитываются из сводки с одним знаком после запятой, как в country_history
+
+ALTER TABLE countries ALTER COLUMN democracy_score TYPE NUMERIC(5,1);
+ALTER TABLE countries ALTER COLUMN freedom_score TYPE NUMERIC(5,1);
+ALTER TABLE countries ALTER COLUMN press_freedom_score TYPE NUMERIC(5,1);
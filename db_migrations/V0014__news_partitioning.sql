@@ -0,0 +1,173 @@
+-- Помесячное секционирование news_articles и news_analysis по collected_at и сводка по удаляемым месяцам
+-- Таблицы пересоздаются с копированием данных, на больших архивах миграцию лучше катить в окно обслуживания
+--
+-- Ограничения секционирования: первичный и уникальные ключи включают collected_at, поэтому
+-- news_analysis получает копию collected_at своей новости, внешний ключ анализа становится составным,
+-- уникальность (country_code, url) соблюдается в пределах месяца, а ссылки analysis_jobs.article_id
+-- и duplicate_of на секционированную таблицу больше не проверяются внешними ключами.
+-- Вложенное деление месяцев по стране несовместимо с уникальностью (id, collected_at), на которую ссылается
+-- news_analysis, поэтому страна отбирается индексом (country_code, published_at, id) внутри секции месяца
+
+-- Сводка по месяцам, секции которых удалены или отсоединены политикой хранения:
+-- rebuild_country_stats складывает её с живыми данными
+CREATE TABLE IF NOT EXISTS news_archive_stats (
+    country_code VARCHAR(3) NOT NULL,
+    month DATE NOT NULL,
+    total_news BIGINT NOT NULL DEFAULT 0,
+    fake_news BIGINT NOT NULL DEFAULT 0,
+    manipulation_count BIGINT NOT NULL DEFAULT 0,
+    bias_sum BIGINT NOT NULL DEFAULT 0,
+    bias_count BIGINT NOT NULL DEFAULT 0,
+    credibility_sum BIGINT NOT NULL DEFAULT 0,
+    credibility_count BIGINT NOT NULL DEFAULT 0,
+    positive_count BIGINT NOT NULL DEFAULT 0,
+    negative_count BIGINT NOT NULL DEFAULT 0,
+    neutral_count BIGINT NOT NULL DEFAULT 0,
+    archived_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (country_code, month)
+);
+
+CREATE TABLE news_articles_partitioned (
+    id INTEGER NOT NULL DEFAULT nextval('news_articles_id_seq'),
+    country_code VARCHAR(3) REFERENCES countries(code),
+    title TEXT NOT NULL,
+    content TEXT,
+    source VARCHAR(200),
+    source_type VARCHAR(20) CHECK (source_type IN ('gov', 'opposition', 'independent', 'international')),
+    url TEXT,
+    published_at TIMESTAMP,
+    collected_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    is_verified BOOLEAN DEFAULT FALSE,
+    is_fake BOOLEAN DEFAULT NULL,
+    fake_check_reason TEXT,
+    minhash INTEGER[],
+    minhash_bands INTEGER[],
+    duplicate_of INTEGER,
+    analysis_status VARCHAR(12) NOT NULL DEFAULT 'pending'
+        CHECK (analysis_status IN ('pending', 'in_progress', 'done', 'failed')),
+    analysis_model VARCHAR(100),
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED,
+    PRIMARY KEY (id, collected_at)
+) PARTITION BY RANGE (collected_at);
+
+CREATE TABLE news_analysis_partitioned (
+    id INTEGER NOT NULL DEFAULT nextval('news_analysis_id_seq'),
+    article_id INTEGER NOT NULL,
+    collected_at TIMESTAMP NOT NULL,
+    sentiment VARCHAR(20),
+    bias_score INTEGER CHECK (bias_score >= 0 AND bias_score <= 100),
+    credibility_score INTEGER CHECK (credibility_score >= 0 AND credibility_score <= 100),
+    manipulation_detected BOOLEAN,
+    summary TEXT,
+    keywords TEXT[],
+    analyzed_at TIMESTAMP DEFAULT NOW(),
+    summary_vector tsvector GENERATED ALWAYS AS (to_tsvector('russian', coalesce(summary, ''))) STORED,
+    PRIMARY KEY (id, collected_at),
+    UNIQUE (article_id, collected_at)
+) PARTITION BY RANGE (collected_at);
+
+-- Секции месяцев first_month..last_month для обеих таблиц (уже существующие пропускаются)
+CREATE OR REPLACE FUNCTION create_news_partitions(first_month DATE, last_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', first_month);
+    articles TEXT;
+    analysis TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        articles := 'news_articles_' || to_char(month_start, '"p"YYYY_MM');
+        analysis := 'news_analysis_' || to_char(month_start, '"p"YYYY_MM');
+
+        IF to_regclass(articles) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF news_articles FOR VALUES FROM (%L) TO (%L)',
+                articles, month_start, month_start + INTERVAL '1 month'
+            );
+            -- Уникальность URL — в пределах секции: на родителе индекс обязан включать collected_at
+            EXECUTE format(
+                'CREATE UNIQUE INDEX %I ON %I (country_code, url) WHERE duplicate_of IS NULL AND url <> %L',
+                articles || '_country_url_key', articles, ''
+            );
+            created := created + 1;
+        END IF;
+
+        IF to_regclass(analysis) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF news_analysis FOR VALUES FROM (%L) TO (%L)',
+                analysis, month_start, month_start + INTERVAL '1 month'
+            );
+        END IF;
+
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос данных: функция создаёт секции по именам news_articles/news_analysis, поэтому сначала меняем таблицы местами
+ALTER TABLE news_articles RENAME TO news_articles_unpartitioned;
+ALTER TABLE news_analysis RENAME TO news_analysis_unpartitioned;
+ALTER TABLE news_articles_partitioned RENAME TO news_articles;
+ALTER TABLE news_analysis_partitioned RENAME TO news_analysis;
+
+-- Имя задано явно: политика хранения снимает ключ с отсоединённой секции анализов
+ALTER TABLE news_analysis ADD CONSTRAINT news_analysis_article_fkey
+    FOREIGN KEY (article_id, collected_at) REFERENCES news_articles(id, collected_at);
+
+SELECT create_news_partitions(
+    COALESCE((SELECT MIN(collected_at) FROM news_articles_unpartitioned), NOW())::date,
+    (NOW() + INTERVAL '3 months')::date
+);
+
+INSERT INTO news_articles (
+    id, country_code, title, content, source, source_type, url, published_at, collected_at,
+    is_verified, is_fake, fake_check_reason, minhash, minhash_bands, duplicate_of, analysis_status, analysis_model
+)
+SELECT
+    id, country_code, title, content, source, source_type, url, published_at, COALESCE(collected_at, published_at, NOW()),
+    is_verified, is_fake, fake_check_reason, minhash, minhash_bands, duplicate_of, analysis_status, analysis_model
+FROM news_articles_unpartitioned;
+
+INSERT INTO news_analysis (
+    id, article_id, collected_at, sentiment, bias_score, credibility_score, manipulation_detected, summary, keywords, analyzed_at
+)
+SELECT
+    a.id, a.article_id, n.collected_at, a.sentiment, a.bias_score, a.credibility_score, a.manipulation_detected,
+    a.summary, a.keywords, a.analyzed_at
+FROM news_analysis_unpartitioned a
+JOIN news_articles n ON n.id = a.article_id;
+
+-- Очередь анализа хранит месяц новости, чтобы захват задач обращался к одной секции
+ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS collected_at TIMESTAMP;
+ALTER TABLE analysis_jobs DROP CONSTRAINT IF EXISTS analysis_jobs_article_id_fkey;
+DELETE FROM analysis_jobs j WHERE NOT EXISTS (SELECT 1 FROM news_articles n WHERE n.id = j.article_id);
+UPDATE analysis_jobs j SET collected_at = n.collected_at FROM news_articles n WHERE n.id = j.article_id;
+ALTER TABLE analysis_jobs ALTER COLUMN collected_at SET NOT NULL;
+
+ALTER SEQUENCE news_articles_id_seq OWNED BY news_articles.id;
+ALTER SEQUENCE news_analysis_id_seq OWNED BY news_analysis.id;
+DROP TABLE news_analysis_unpartitioned;
+DROP TABLE news_articles_unpartitioned;
+ALTER TABLE news_articles RENAME CONSTRAINT news_articles_partitioned_pkey TO news_articles_pkey;
+ALTER TABLE news_analysis RENAME CONSTRAINT news_analysis_partitioned_pkey TO news_analysis_pkey;
+ALTER TABLE news_analysis RENAME CONSTRAINT news_analysis_partitioned_article_id_collected_at_key TO news_analysis_article_id_key;
+
+-- Индексы на родителе создаются на всех секциях, в том числе будущих
+CREATE INDEX IF NOT EXISTS idx_news_published ON news_articles(published_at DESC);
+CREATE INDEX IF NOT EXISTS idx_news_source_type ON news_articles(source_type);
+CREATE INDEX IF NOT EXISTS idx_news_country_published_id ON news_articles(country_code, published_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_news_title_hash ON news_articles(md5(lower(title)));
+CREATE INDEX IF NOT EXISTS idx_news_minhash_bands ON news_articles USING GIN (minhash_bands);
+CREATE INDEX IF NOT EXISTS idx_news_duplicate_of ON news_articles(duplicate_of) WHERE duplicate_of IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_news_pending ON news_articles(country_code, collected_at) WHERE analysis_status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_news_unfinished ON news_articles(country_code, analysis_status) WHERE analysis_status <> 'done';
+CREATE INDEX IF NOT EXISTS idx_news_search ON news_articles USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_analysis_summary_search ON news_analysis USING GIN (summary_vector);
+CREATE INDEX IF NOT EXISTS idx_analysis_keywords ON news_analysis USING GIN (keywords);
+
+ANALYZE news_articles;
+ANALYZE news_analysis;
@@ -0,0 +1,5 @@
+-- Частичный индекс новостей в статусе pending не читается ни одним запросом: захват задач и глубина очереди
+-- идут по analysis_jobs (там же учитываются просроченные аренды), а get_backlog фильтрует analysis_status <> 'done'
+-- и обслуживается idx_news_unfinished. Индекс только замедлял каждую вставку и смену статуса
+
+DROP INDEX IF EXISTS idx_news_pending;
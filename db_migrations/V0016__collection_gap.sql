@@ -0,0 +1,6 @@
+-- Окно NewsAPI, которое сбор ещё не пролистал: если за один вызов новых статей больше NEWSAPI_MAX_PAGES страниц,
+-- между прежней отметкой (gap_after) и самой старой полученной статьёй (gap_before) остаются пропущенные новости.
+-- Следующие вызовы дочитывают окно сверху вниз, сдвигая gap_before, и сбрасывают его, когда дошли до gap_after
+
+ALTER TABLE collection_state ADD COLUMN IF NOT EXISTS gap_after TIMESTAMP;
+ALTER TABLE collection_state ADD COLUMN IF NOT EXISTS gap_before TIMESTAMP;